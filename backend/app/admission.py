@@ -0,0 +1,185 @@
+﻿"""Admission control: per-user token buckets per route class, and a cap on requests in flight.
+
+Each request is charged to the bucket of its caller and route class: reads
+(GET and HEAD), writes (other methods) or exports (requests that start a CSV
+or bulk export). A bucket holds up to ADMISSION_BURST tokens of its class and
+refills at ADMISSION_RATE_PER_SECOND; when it is empty the request is answered
+429 with Retry-After set to when the next token arrives, so one script calling
+POST /simulate/events in a loop only ever spends its own budget.
+
+Independently, once ADMISSION_MAX_IN_FLIGHT requests are being served by this
+worker, further ones are shed with 429 before any work is done, rather than
+queueing behind the database and timing everybody out.
+
+Callers are the subject of a valid bearer token, otherwise the client address.
+Logging in (POST /oauth/token) is its own class, not limited unless it is
+given a rate: everyone behind one address (a hospital's NAT, or a proxy whose
+forwarded headers are not trusted) shares an address bucket, and must not
+lock each other out of getting a token. Buckets are kept per worker, like
+metrics, and only touched from the event loop, so they need no lock.
+"""
+import heapq
+import math
+import time
+from typing import Callable, Mapping, Optional
+
+from fastapi import FastAPI, HTTPException
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.auth import verify_token
+from app.config import settings
+from app.metrics import ADMISSION_REJECTED
+
+
+READ, WRITE, EXPORT, LOGIN = "read", "write", "export", "login"
+# Requests that start an export; polling a job and downloading its files are reads.
+EXPORT_ROUTES = {("POST", "/export/csv"), ("GET", "/$export"), ("GET", "/Patient/$export")}
+LOGIN_ROUTES = {("POST", "/oauth/token")}
+# Probes, metrics and docs are never limited.
+EXEMPT_PATHS = ("/health", "/metrics", "/docs", "/redoc", "/openapi.json")
+# Long-lived streams take a read token to connect but do not hold an in-flight slot.
+STREAM_PATHS = {"/Observation/stream"}
+# Past this many buckets, the ones that have refilled completely (idle callers) are dropped, and if that is
+# not enough to get back to half, the least recently used ones.
+MAX_BUCKETS = 10000
+
+
+def route_class(method: str, path: str) -> str:
+    if (method, path) in EXPORT_ROUTES:
+        return EXPORT
+    if (method, path) in LOGIN_ROUTES:
+        return LOGIN
+    return READ if method in ("GET", "HEAD") else WRITE
+
+
+def is_exempt(path: str) -> bool:
+    return any(path == prefix or path.startswith(prefix + "/") for prefix in EXEMPT_PATHS)
+
+
+class TokenBucket:
+    """``capacity`` tokens, refilled continuously at ``rate`` per second."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        """Take a token and return 0, or return the seconds until one is available."""
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware answering 429 (with Retry-After) to callers over their rate or when overloaded."""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        rates: Mapping[str, float],
+        bursts: Mapping[str, int],
+        max_in_flight: int = 0,
+        shed_retry_after: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.app = app
+        # Classes without a positive rate are not limited.
+        self.limits = {name: (rate, max(1, bursts.get(name, 1))) for name, rate in rates.items() if rate > 0}
+        self.max_in_flight = max_in_flight
+        self.shed_retry_after = shed_retry_after
+        self.clock = clock
+        self.buckets: dict[tuple[str, str], TokenBucket] = {}
+        self.in_flight = 0
+
+    def wait(self, caller: str, klass: str) -> float:
+        """Seconds ``caller`` must wait before a request of ``klass`` is admitted (0: admitted now)."""
+        if klass not in self.limits:
+            return 0.0
+        now = self.clock()
+        bucket = self.buckets.get((caller, klass))
+        if bucket is None:
+            if len(self.buckets) >= MAX_BUCKETS:
+                self._prune(now)
+            bucket = self.buckets[(caller, klass)] = TokenBucket(*self.limits[klass], now)
+        return bucket.take(now)
+
+    def _prune(self, now: float) -> None:
+        for key, bucket in list(self.buckets.items()):
+            # Not refill(): that would reset ``updated``, which orders the eviction below.
+            if bucket.tokens + (now - bucket.updated) * bucket.rate >= bucket.capacity:
+                del self.buckets[key]
+        excess = len(self.buckets) - MAX_BUCKETS // 2
+        if excess > 0:
+            # Every caller is active (e.g. addresses rotated faster than buckets refill); forgetting the
+            # longest unseen ones only hands them a fresh burst, while the table stays bounded.
+            for key in heapq.nsmallest(excess, self.buckets, key=lambda key: self.buckets[key].updated):
+                del self.buckets[key]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or is_exempt(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        holds_slot = scope["path"] not in STREAM_PATHS
+        klass = route_class(scope["method"], scope["path"])
+        if holds_slot and self.max_in_flight and self.in_flight >= self.max_in_flight:
+            await self._reject(scope, receive, send, klass, "overloaded", self.shed_retry_after)
+            return
+        wait = self.wait(_caller(scope), klass)
+        if wait:
+            await self._reject(scope, receive, send, klass, "rate_limited", math.ceil(wait))
+            return
+
+        if holds_slot:
+            self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if holds_slot:
+                self.in_flight -= 1
+
+    async def _reject(self, scope: Scope, receive: Receive, send: Send, klass: str, reason: str, retry_after: int):
+        ADMISSION_REJECTED.inc(route_class=klass, reason=reason)
+        detail = "Server busy" if reason == "overloaded" else f"Too many {klass} requests"
+        response = JSONResponse(
+            {"detail": f"{detail}; retry after {retry_after} s"},
+            status_code=429,
+            headers={"Retry-After": str(retry_after)},
+        )
+        await response(scope, receive, send)
+
+
+def _caller(scope: Scope) -> str:
+    scheme, _, token = Headers(scope=scope).get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        try:
+            return f"user:{verify_token(token).username}"
+        except HTTPException:
+            pass  # rejected later by the endpoint; limit it by address meanwhile
+    client = scope.get("client")
+    return f"addr:{client[0] if client else 'unknown'}"
+
+
+def add_admission_middleware(app: FastAPI) -> None:
+    """Add admission control configured by the ADMISSION_* settings."""
+    if not settings.ADMISSION_ENABLED:
+        return
+    app.add_middleware(
+        AdmissionMiddleware,
+        rates=settings.ADMISSION_RATE_PER_SECOND,
+        bursts=settings.ADMISSION_BURST,
+        max_in_flight=settings.ADMISSION_MAX_IN_FLIGHT,
+        shed_retry_after=settings.ADMISSION_SHED_RETRY_AFTER_SECONDS,
+    )
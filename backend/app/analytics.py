@@ -0,0 +1,223 @@
+﻿from collections import Counter
+from datetime import date, datetime
+from typing import Optional
+
+from sqlalchemy import case, delete, exists, func, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, aliased
+
+from app import archive, models
+
+
+def month_of(value: datetime) -> str:
+    """Summary-table month key (YYYY-MM)."""
+    return value.strftime("%Y-%m")
+
+
+def _increment(db: Session, model, rows: list[dict], counters: tuple[str, ...]) -> None:
+    """Add each row's ``counters`` to the summary row with the same primary key, creating it if needed."""
+    if not rows:
+        return
+    table = model.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        insert = sqlite_insert if dialect == "sqlite" else pg_insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[column.name for column in table.primary_key],
+            set_={name: table.c[name] + stmt.excluded[name] for name in counters},
+        )
+        db.execute(stmt, rows)
+        return
+
+    for row in rows:
+        key = {column.name: row[column.name] for column in table.primary_key}
+        existing = db.get(model, key)
+        if existing is None:
+            db.add(model(**row))
+        else:
+            for name in counters:
+                setattr(existing, name, getattr(existing, name) + row[name])
+
+
+def record_observation(db: Session, obs: models.Observation) -> None:
+    """Count a new (not yet flushed) observation in the summary tables, in the caller's transaction."""
+    key = {"month": month_of(obs.performed_date), "type": obs.type, "interpretation": obs.interpretation}
+    _increment(db, models.ObservationMonthlyCount, [{**key, "count": 1}], ("count",))
+
+    drugs = (
+        db.query(models.Medication.drug_name)
+        .filter(
+            models.Medication.patient_id == obs.patient_id,
+            models.Medication.start_date <= obs.performed_date,
+            or_(models.Medication.stop_date.is_(None), models.Medication.stop_date >= obs.performed_date),
+        )
+        .distinct()
+    )
+    rows = [{**key, "drug_name": drug_name, "count": 1} for (drug_name,) in drugs]
+    _increment(db, models.ObservationDrugMonthlyCount, rows, ("count",))
+
+
+def record_medication(db: Session, med: models.Medication) -> None:
+    """Count a new (not yet flushed) medication in the summary tables, in the caller's transaction."""
+    activity = [{"drug_name": med.drug_name, "day": med.start_date.date(), "starts": 1, "stops": 0}]
+    if med.stop_date:
+        activity.append({"drug_name": med.drug_name, "day": med.stop_date.date(), "starts": 0, "stops": 1})
+    _increment(db, models.MedicationDailyActivity, activity, ("starts", "stops"))
+
+    # Observations already recorded in this medication's window now count against the drug,
+    # unless another prescription of the same drug already covered them.
+    other = aliased(models.Medication)
+    obs = archive.observations(db, med.start_date)
+    covered = exists().where(
+        other.patient_id == obs.patient_id,
+        other.drug_name == med.drug_name,
+        other.start_date <= obs.performed_date,
+        or_(other.stop_date.is_(None), other.stop_date >= obs.performed_date),
+    )
+    query = db.query(obs.performed_date, obs.type, obs.interpretation).filter(
+        obs.patient_id == med.patient_id, obs.performed_date >= med.start_date, ~covered
+    )
+    if med.stop_date:
+        query = query.filter(obs.performed_date <= med.stop_date)
+    counts = Counter((month_of(performed), test_type, interpretation) for performed, test_type, interpretation in query)
+    rows = [
+        {"drug_name": med.drug_name, "month": month, "type": test_type, "interpretation": interpretation, "count": n}
+        for (month, test_type, interpretation), n in counts.items()
+    ]
+    _increment(db, models.ObservationDrugMonthlyCount, rows, ("count",))
+
+
+def observation_counts(
+    db: Session,
+    from_month: Optional[str] = None,
+    to_month: Optional[str] = None,
+    test_type: Optional[str] = None,
+    interpretation: Optional[str] = None,
+    drug_name: Optional[str] = None,
+    by_drug: bool = False,
+) -> list[dict]:
+    """Observation counts per month/type/interpretation (and drug when ``by_drug`` or ``drug_name``)."""
+    by_drug = by_drug or drug_name is not None
+    model = models.ObservationDrugMonthlyCount if by_drug else models.ObservationMonthlyCount
+    query = db.query(model)
+    if from_month:
+        query = query.filter(model.month >= from_month)
+    if to_month:
+        query = query.filter(model.month <= to_month)
+    if test_type:
+        query = query.filter(model.type == test_type)
+    if interpretation:
+        query = query.filter(model.interpretation == interpretation)
+    if drug_name:
+        query = query.filter(model.drug_name == drug_name)
+
+    order = [model.month, model.type, model.interpretation]
+    if by_drug:
+        order.insert(0, model.drug_name)
+    return [
+        {
+            "month": row.month,
+            "type": row.type,
+            "interpretation": row.interpretation,
+            "drug_name": row.drug_name if by_drug else None,
+            "count": row.count,
+        }
+        for row in query.order_by(*order)
+    ]
+
+
+def active_medication_counts(db: Session, on: date) -> list[dict]:
+    """Medications active on ``on`` (started on or before, not stopped before) per drug."""
+    activity = models.MedicationDailyActivity
+    active = func.sum(case((activity.day <= on, activity.starts), else_=0)) - func.sum(
+        case((activity.day < on, activity.stops), else_=0)
+    )
+    rows = (
+        db.query(activity.drug_name, active.label("active"))
+        .group_by(activity.drug_name)
+        .having(active > 0)
+        .order_by(activity.drug_name)
+    )
+    return [{"drug_name": drug_name, "active": count} for drug_name, count in rows]
+
+
+def merge_counts(parts: list[list[dict]], order: list[str], count: str = "count") -> list[dict]:
+    """Add up per-shard rows that differ only in ``count``, sorted by the ``order`` fields."""
+    if len(parts) == 1:
+        return parts[0]
+    merged: dict[tuple, dict] = {}
+    for rows in parts:
+        for row in rows:
+            key = tuple(value for name, value in row.items() if name != count)
+            if key in merged:
+                merged[key][count] += row[count]
+            else:
+                merged[key] = dict(row)
+    return sorted(merged.values(), key=lambda row: tuple(row[name] or "" for name in order))
+
+
+def rebuild_summaries(db: Session) -> None:
+    """Recompute every summary table from the base tables (for existing databases)."""
+    for model in (models.ObservationMonthlyCount, models.ObservationDrugMonthlyCount, models.MedicationDailyActivity):
+        db.execute(delete(model))
+
+    obs = archive.observations(db)
+    monthly: Counter = Counter()
+    for performed, test_type, interpretation in db.query(obs.performed_date, obs.type, obs.interpretation).yield_per(10000):
+        monthly[(month_of(performed), test_type, interpretation)] += 1
+    db.bulk_insert_mappings(
+        models.ObservationMonthlyCount,
+        [{"month": m, "type": t, "interpretation": i, "count": n} for (m, t, i), n in monthly.items()],
+    )
+
+    med = models.Medication
+    by_drug: Counter = Counter()
+    joined = (
+        db.query(med.drug_name, obs.id, obs.performed_date, obs.type, obs.interpretation)
+        .join(med, med.patient_id == obs.patient_id)
+        .filter(med.start_date <= obs.performed_date, or_(med.stop_date.is_(None), med.stop_date >= obs.performed_date))
+        .distinct()
+    )
+    for drug_name, _, performed, test_type, interpretation in joined.yield_per(10000):
+        by_drug[(drug_name, month_of(performed), test_type, interpretation)] += 1
+    db.bulk_insert_mappings(
+        models.ObservationDrugMonthlyCount,
+        [
+            {"drug_name": d, "month": m, "type": t, "interpretation": i, "count": n}
+            for (d, m, t, i), n in by_drug.items()
+        ],
+    )
+
+    activity: dict[tuple, dict] = {}
+    for drug_name, start_date, stop_date in db.query(med.drug_name, med.start_date, med.stop_date).yield_per(10000):
+        for day, counter in ((start_date, "starts"), (stop_date, "stops")):
+            if day is None:
+                continue
+            row = activity.setdefault(
+                (drug_name, day.date()), {"drug_name": drug_name, "day": day.date(), "starts": 0, "stops": 0}
+            )
+            row[counter] += 1
+    db.bulk_insert_mappings(models.MedicationDailyActivity, list(activity.values()))
+    db.commit()
+
+
+def ensure_summaries(db: Session) -> None:
+    """Build the summary tables if they are empty but the base tables are not (first start after upgrade)."""
+    if db.query(models.ObservationMonthlyCount).first() or db.query(models.MedicationDailyActivity).first():
+        return
+    if db.query(models.Observation).first() or db.query(models.Medication).first():
+        rebuild_summaries(db)
+
+
+if __name__ == "__main__":
+    from app.sharding import SHARDS
+
+    for shard in SHARDS:
+        session = shard.WriteSessionLocal()
+        try:
+            rebuild_summaries(session)
+        finally:
+            session.close()
+    print("Analytics summary tables rebuilt.")
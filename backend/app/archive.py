@@ -0,0 +1,87 @@
+﻿import argparse
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, func, insert, select, union_all
+from sqlalchemy.orm import Session, aliased
+
+from app import models
+from app.config import settings
+
+
+_COLUMNS = [column.name for column in models.Observation.__table__.columns]
+
+
+def newest_archived(db: Session) -> Optional[datetime]:
+    """performed_date of the newest archived observation (one step along its index)."""
+    return db.scalar(select(func.max(models.ArchivedObservation.performed_date)))
+
+
+def observations(db: Session, since: Optional[datetime] = None, columns: Optional[list[str]] = None):
+    """Observation entity over the hot table and, when needed, the archive.
+
+    Use it like ``models.Observation`` (filters, ordering, loading objects).
+    With ``since`` after the newest archived result, the archive is left out
+    of the query entirely, so reads of recent history only touch the hot
+    table and its indexes. ``columns`` narrows the union to the columns a
+    query selects, filters or orders by (loading objects needs them all), so
+    that narrow reads of both tables can be answered from their indexes.
+    """
+    if since is not None:
+        newest = newest_archived(db)
+        if newest is None or since > newest:
+            return models.Observation
+    names = [name for name in _COLUMNS if columns is None or name in columns]
+    hot = models.Observation.__table__
+    cold = models.ArchivedObservation.__table__
+    rows = union_all(
+        select(*(hot.c[name] for name in names)), select(*(cold.c[name] for name in names))
+    ).subquery("all_observations")
+    return aliased(models.Observation, rows)
+
+
+def archive_observations(db: Session, cutoff: datetime, batch_size: int = 5000) -> int:
+    """Move observations performed before ``cutoff`` into the archive; returns how many moved.
+
+    Each batch is copied and deleted in one transaction, so readers always see
+    every observation exactly once. Summary tables, the latest-result index and
+    the change log refer to observations by value or id and are unaffected.
+    """
+    hot = models.Observation.__table__
+    moved = 0
+    while True:
+        ids = db.scalars(select(hot.c.id).where(hot.c.performed_date < cutoff).limit(batch_size)).all()
+        if not ids:
+            break
+        db.execute(
+            insert(models.ArchivedObservation).from_select(
+                _COLUMNS, select(*(hot.c[name] for name in _COLUMNS)).where(hot.c.id.in_(ids))
+            )
+        )
+        db.execute(delete(hot).where(hot.c.id.in_(ids)))
+        db.commit()
+        moved += len(ids)
+    return moved
+
+
+def archive_cutoff(days: int, now: Optional[datetime] = None) -> datetime:
+    return (now or datetime.utcnow()) - timedelta(days=days)
+
+
+if __name__ == "__main__":
+    from app.sharding import SHARDS
+
+    parser = argparse.ArgumentParser(description="Move old observations into observations_archive.")
+    parser.add_argument("--days", type=int, default=settings.OBSERVATION_ARCHIVE_DAYS, help="Keep this many days hot")
+    parser.add_argument("--batch-size", type=int, default=settings.OBSERVATION_ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    cutoff = archive_cutoff(args.days)
+    count = 0
+    for shard in SHARDS:
+        session = shard.WriteSessionLocal()
+        try:
+            count += archive_observations(session, cutoff, args.batch_size)
+        finally:
+            session.close()
+    print(f"Archived {count} observations performed before {cutoff:%Y-%m-%d}.")
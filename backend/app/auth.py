@@ -12,6 +12,7 @@ from app.config import settings
 SECRET_KEY = settings.SECRET_SALT
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+REFRESH_TOKEN_EXPIRE_MINUTES = 12 * 60
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/oauth/token")
 
@@ -34,6 +35,8 @@ MOCK_USERS = {
 class Token(BaseModel):
     access_token: str
     token_type: str
+    expires_in: Optional[int] = None
+    refresh_token: Optional[str] = None
 
 
 class TokenData(BaseModel):
@@ -54,7 +57,25 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-def verify_token(token: str) -> TokenData:
+def create_refresh_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
+    """Create JWT refresh token (only accepted by the refresh_token grant)."""
+    to_encode = data.copy()
+    to_encode.update({"type": "refresh"})
+    return create_access_token(to_encode, expires_delta or timedelta(minutes=REFRESH_TOKEN_EXPIRE_MINUTES))
+
+
+def issue_tokens(username: str) -> dict:
+    """Issue an access/refresh token pair for a user."""
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    return {
+        "access_token": create_access_token(data={"sub": username}, expires_delta=access_token_expires),
+        "token_type": "bearer",
+        "expires_in": int(access_token_expires.total_seconds()),
+        "refresh_token": create_refresh_token(data={"sub": username}),
+    }
+
+
+def verify_token(token: str, token_type: str = "access") -> TokenData:
     """Verify JWT token and extract username."""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -64,7 +85,7 @@ def verify_token(token: str) -> TokenData:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username = payload.get("sub")
-        if username is None:
+        if username is None or payload.get("type", "access") != token_type:
             raise credentials_exception
         return TokenData(username=username)
     except JWTError as exc:
@@ -80,6 +101,13 @@ def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
     return User(**user)
 
 
+def require_admin(current_user: User = Depends(get_current_user)) -> User:
+    """Require the current user to have the admin role."""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return current_user
+
+
 def authenticate_user(username: str, password: str) -> Optional[dict]:
     """Authenticate user with username and password."""
     user = MOCK_USERS.get(username)
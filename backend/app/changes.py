@@ -0,0 +1,148 @@
+﻿import heapq
+from contextlib import nullcontext
+from typing import Union
+
+from sqlalchemy import insert, literal, select, union_all
+from sqlalchemy.orm import Session
+
+from app import archive, models, schemas, sharding
+
+
+PATIENT = "Patient"
+OBSERVATION = "Observation"
+MEDICATION = "MedicationRequest"
+
+# Resource type -> (model, response schema) used to embed each resource in the feed.
+RESOURCES = {
+    PATIENT: (models.Patient, schemas.PatientResponse),
+    OBSERVATION: (models.Observation, schemas.ObservationResponse),
+    MEDICATION: (models.Medication, schemas.MedicationResponse),
+}
+
+
+def record(db: Session, resource_type: str, resource) -> None:
+    """Append a create entry for ``resource`` in the caller's transaction (flushes to assign its id).
+
+    Entries go to the change log of the database the resource is written to:
+    the primary for patients, the patient's shard for clinical records.
+    """
+    db.flush()
+    db.add(
+        models.ChangeLogEntry(
+            resource_type=resource_type,
+            resource_id=resource.id,
+            # Patients are their own patient; everything else belongs to one.
+            patient_id=getattr(resource, "patient_id", resource.id),
+            action="create",
+        )
+    )
+
+
+def log_count() -> int:
+    """Change logs merged by the feed: the primary's, then each shard's (one when unsharded)."""
+    return 1 + len(sharding.SHARDS) if sharding.SHARDED else 1
+
+
+def parse_cursor(since: str) -> list[int]:
+    """Last sequence number read from each change log, from a ``last_seq`` value.
+
+    A cursor from before shards were added has fewer parts; the new shards'
+    logs are read from the start.
+    """
+    positions = [int(part) for part in since.split(".")]
+    if len(positions) > log_count():
+        raise ValueError(f"Cursor {since} has more parts than the {log_count()} change logs; restart from 0")
+    return positions + [0] * (log_count() - len(positions))
+
+
+def format_cursor(positions: list[int]) -> Union[int, str]:
+    """``last_seq``: the sequence number itself when unsharded, else one per log joined by dots."""
+    return positions[0] if len(positions) == 1 else ".".join(str(position) for position in positions)
+
+
+def list_changes(db: Session, since: str = "0", limit: int = 100) -> dict:
+    """Changes after the cursor ``since``, oldest first, each with its resource.
+
+    Writers hold each database's SQLite write lock from BEGIN IMMEDIATE to
+    commit, so sequence numbers become visible in order within each log and
+    a consumer that resumes from its ``last_seq`` never skips an entry. The
+    logs are merged by ``changed_at``, each read strictly in sequence order,
+    so a page always ends on a prefix of every log.
+    """
+    positions = parse_cursor(since)
+    log = models.ChangeLogEntry
+    pages = []
+    for index, position in enumerate(positions):
+        with nullcontext(db) if index == 0 else sharding.shard_reader(index - 1, db) as log_db:
+            entries = log_db.query(log).filter(log.seq > position).order_by(log.seq).limit(limit + 1).all()
+        pages.append([(entry.changed_at, index, entry) for entry in entries])
+
+    merged = list(heapq.merge(*pages, key=lambda item: item[:2]))
+    has_more = len(merged) > limit
+    merged = merged[:limit]
+    for _, index, entry in merged:
+        positions[index] = entry.seq
+    entries = [entry for _, _, entry in merged]
+
+    # One query per resource type (and shard) on the page, however many changes it holds.
+    resources: dict[tuple[str, str], dict] = {}
+    for index, shard_entries in sharding.group_by_shard(entries, lambda entry: entry.patient_id).items():
+        with sharding.shard_reader(index, db) as shard_db:
+            for resource_type, (model, schema) in RESOURCES.items():
+                ids = {entry.resource_id for entry in shard_entries if entry.resource_type == resource_type}
+                if ids:
+                    source = archive.observations(shard_db) if model is models.Observation else model
+                    for obj in shard_db.query(source).filter(source.id.in_(ids)):
+                        resources[(resource_type, obj.id)] = schema.model_validate(obj).model_dump(mode="json")
+
+    return {
+        "changes": [
+            {
+                "seq": entry.seq,
+                "resource_type": entry.resource_type,
+                "resource_id": entry.resource_id,
+                "patient_id": entry.patient_id,
+                "action": entry.action,
+                "changed_at": entry.changed_at,
+                "resource": resources.get((entry.resource_type, entry.resource_id)),
+            }
+            for entry in entries
+        ],
+        "last_seq": format_cursor(positions),
+        "has_more": has_more,
+    }
+
+
+def backfill_changes(db: Session) -> None:
+    """Seed the change log with a create entry per existing resource, in creation order."""
+    sources = [
+        select(
+            model.created_at.label("changed_at"),
+            literal(resource_type).label("resource_type"),
+            model.id.label("resource_id"),
+            (model.id if model is models.Patient else model.patient_id).label("patient_id"),
+        )
+        for resource_type, (model, _) in RESOURCES.items()
+    ]
+    archived = models.ArchivedObservation
+    sources.append(select(archived.created_at, literal(OBSERVATION), archived.id, archived.patient_id))
+    ordered = union_all(*sources).subquery()
+    db.execute(
+        insert(models.ChangeLogEntry).from_select(
+            ["changed_at", "resource_type", "resource_id", "patient_id", "action"],
+            select(
+                ordered.c.changed_at,
+                ordered.c.resource_type,
+                ordered.c.resource_id,
+                ordered.c.patient_id,
+                literal("create"),
+            ).order_by(ordered.c.changed_at, ordered.c.resource_type, ordered.c.resource_id),
+        )
+    )
+    db.commit()
+
+
+def ensure_changes(db: Session) -> None:
+    """Seed the change log if it is empty but resources exist (first start after upgrade)."""
+    if db.query(models.ChangeLogEntry).first() is None and db.query(models.Patient).first() is not None:
+        backfill_changes(db)
@@ -0,0 +1,176 @@
+﻿"""Code tables: strings repeated on every clinical row, stored as small integer ids.
+
+Test types, units, interpretations and drug names each have a table of
+``(id, name)`` in every database. ``Coded`` columns translate between the two
+at the SQLAlchemy boundary, so models, filters and API schemas keep using the
+strings. Each engine keeps an interned cache of its code tables. Writers call
+``intern`` before inserting a new string. The code row is added in the writer's
+transaction, and other sessions only see the new code once that transaction
+commits. A cache miss reads the table on a separate connection, which WAL
+lets proceed beside an open write transaction.
+"""
+import threading
+import time
+import weakref
+from contextvars import ContextVar
+from typing import Iterable, Optional
+
+from sqlalchemy import Integer, event, text
+from sqlalchemy.engine import Dialect, Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.types import TypeDecorator
+
+from app.config import settings
+
+
+# Binds a string that has no code; no row has this id, so filters on it match nothing.
+UNKNOWN = 0
+
+# Codes added by this context's uncommitted transactions: {(cache, table): {name: id}}.
+_pending: ContextVar[Optional[dict]] = ContextVar("pending_codes", default=None)
+
+
+class CodeCache:
+    """One database's code tables: name -> id and id -> name per table, loaded on first use."""
+
+    def __init__(self, engine: Engine):
+        self._engine = weakref.ref(engine)
+        self._lock = threading.Lock()
+        self._ids: dict[str, dict[str, int]] = {}
+        self._names: dict[str, dict[int, str]] = {}
+        self._loaded: dict[str, float] = {}
+
+    def load(self, table: str) -> None:
+        """Read every code in ``table`` (committed by any worker) into the cache."""
+        with self._engine().connect() as conn:
+            conn.execution_options(sqlite_immediate=False)  # read-only, whatever engine registered the cache
+            rows = conn.execute(text(f"SELECT id, name FROM {table}")).all()
+        self.add(table, rows)
+        self._loaded[table] = time.monotonic()
+
+    def add(self, table: str, rows: Iterable[tuple[int, str]]) -> None:
+        # Copy on write: lookups read the dicts without taking the lock.
+        with self._lock:
+            ids, names = dict(self._ids.get(table, {})), dict(self._names.get(table, {}))
+            for code, name in rows:
+                ids[name], names[code] = code, name
+            self._ids[table], self._names[table] = ids, names
+
+    def _pending(self, table: str) -> dict[str, int]:
+        pending = _pending.get()
+        return pending.get((self, table), {}) if pending else {}
+
+    def id(self, table: str, name: str, reload: bool = True) -> Optional[int]:
+        """Code of ``name``, or None if it has none yet.
+
+        A miss re-reads the table (another worker may have added the code) at
+        most every CODE_CACHE_RELOAD_SECONDS.
+        """
+        code = self._ids.get(table, {}).get(name)
+        if code is None:
+            code = self._pending(table).get(name)
+        if code is None and reload:
+            if time.monotonic() - self._loaded.get(table, float("-inf")) >= settings.CODE_CACHE_RELOAD_SECONDS:
+                self.load(table)
+                code = self._ids.get(table, {}).get(name)
+        return code
+
+    def name(self, table: str, code: int) -> str:
+        name = self._names.get(table, {}).get(code)
+        if name is None:
+            name = next((name for name, pending in self._pending(table).items() if pending == code), None)
+        if name is None:
+            self.load(table)
+            name = self._names.get(table, {}).get(code)
+        if name is None:
+            raise LookupError(f"{table} has no code {code}")
+        return name
+
+
+_caches: "weakref.WeakKeyDictionary[Dialect, CodeCache]" = weakref.WeakKeyDictionary()
+
+
+@event.listens_for(Engine, "engine_connect")
+def _register_engine(conn) -> None:
+    # Every engine has its own dialect instance, which is all a column type sees of its database.
+    if conn.dialect not in _caches:
+        _caches[conn.dialect] = CodeCache(conn.engine)
+
+
+def _cache(dialect: Dialect) -> CodeCache:
+    return _caches[dialect]
+
+
+class Coded(TypeDecorator):
+    """A string column stored as the id of its value in the code table ``table``."""
+
+    impl = Integer
+    cache_ok = True
+
+    def __init__(self, table: str):
+        super().__init__()
+        self.table = table
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        code = _cache(dialect).id(self.table, value)
+        return UNKNOWN if code is None else code
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return _cache(dialect).name(self.table, value)
+
+
+def intern(db: Session, column, *names: Optional[str]) -> None:
+    """Give each of ``names`` a code in ``column``'s code table, adding new ones in ``db``'s transaction."""
+    cache = _cache(db.get_bind().dialect)
+    table = column.type.table
+    for name in dict.fromkeys(names):
+        if name is None or cache.id(table, name, reload=False) is not None:
+            continue
+        if db.get_bind().dialect.name in ("sqlite", "postgresql"):
+            # A no-op update so the id comes back whether or not the name was already there.
+            code = db.scalar(
+                text(
+                    f"INSERT INTO {table} (name) VALUES (:name) "
+                    "ON CONFLICT (name) DO UPDATE SET name = excluded.name RETURNING id"
+                ),
+                {"name": name},
+            )
+        else:
+            code = db.scalar(text(f"SELECT id FROM {table} WHERE name = :name"), {"name": name})
+            if code is None:
+                db.execute(text(f"INSERT INTO {table} (name) VALUES (:name)"), {"name": name})
+                code = db.scalar(text(f"SELECT id FROM {table} WHERE name = :name"), {"name": name})
+
+        pending = _pending.get()
+        if pending is None:
+            pending = {}
+            _pending.set(pending)
+        pending.setdefault((cache, table), {})[name] = code
+        db.info.setdefault("pending_codes", []).append((pending, cache, table, name, code))
+
+
+def intern_rows(db: Session, table, rows: Iterable) -> None:
+    """``intern`` every coded value in ``rows`` (ORM objects or dicts of ``table``'s columns)."""
+    rows = list(rows)
+    for column in table.columns:
+        if isinstance(column.type, Coded):
+            names = (row.get(column.name) if isinstance(row, dict) else getattr(row, column.key) for row in rows)
+            intern(db, column, *names)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_codes(session):
+    for pending, cache, table, name, code in session.info.pop("pending_codes", ()):
+        cache.add(table, [(code, name)])
+        pending.get((cache, table), {}).pop(name, None)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_codes(session):
+    for pending, cache, table, name, code in session.info.pop("pending_codes", ()):
+        pending.get((cache, table), {}).pop(name, None)
+
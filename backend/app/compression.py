@@ -0,0 +1,145 @@
+﻿import gzip
+import logging
+from typing import Optional, Sequence
+
+from anyio import to_thread
+from fastapi import FastAPI
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import settings
+
+try:
+    import brotli
+except ImportError:  # optional: pip install brotli
+    brotli = None
+
+
+logger = logging.getLogger(__name__)
+
+# Bodies at least this large are compressed in a worker thread rather than on the event loop.
+OFFLOAD_BYTES = 256 * 1024
+
+
+def negotiate(accept_encoding: str, supported: Sequence[str]) -> Optional[str]:
+    """Pick the encoding from ``supported`` (in server preference order) the client rates highest."""
+    weights: dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        weights[name] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in supported:
+        quality = weights.get(encoding, weights.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class CompressionMiddleware:
+    """Pure ASGI middleware compressing buffered responses with brotli or gzip, as negotiated.
+
+    Only complete single-message bodies of an allowed content type and at
+    least ``min_size`` bytes are compressed. Streaming responses (exports,
+    the observation stream) and bodies that already carry a Content-Encoding
+    are passed through untouched, so nothing is ever buffered here.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        min_size: int = 1024,
+        content_types: Sequence[str] = ("application/json",),
+        encodings: Sequence[str] = ("br", "gzip"),
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+    ) -> None:
+        self.app = app
+        self.min_size = min_size
+        self.content_types = tuple(content_types)
+        self.encodings = [name for name in encodings if name == "gzip" or (name == "br" and brotli is not None)]
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        if "br" in encodings and brotli is None:
+            logger.info("brotli is not installed; compressing responses with gzip only")
+
+    def compress(self, body: bytes, encoding: str) -> bytes:
+        if encoding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""), self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Optional[Message] = None
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message.get("headers", []))
+                eligible = (
+                    message["status"] >= 200
+                    and message["status"] not in (204, 304)
+                    and "content-encoding" not in headers
+                    and headers.get("content-type", "").startswith(self.content_types)
+                )
+                if not eligible:
+                    await send(message)
+                    return
+                # Hold the start message until the first body chunk shows whether this is a stream.
+                start_message = message
+                return
+
+            if start_message is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            headers = MutableHeaders(raw=list(start.get("headers", [])))
+            headers.add_vary_header("Accept-Encoding")
+            body = message.get("body", b"")
+            if message.get("more_body", False) or len(body) < self.min_size:
+                await send({**start, "headers": headers.raw})
+                await send(message)
+                return
+
+            if len(body) >= OFFLOAD_BYTES:
+                compressed = await to_thread.run_sync(self.compress, body, encoding)
+            else:
+                compressed = self.compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            await send({**start, "headers": headers.raw})
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
+
+
+def add_compression_middleware(app: FastAPI) -> None:
+    """Add response compression configured by the COMPRESSION_* settings."""
+    if not settings.COMPRESSION_ENABLED:
+        return
+    app.add_middleware(
+        CompressionMiddleware,
+        min_size=settings.COMPRESSION_MIN_BYTES,
+        content_types=settings.COMPRESSION_CONTENT_TYPES,
+        encodings=settings.COMPRESSION_ENCODINGS,
+        gzip_level=settings.COMPRESSION_GZIP_LEVEL,
+        brotli_quality=settings.COMPRESSION_BROTLI_QUALITY,
+    )
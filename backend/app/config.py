@@ -7,11 +7,89 @@ class Settings(BaseSettings):
 
     # Database
     DATABASE_URL: str = "sqlite:///./epr.db"
+    SLOW_QUERY_MS: float = 200.0
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    SEED_ON_STARTUP: bool = False
+    # A filter on a test type, unit or drug this worker has no code for re-reads the code table at most this
+    # often, to pick up codes other workers added (app.codes).
+    CODE_CACHE_RELOAD_SECONDS: float = 1.0
+    # Optional SQLite shards for observations and medications, chosen by a stable hash of the patient id.
+    # DATABASE_URL stays the primary: patients, the change log and export jobs. Changing the list needs
+    # `python -m app.sharding rebalance`.
+    SHARD_DATABASE_URLS: list[str] = []
 
     # Server
     HOST: str = "0.0.0.0"
     PORT: int = 8000
 
+    # Monitoring due-list: maximum days between results per test, and drugs that require a baseline
+    MONITORING_INTERVAL_DAYS: dict[str, int] = {"HbA1c": 365, "Weight": 90, "ECG": 365, "FBC": 365, "LFT": 365}
+    MONITORED_DRUGS: list[str] = [
+        "Amisulpride",
+        "Aripiprazole",
+        "Clozapine",
+        "Haloperidol",
+        "Olanzapine",
+        "Quetiapine",
+        "Risperidone",
+    ]
+
+    # Observation archival (python -m app.archive): results older than this move to observations_archive
+    OBSERVATION_ARCHIVE_DAYS: int = 365
+    OBSERVATION_ARCHIVE_BATCH_SIZE: int = 5000
+
+    # Observation push stream (GET /Observation/stream)
+    STREAM_POLL_SECONDS: float = 1.0
+    STREAM_BUFFER_SIZE: int = 100
+    STREAM_KEEPALIVE_SECONDS: float = 15.0
+
+    # Export artifact storage: "local" (EXPORT_DIR, shared volume for several nodes) or "s3"
+    EXPORT_STORAGE: str = "local"
+    EXPORT_DIR: str = "exports"
+    EXPORT_PRESIGNED_URLS: bool = False
+    EXPORT_PRESIGNED_TTL_SECONDS: int = 300
+    S3_BUCKET: str = ""
+    S3_PREFIX: str = "exports/"
+    S3_ENDPOINT_URL: str = ""
+    S3_REGION: str = ""
+    S3_ACCESS_KEY_ID: str = ""
+    S3_SECRET_ACCESS_KEY: str = ""
+
+    # FHIR Bulk Data ($export): NDJSON files are gzip-compressed in storage and built from batched cursors
+    BULK_EXPORT_GZIP: bool = True
+    BULK_EXPORT_BATCH_SIZE: int = 1000
+    BULK_EXPORT_WORKERS: int = 2
+    # Queued or running jobs whose worker has not reported for this long are marked FAILED.
+    BULK_EXPORT_STALE_SECONDS: int = 300
+
+    # Response compression: encodings in preference order ("br" needs the brotli package)
+    COMPRESSION_ENABLED: bool = True
+    COMPRESSION_MIN_BYTES: int = 1024
+    COMPRESSION_ENCODINGS: list[str] = ["br", "gzip"]
+    COMPRESSION_GZIP_LEVEL: int = 6
+    COMPRESSION_BROTLI_QUALITY: int = 4
+    COMPRESSION_CONTENT_TYPES: list[str] = ["application/json", "application/fhir+json", "text/plain", "text/csv"]
+
+    # Admission control (app.admission): per-user token buckets for reads, writes and exports (starting a CSV or
+    # bulk export), refilling at ADMISSION_RATE_PER_SECOND up to ADMISSION_BURST, plus a per-worker cap on requests
+    # being served (0: none). Requests over either limit get 429 with Retry-After. Logins are a "login" class of
+    # their own, not limited by default (callers sharing an address would share its bucket).
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_RATE_PER_SECOND: dict[str, float] = {"read": 20.0, "write": 5.0, "export": 0.1}
+    ADMISSION_BURST: dict[str, int] = {"read": 60, "write": 20, "export": 3}
+    ADMISSION_MAX_IN_FLIGHT: int = 64
+    ADMISSION_SHED_RETRY_AFTER_SECONDS: int = 1
+
+    # Readiness checks (cached for HEALTH_CACHE_SECONDS)
+    HEALTH_CACHE_SECONDS: float = 5.0
+    READY_MAX_DB_MS: float = 500.0
+    READY_MAX_POOL_UTILISATION: float = 0.9
+    READY_MAX_PENDING_EXPORTS: int = 20
+    READY_MIN_FREE_DISK_MB: int = 100
+
+    # Logging
+    LOG_QUEUE_SIZE: int = 10000
+
     class Config:
         env_file = ".env"
 
@@ -1,14 +1,34 @@
-﻿from typing import Optional
+﻿from datetime import datetime
+from typing import Optional, Union
 
-from sqlalchemy.orm import Session
+from sqlalchemy import func
+from sqlalchemy.orm import Query, Session
 
-from app import models, schemas
+from app import analytics, archive, changes, codes, models, monitoring, schemas, sharding
 from app.hashing import generate_pseudonym, hash_nhs_number
 
 
-def get_patient_by_nhs_hash(db: Session, nhs_hash: str) -> Optional[models.Patient]:
-    """Get patient by NHS number hash."""
-    return db.query(models.Patient).filter(models.Patient.nhs_hash == nhs_hash).first()
+def _columns(entity, elements: Optional[list[str]]) -> list:
+    """What to select: ``entity`` itself, or only the columns named in ``elements``."""
+    return [entity] if elements is None else [getattr(entity, name) for name in elements]
+
+
+def _as_dict(row, elements: Optional[list[str]]):
+    """A row selected with ``_columns``: the object itself, or a dict of the selected columns."""
+    return row if elements is None or row is None else row._asdict()
+
+
+def get_patient_by_nhs_hash(
+    db: Session, nhs_hash: str, elements: Optional[list[str]] = None
+) -> Union[models.Patient, dict, None]:
+    """Get patient by NHS number hash; with ``elements``, only those columns, as a dict."""
+    row = db.query(*_columns(models.Patient, elements)).filter(models.Patient.nhs_hash == nhs_hash).first()
+    return _as_dict(row, elements)
+
+
+def count_patients_by_nhs_hash(db: Session, nhs_hash: str) -> int:
+    """Patients with this NHS number hash (0 or 1), counted in SQL."""
+    return db.query(func.count()).select_from(models.Patient).filter(models.Patient.nhs_hash == nhs_hash).scalar()
 
 
 def get_patient_by_id(db: Session, patient_id: str) -> Optional[models.Patient]:
@@ -17,7 +37,7 @@ def get_patient_by_id(db: Session, patient_id: str) -> Optional[models.Patient]:
 
 
 def create_patient(db: Session, patient: schemas.PatientCreate) -> models.Patient:
-    """Create a new patient."""
+    """Create a new patient and its change-log entry in one transaction, copying the row to its shard first."""
     nhs_hash = hash_nhs_number(patient.nhs_number)
 
     existing = get_patient_by_nhs_hash(db, nhs_hash)
@@ -34,44 +54,96 @@ def create_patient(db: Session, patient: schemas.PatientCreate) -> models.Patien
         age_band=patient.age_band,
     )
     db.add(db_patient)
+    changes.record(db, changes.PATIENT, db_patient)
+    # Before the primary commits: a patient in the directory (and the change feed) always has its shard copy.
+    sharding.copy_patient(db_patient)
     db.commit()
     db.refresh(db_patient)
     return db_patient
 
 
-def get_observations(db: Session, patient_id: str) -> list[models.Observation]:
-    """Get all observations for a patient."""
-    return (
-        db.query(models.Observation)
-        .filter(models.Observation.patient_id == patient_id)
-        .order_by(models.Observation.performed_date.desc())
-        .all()
-    )
+# Columns get_observations filters and orders by, whatever it selects.
+_OBSERVATION_FILTERS = ["patient_id", "performed_date"]
+
+
+def _filter_observations(
+    query: Query, obs, patient_id: str, from_date: Optional[datetime], to_date: Optional[datetime]
+) -> Query:
+    query = query.filter(obs.patient_id == patient_id)
+    if from_date:
+        query = query.filter(obs.performed_date >= from_date)
+    if to_date:
+        query = query.filter(obs.performed_date <= to_date)
+    return query
+
+
+def get_observations(
+    db: Session,
+    patient_id: str,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+    elements: Optional[list[str]] = None,
+) -> list[Union[models.Observation, dict]]:
+    """Get a patient's observations (newest first), reading the archive only if ``from_date`` reaches it.
+
+    With ``elements``, only those columns are selected and each observation is a dict of them.
+    """
+    obs = archive.observations(db, from_date, None if elements is None else _OBSERVATION_FILTERS + elements)
+    query = _filter_observations(db.query(*_columns(obs, elements)), obs, patient_id, from_date, to_date)
+    return [_as_dict(row, elements) for row in query.order_by(obs.performed_date.desc())]
+
+
+def count_observations(
+    db: Session, patient_id: str, from_date: Optional[datetime] = None, to_date: Optional[datetime] = None
+) -> int:
+    """How many observations ``get_observations`` would return, counted in SQL."""
+    obs = archive.observations(db, from_date, _OBSERVATION_FILTERS)
+    return _filter_observations(db.query(func.count()).select_from(obs), obs, patient_id, from_date, to_date).scalar()
 
 
 def create_observation(db: Session, obs: schemas.ObservationCreate) -> models.Observation:
-    """Create observation."""
+    """Create observation and update the summaries, latest-result index and change log in the same transaction."""
     db_obs = models.Observation(**obs.model_dump())
+    codes.intern_rows(db, models.Observation.__table__, [db_obs])
+    analytics.record_observation(db, db_obs)
+    monitoring.record_observation(db, db_obs)
     db.add(db_obs)
+    changes.record(db, changes.OBSERVATION, db_obs)
     db.commit()
     db.refresh(db_obs)
     return db_obs
 
 
-def get_medications(db: Session, patient_id: str) -> list[models.Medication]:
-    """Get all medications for a patient."""
-    return (
-        db.query(models.Medication)
+def get_medications(
+    db: Session, patient_id: str, elements: Optional[list[str]] = None
+) -> list[Union[models.Medication, dict]]:
+    """Get all medications for a patient; with ``elements``, only those columns, as dicts."""
+    query = (
+        db.query(*_columns(models.Medication, elements))
         .filter(models.Medication.patient_id == patient_id)
         .order_by(models.Medication.start_date.desc())
-        .all()
+    )
+    return [_as_dict(row, elements) for row in query]
+
+
+def count_medications(db: Session, patient_id: str) -> int:
+    """How many medications ``get_medications`` would return, counted in SQL."""
+    return (
+        db.query(func.count())
+        .select_from(models.Medication)
+        .filter(models.Medication.patient_id == patient_id)
+        .scalar()
     )
 
 
 def create_medication(db: Session, med: schemas.MedicationCreate) -> models.Medication:
-    """Create medication."""
+    """Create medication and update the summaries, monitoring index, drug-name codes and change log in the same transaction."""
     db_med = models.Medication(**med.model_dump())
+    codes.intern_rows(db, models.Medication.__table__, [db_med])
+    analytics.record_medication(db, db_med)
+    monitoring.record_medication(db, db_med)
     db.add(db_med)
+    changes.record(db, changes.MEDICATION, db_med)
     db.commit()
     db.refresh(db_med)
     return db_med
@@ -82,6 +154,29 @@ def get_all_patients(db: Session) -> list[models.Patient]:
     return db.query(models.Patient).all()
 
 
+def get_observations_by_patient(db: Session, patient_id: Optional[str] = None) -> dict[str, list[models.Observation]]:
+    """Get observations (including archived ones) grouped by patient ID, newest first, in a single query."""
+    source = archive.observations(db)
+    query = db.query(source)
+    if patient_id:
+        query = query.filter(source.patient_id == patient_id)
+    grouped: dict[str, list[models.Observation]] = {}
+    for obs in query.order_by(source.performed_date.desc()):
+        grouped.setdefault(obs.patient_id, []).append(obs)
+    return grouped
+
+
+def get_medications_by_patient(db: Session, patient_id: Optional[str] = None) -> dict[str, list[models.Medication]]:
+    """Get medications grouped by patient ID (newest first) in a single query."""
+    query = db.query(models.Medication)
+    if patient_id:
+        query = query.filter(models.Medication.patient_id == patient_id)
+    grouped: dict[str, list[models.Medication]] = {}
+    for med in query.order_by(models.Medication.start_date.desc()):
+        grouped.setdefault(med.patient_id, []).append(med)
+    return grouped
+
+
 def create_export_job(db: Session, patient_id: Optional[str] = None) -> models.ExportJob:
     """Create export job."""
     db_job = models.ExportJob(patient_id=patient_id)
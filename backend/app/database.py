@@ -1,15 +1,108 @@
-﻿from sqlalchemy import create_engine
+﻿import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
 from sqlalchemy.orm import sessionmaker
 
 from app.config import settings
+from app.metrics import instrument_engine
+from app.slow_queries import instrument_slow_queries
+
+
+IS_SQLITE = settings.DATABASE_URL.startswith("sqlite")
+
+
+def create_database_engine(url: str) -> Engine:
+    """Engine configured for concurrent workers (WAL, queued writers) and instrumented like the primary."""
+    is_sqlite = url.startswith("sqlite")
+    new_engine = create_engine(url, connect_args={"check_same_thread": False} if is_sqlite else {})
+
+    if is_sqlite:
+
+        @event.listens_for(new_engine, "connect")
+        def _configure_sqlite(dbapi_connection, connection_record):
+            # WAL lets readers in every worker proceed while one writer commits; busy_timeout makes
+            # writers queue for the lock instead of failing with "database is locked".
+            dbapi_connection.isolation_level = None  # transactions are begun by _begin_sqlite below
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+            cursor.close()
+
+        # SQLite's busy handler polls with growing sleeps, so many threads waiting on it at once are woken
+        # late and some run past busy_timeout. Writers in this process queue here instead, in the threadpool,
+        # and only the one at the head waits on SQLite for writers in other processes.
+        writer_queue = threading.Lock()
+        queued_writers: set = set()  # DBAPI connections whose transaction holds writer_queue
+
+        def _release_writer(dbapi_connection) -> None:
+            if dbapi_connection in queued_writers:
+                queued_writers.discard(dbapi_connection)
+                writer_queue.release()
+
+        @event.listens_for(new_engine, "begin")
+        def _begin_sqlite(conn):
+            # Write sessions take the write lock up front: a deferred transaction that reads and then
+            # writes fails immediately (without waiting) if another worker committed in between.
+            dbapi_connection = conn.connection.dbapi_connection
+            immediate = conn.get_execution_options().get("sqlite_immediate", False)
+            if not immediate:
+                dbapi_connection.execute("BEGIN")
+                return
+            if not writer_queue.acquire(timeout=settings.SQLITE_BUSY_TIMEOUT_MS / 1000):
+                raise sqlite3.OperationalError("database is locked (queued behind this worker's writers)")
+            try:
+                dbapi_connection.execute("BEGIN IMMEDIATE")
+            except BaseException:
+                writer_queue.release()
+                raise
+            queued_writers.add(dbapi_connection)
+
+        # The engine's commit/rollback events fire before COMMIT/ROLLBACK is sent, while SQLite's write lock is
+        # still held; release the queue only once it has been, so the next writer's BEGIN IMMEDIATE succeeds.
+        dialect = new_engine.dialect
+
+        def _releasing(end_transaction):
+            def end_sqlite(connection):
+                try:
+                    end_transaction(connection)
+                finally:
+                    _release_writer(connection.dbapi_connection)
+
+            return end_sqlite
+
+        dialect.do_commit = _releasing(dialect.do_commit)
+        dialect.do_rollback = _releasing(dialect.do_rollback)
+
+        # A connection returned or discarded mid-transaction must not keep the queue.
+        @event.listens_for(new_engine, "reset")
+        def _reset_sqlite(dbapi_connection, connection_record, reset_state):
+            _release_writer(dbapi_connection)
+
+        @event.listens_for(new_engine, "invalidate")
+        def _invalidate_sqlite(dbapi_connection, connection_record, exception):
+            _release_writer(dbapi_connection)
 
+    instrument_engine(new_engine)
+    instrument_slow_queries(new_engine, settings.SLOW_QUERY_MS)
+    return new_engine
 
-engine = create_engine(
-    settings.DATABASE_URL,
-    connect_args={"check_same_thread": False} if "sqlite" in settings.DATABASE_URL else {},
-)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def create_sessionmakers(bind: Engine, **kwargs) -> tuple[sessionmaker, sessionmaker]:
+    """Read and write (BEGIN IMMEDIATE) session factories for an engine."""
+    return (
+        sessionmaker(autocommit=False, autoflush=False, bind=bind, **kwargs),
+        sessionmaker(autocommit=False, autoflush=False, bind=bind.execution_options(sqlite_immediate=True), **kwargs),
+    )
+
+
+engine = create_database_engine(settings.DATABASE_URL)
+SessionLocal, WriteSessionLocal = create_sessionmakers(engine)
 
 
 def get_db():
@@ -19,3 +112,91 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_write_db():
+    """Dependency to get a database session for requests that write.
+
+    Async so the session (and the SQLite write lock it holds) is closed as soon as the
+    endpoint returns, without first waiting for a threadpool slot. Its first statement may
+    wait up to SQLITE_BUSY_TIMEOUT_MS for the write lock, so endpoints using it are plain
+    ``def`` (or call it through ``run_in_threadpool``): that wait must not stall the event loop.
+    """
+    db = WriteSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+@contextmanager
+def _startup_lock():
+    database = make_url(settings.DATABASE_URL).database
+    if IS_SQLITE and database not in (None, "", ":memory:"):
+        lock_path = Path(f"{database}.startup.lock")
+    else:
+        lock_path = Path(".epr-startup.lock")
+    with open(lock_path, "a+b") as lock_file:
+        if os.name == "nt":
+            import msvcrt
+
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # LK_LOCK gives up after ~10 s; keep waiting
+                    continue
+            try:
+                yield
+            finally:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def init_database(seed: bool = False) -> None:
+    """Create tables (and seed if requested) once, even when several workers start together."""
+    from app import analytics, bulk_export, changes, models, monitoring, search, sharding, upgrade
+    from app.seed import seed_database
+
+    with _startup_lock():
+        # Shards get the full schema too: patient copies, summary tables and a change log of their own writes.
+        for shard_engine in dict.fromkeys([engine] + [shard.engine for shard in sharding.SHARDS]):
+            models.Base.metadata.create_all(bind=shard_engine)
+            # create_all only indexes new tables; add indexes declared since a table was created.
+            for table in models.Base.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(bind=shard_engine, checkfirst=True)
+        # The primary keeps patients, the change log and export jobs even when observations are sharded.
+        write_sessions = [WriteSessionLocal] + [shard.WriteSessionLocal for shard in sharding.SHARDS]
+        for write_session in dict.fromkeys(write_sessions):
+            db = write_session()
+            try:
+                upgrade.upgrade_tables(db)
+            finally:
+                db.close()
+        for shard in sharding.SHARDS:
+            db = shard.WriteSessionLocal()
+            try:
+                analytics.ensure_summaries(db)
+                monitoring.ensure_latest(db)
+                search.ensure_search_index(db)
+            finally:
+                db.close()
+        db = WriteSessionLocal()
+        try:
+            changes.ensure_changes(db)
+        finally:
+            db.close()
+        # Jobs left queued or running by a worker that has since stopped would otherwise report 202 for ever.
+        bulk_export.reap_stale_jobs(WriteSessionLocal)
+        if seed:
+            seed_database()
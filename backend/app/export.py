@@ -1,29 +1,49 @@
 ﻿import csv
 import os
+import tempfile
 import zipfile
-from typing import Optional
+from typing import Callable, Optional
 
 from sqlalchemy.orm import Session
 
-from app import crud
+from app import crud, sharding
+from app.config import settings
+from app.storage import get_export_storage
 
 
-EXPORT_DIR = "exports"
+EXPORT_DIR = settings.EXPORT_DIR
 os.makedirs(EXPORT_DIR, exist_ok=True)
 
 
 def generate_csv_export(db: Session, job_id: str, patient_id: Optional[str] = None) -> str:
-    """Generate CSV export files and return ZIP path."""
+    """Generate CSV export files, store the ZIP and return its storage key."""
+    # Stage next to local artifacts so LocalStorage.save is a rename, not a copy.
+    with tempfile.TemporaryDirectory(prefix=".epr-export-", dir=EXPORT_DIR) as work_dir:
+        return _write_export(db, job_id, patient_id, work_dir)
+
+
+def _by_patient(db: Session, fetch: Callable[[Session, Optional[str]], dict], patient_id: Optional[str]) -> dict:
+    """``fetch`` from the patient's shard, or from every shard merged when exporting everyone."""
+    if patient_id:
+        with sharding.reader(patient_id, db) as shard_db:
+            return fetch(shard_db, patient_id)
+    merged: dict = {}
+    for part in sharding.scatter(db, fetch, None):
+        merged.update(part)
+    return merged
+
+
+def _write_export(db: Session, job_id: str, patient_id: Optional[str], work_dir: str) -> str:
     if patient_id:
         patient = crud.get_patient_by_id(db, patient_id)
         patients = [patient] if patient else []
     else:
         patients = crud.get_all_patients(db)
 
-    patients_csv = os.path.join(EXPORT_DIR, f"{job_id}_patients.csv")
-    medications_csv = os.path.join(EXPORT_DIR, f"{job_id}_medications.csv")
-    events_csv = os.path.join(EXPORT_DIR, f"{job_id}_events.csv")
-    zip_path = os.path.join(EXPORT_DIR, f"{job_id}.zip")
+    patients_csv = os.path.join(work_dir, "patients.csv")
+    medications_csv = os.path.join(work_dir, "medications.csv")
+    events_csv = os.path.join(work_dir, "events.csv")
+    zip_path = os.path.join(work_dir, f"{job_id}.zip")
 
     with open(patients_csv, "w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
@@ -34,8 +54,9 @@ def generate_csv_export(db: Session, job_id: str, patient_id: Optional[str] = No
     with open(medications_csv, "w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
         writer.writerow(["pseudonymous_number", "drug_name", "start_date", "stop_date", "dose"])
+        medications = _by_patient(db, crud.get_medications_by_patient, patient_id)
         for patient in patients:
-            for med in crud.get_medications(db, patient.id):
+            for med in medications.get(patient.id, []):
                 writer.writerow([
                     patient.pseudonym,
                     med.drug_name,
@@ -47,8 +68,9 @@ def generate_csv_export(db: Session, job_id: str, patient_id: Optional[str] = No
     with open(events_csv, "w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
         writer.writerow(["pseudonymous_number", "test_type", "performed_date", "value", "unit", "interpretation"])
+        observations = _by_patient(db, crud.get_observations_by_patient, patient_id)
         for patient in patients:
-            for obs in crud.get_observations(db, patient.id):
+            for obs in observations.get(patient.id, []):
                 writer.writerow([
                     patient.pseudonym,
                     obs.type,
@@ -63,8 +85,6 @@ def generate_csv_export(db: Session, job_id: str, patient_id: Optional[str] = No
         zipf.write(medications_csv, "medications.csv")
         zipf.write(events_csv, "events.csv")
 
-    os.remove(patients_csv)
-    os.remove(medications_csv)
-    os.remove(events_csv)
-
-    return zip_path
+    key = f"{job_id}.zip"
+    get_export_storage().save(key, zip_path)
+    return key
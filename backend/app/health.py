@@ -0,0 +1,90 @@
+﻿import shutil
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+
+from app import models
+from app.config import settings
+
+
+class ReadinessProbe:
+    """Database, pool, export queue and disk checks, cached for ``interval`` seconds."""
+
+    def __init__(self, engine: Engine, session_factory: sessionmaker, export_dir: str, interval: float):
+        self.engine = engine
+        self.session_factory = session_factory
+        self.export_dir = export_dir
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._result: Optional[dict] = None
+        self._checked_at = 0.0
+
+    def _pool_status(self) -> dict:
+        pool = self.engine.pool
+        if not hasattr(pool, "checkedout") or not hasattr(pool, "size"):
+            return {"checked_out": None, "capacity": None, "utilisation": None}
+        capacity = pool.size() + max(getattr(pool, "_max_overflow", 0), 0)
+        checked_out = pool.checkedout()
+        return {
+            "checked_out": checked_out,
+            "capacity": capacity,
+            "utilisation": round(checked_out / capacity, 3) if capacity else None,
+        }
+
+    def _check(self) -> dict:
+        checks: dict = {}
+        problems: list[str] = []
+
+        started = time.perf_counter()
+        db = self.session_factory()
+        try:
+            db.execute(text("SELECT 1"))
+            checks["database"] = {"ok": True, "round_trip_ms": round((time.perf_counter() - started) * 1000, 2)}
+            pending = db.query(models.ExportJob).filter(models.ExportJob.status == "PENDING").count()
+            # Bulk $export jobs queue on the per-worker export pool; count those not yet finished too.
+            bulk = (
+                db.query(models.BulkExportJob)
+                .filter(models.BulkExportJob.status.in_(["PENDING", "RUNNING"]))
+                .count()
+            )
+            checks["export_queue"] = {"pending": pending, "bulk_unfinished": bulk}
+            if pending + bulk > settings.READY_MAX_PENDING_EXPORTS:
+                problems.append("export queue backlog")
+        except Exception as exc:  # noqa: BLE001 - any DB failure means not ready
+            checks["database"] = {"ok": False, "error": type(exc).__name__}
+            problems.append("database unavailable")
+        finally:
+            db.close()
+        if checks["database"].get("round_trip_ms", 0) > settings.READY_MAX_DB_MS:
+            problems.append("database slow")
+
+        checks["pool"] = self._pool_status()
+        utilisation = checks["pool"]["utilisation"]
+        if utilisation is not None and utilisation >= settings.READY_MAX_POOL_UTILISATION:
+            problems.append("connection pool saturated")
+
+        usage = shutil.disk_usage(self.export_dir)
+        free_mb = usage.free // (1024 * 1024)
+        checks["export_disk"] = {"free_mb": free_mb, "used_pct": round(usage.used / usage.total * 100, 1)}
+        if free_mb < settings.READY_MIN_FREE_DISK_MB:
+            problems.append("low disk space for exports")
+
+        return {
+            "status": "ready" if not problems else "degraded",
+            "problems": problems,
+            "checks": checks,
+            "checked_at": datetime.utcnow().isoformat(),
+        }
+
+    def status(self) -> dict:
+        """Cached readiness status; at most one caller refreshes it per interval."""
+        with self._lock:
+            if self._result is None or time.monotonic() - self._checked_at >= self.interval:
+                self._result = self._check()
+                self._checked_at = time.monotonic()
+            return self._result
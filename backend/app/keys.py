@@ -0,0 +1,58 @@
+﻿"""Compact primary keys: UUIDs stored as their 16 bytes rather than 36 characters of text.
+
+The API keeps handing out and accepting the usual string form; ``UUIDKey``
+columns convert at the SQLAlchemy boundary, as ``Coded`` columns do for code
+tables. Ids existing before the change keep their string exactly (a UUID's
+bytes round-trip to the same text), and byte order equals the order of the
+lowercase strings, so keyset cursors and merges by id are unaffected.
+
+New ids are time-ordered (UUID version 7: a millisecond timestamp, then
+random bits), so inserts land at the right-hand edge of the primary key and
+patient_id indexes instead of on random pages throughout them.
+"""
+import os
+import time
+import uuid
+
+from sqlalchemy import LargeBinary
+from sqlalchemy.types import TypeDecorator
+
+
+# Binds a string that is not a UUID; no key is empty, so filters on it match nothing.
+NO_KEY = b""
+
+
+def time_ordered_uuid(millis: int, rand: int) -> uuid.UUID:
+    """Version 7 UUID: 48 bits of Unix time in milliseconds, the version, then 74 of the 80 bits of ``rand``."""
+    return uuid.UUID(
+        int=(millis & (1 << 48) - 1) << 80
+        | 0x7 << 76
+        | (rand >> 68 & 0xFFF) << 64
+        | 0b10 << 62  # RFC 4122 variant
+        | rand & (1 << 62) - 1
+    )
+
+
+def generate_uuid() -> str:
+    return str(time_ordered_uuid(time.time_ns() // 1_000_000, int.from_bytes(os.urandom(10), "big")))
+
+
+def key_bytes(value: str) -> bytes:
+    """The stored form of the UUID string ``value`` (NO_KEY if it is not one)."""
+    try:
+        return uuid.UUID(value).bytes
+    except (AttributeError, TypeError, ValueError):
+        return NO_KEY
+
+
+class UUIDKey(TypeDecorator):
+    """A UUID string column stored as 16 bytes."""
+
+    impl = LargeBinary(16)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else key_bytes(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else str(uuid.UUID(bytes=bytes(value)))
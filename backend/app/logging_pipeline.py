@@ -0,0 +1,112 @@
+﻿import atexit
+import copy
+import json
+import logging
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Iterable, Optional
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Non-blocking queue handler: records are dropped (and counted) when the queue is full."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    _formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge the arguments and render the traceback now, while they still describe the state at the
+        # logging call; redaction and JSON encoding are left to the listener thread.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self._formatter.formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+
+class _BlockingSentinelListener(QueueListener):
+    """QueueListener whose stop sentinel waits for room instead of failing on a full queue."""
+
+    def enqueue_sentinel(self) -> None:
+        self.queue.put(self._sentinel)
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as single-line JSON objects."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, default=str)
+
+
+_listener: Optional[_BlockingSentinelListener] = None
+_queue_handler: Optional[DroppingQueueHandler] = None
+
+
+def start_log_pipeline(filters: Iterable[logging.Filter] = (), queue_size: int = 10000) -> DroppingQueueHandler:
+    """Route root and uvicorn loggers through a bounded queue drained by a listener thread.
+
+    Filters run on the listener thread, in front of the JSON stream handler.
+    Calling this again once the pipeline is running is a no-op.
+    """
+    global _listener, _queue_handler
+    if _listener is not None and _queue_handler is not None:
+        return _queue_handler
+
+    log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter())
+    for log_filter in filters:
+        output.addFilter(log_filter)
+
+    _queue_handler = DroppingQueueHandler(log_queue)
+    logging.getLogger().handlers = [_queue_handler]
+    # uvicorn configures its own non-propagating handlers; reroute those too.
+    for logger_name in ["uvicorn", "uvicorn.access", "uvicorn.error"]:
+        logger = logging.getLogger(logger_name)
+        if logger.handlers:
+            logger.handlers = [_queue_handler]
+
+    _listener = _BlockingSentinelListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_log_pipeline)
+    return _queue_handler
+
+
+def stop_log_pipeline() -> None:
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_dropped_log_count() -> int:
+    """Number of log records dropped because the queue was full."""
+    return _queue_handler.dropped if _queue_handler else 0
@@ -1,39 +1,104 @@
-﻿from datetime import datetime, timedelta
+﻿from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+import json
 import logging
 import random
+import time
 from typing import Optional
 
-from fastapi import Depends, FastAPI, HTTPException, Query, status
-from fastapi.responses import FileResponse
-from fastapi.security import OAuth2PasswordRequestForm
+from fastapi import Depends, FastAPI, Form, HTTPException, Query, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, RedirectResponse, Response, StreamingResponse
+from pydantic import BaseModel
 from sqlalchemy.orm import Session
 
-from app import crud, models, schemas
-from app.auth import ACCESS_TOKEN_EXPIRE_MINUTES, Token, User, authenticate_user, create_access_token, get_current_user
-from app.database import engine, get_db
-from app.export import generate_csv_export
+from app import (
+    analytics,
+    bulk_export,
+    changes,
+    crud,
+    models,
+    monitoring,
+    profiling,
+    schemas,
+    search,
+    series,
+    sharding,
+    slow_queries,
+    streams,
+)
+from app.admission import add_admission_middleware
+from app.auth import (
+    MOCK_USERS,
+    Token,
+    User,
+    authenticate_user,
+    get_current_user,
+    issue_tokens,
+    require_admin,
+    verify_token,
+)
+from app.compression import add_compression_middleware
+from app.config import settings
+from app.database import SessionLocal, WriteSessionLocal, engine, get_db, get_write_db, init_database
+from app.export import EXPORT_DIR, generate_csv_export
 from app.hashing import hash_nhs_number
+from app.health import ReadinessProbe
+from app.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from app.metrics import EXPORT_DURATION, REGISTRY, MetricsMiddleware
 from app.redaction import add_redaction_middleware
+from app.storage import ArtifactNotFound, get_export_storage
 
 
-models.Base.metadata.create_all(bind=engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create tables (and optionally seed) before serving; safe with several workers."""
+    await run_in_threadpool(init_database, settings.SEED_ON_STARTUP)
+    yield
+    await observation_stream.close()
+
 
 app = FastAPI(
     title="NHS Mock EPR System",
     description="Mock Electronic Patient Record system for antipsychotic monitoring",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
+logging.basicConfig(level=logging.INFO)
 add_redaction_middleware(app)
+# Outside redaction, which must see uncompressed error bodies.
+add_compression_middleware(app)
+app.add_middleware(profiling.ProfilingMiddleware)
+# Outside everything but metrics, so rejected requests cost as little as possible and are still counted.
+add_admission_middleware(app)
+app.add_middleware(MetricsMiddleware)
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+readiness_probe = ReadinessProbe(engine, SessionLocal, EXPORT_DIR, settings.HEALTH_CACHE_SECONDS)
+observation_stream = streams.ObservationBroadcaster(
+    [shard.SessionLocal for shard in sharding.SHARDS], settings.STREAM_POLL_SECONDS, settings.STREAM_BUFFER_SIZE
+)
+streams.watch_commits(observation_stream)
+
 
 @app.post("/oauth/token", response_model=Token, tags=["Authentication"])
-async def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    """Mock OAuth2 token endpoint."""
-    user = authenticate_user(form_data.username, form_data.password)
+async def login(
+    grant_type: str = Form("password", pattern="^(password|refresh_token)$"),
+    username: Optional[str] = Form(None),
+    password: Optional[str] = Form(None),
+    refresh_token: Optional[str] = Form(None),
+):
+    """Mock OAuth2 token endpoint (password and refresh_token grants)."""
+    if grant_type == "refresh_token":
+        token_data = verify_token(refresh_token or "", token_type="refresh")
+        if token_data.username not in MOCK_USERS:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+        return issue_tokens(token_data.username)
+
+    user = authenticate_user(username or "", password or "")
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -41,9 +106,7 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(data={"sub": user["username"]}, expires_delta=access_token_expires)
-    return {"access_token": access_token, "token_type": "bearer"}
+    return issue_tokens(user["username"])
 
 
 @app.get("/oauth/userinfo", response_model=User, tags=["Authentication"])
@@ -52,33 +115,66 @@ async def get_user_info(current_user: User = Depends(get_current_user)):
     return current_user
 
 
+# FHIR-style sparse fieldsets and counts on the resource reads: `_elements=a,b` returns only those fields (and
+# `id`), and `_summary=count` returns `{"total": n}` instead of the resources. Both are answered by narrower SQL
+# (just those columns, or count(*)), so the rows are never loaded whole.
+def _elements(value: Optional[str], schema: type[BaseModel]) -> Optional[list[str]]:
+    """Fields named in an ``_elements`` parameter, in ``schema`` order and with ``id``; None for whole resources."""
+    if value is None:
+        return None
+    names = {name.strip() for name in value.split(",") if name.strip()}
+    unknown = sorted(names - set(schema.model_fields))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown element(s): {', '.join(unknown)}")
+    return [name for name in schema.model_fields if name == "id" or name in names]
+
+
 @app.get("/Patient", response_model=schemas.PatientResponse, tags=["Patient"])
 async def search_patient(
     identifier: str = Query(..., description="NHS number"),
+    elements: Optional[str] = Query(None, alias="_elements", description="Fields to return, comma-separated"),
+    summary: Optional[str] = Query(None, alias="_summary", pattern="^(count|false)$", description="count: total only"),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
     """Search for patient by NHS number."""
     logger.info("User %s searching for patient", current_user.username)
+    fields = _elements(elements, schemas.PatientResponse)
 
     try:
         nhs_hash = hash_nhs_number(identifier)
     except ValueError as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
 
-    patient = crud.get_patient_by_nhs_hash(db, nhs_hash)
+    if summary == "count":
+        return JSONResponse({"total": crud.count_patients_by_nhs_hash(db, nhs_hash)})
+    patient = crud.get_patient_by_nhs_hash(db, nhs_hash, fields)
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found")
+    if fields is not None:
+        return JSONResponse(jsonable_encoder(patient))
 
     logger.info("Patient found: %s", patient.pseudonym)
     return patient
 
 
+@app.get("/Patient/search", response_model=schemas.PatientSearchResults, tags=["Patient"])
+async def search_patients_by_pseudonym(
+    pseudonym: str = Query(..., min_length=1, description="Pseudonym prefix, e.g. PAT-0012"),
+    after: Optional[str] = Query(None, description="next_after from the previous page"),
+    limit: int = Query(50, ge=1, le=500),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Patients whose pseudonym starts with ``pseudonym``, in pseudonym order."""
+    return search.search_patients(db, pseudonym, after, limit)
+
+
 @app.post("/Patient", response_model=schemas.PatientResponse, status_code=status.HTTP_201_CREATED, tags=["Patient"])
-async def create_patient(
+def create_patient(
     patient: schemas.PatientCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_write_db),
 ):
     """Create new patient."""
     logger.info("User %s creating new patient", current_user.username)
@@ -94,17 +190,70 @@ async def create_patient(
 @app.get("/Observation", response_model=list[schemas.ObservationResponse], tags=["Observation"])
 async def get_observations(
     patient: str = Query(..., description="Patient ID"),
+    from_date: Optional[datetime] = Query(None, description="Earliest performed date (omit for full history)"),
+    to_date: Optional[datetime] = Query(None, description="Latest performed date"),
+    elements: Optional[str] = Query(None, alias="_elements", description="Fields to return, comma-separated"),
+    summary: Optional[str] = Query(None, alias="_summary", pattern="^(count|false)$", description="count: total only"),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    """Get all observations for a patient."""
+    """Get a patient's observations, newest first; archived results are included when the range reaches them."""
+    fields = _elements(elements, schemas.ObservationResponse)
     db_patient = crud.get_patient_by_id(db, patient)
     if not db_patient:
         raise HTTPException(status_code=404, detail="Patient not found")
 
-    observations = crud.get_observations(db, patient)
+    with sharding.reader(patient, db) as shard_db:
+        if summary == "count":
+            return JSONResponse({"total": crud.count_observations(shard_db, patient, from_date, to_date)})
+        observations = crud.get_observations(shard_db, patient, from_date, to_date, fields)
     logger.info("Retrieved %s observations for %s", len(observations), db_patient.pseudonym)
-    return observations
+    return observations if fields is None else JSONResponse(jsonable_encoder(observations))
+
+
+@app.get("/Observation/series", response_model=schemas.ObservationSeries, tags=["Observation"])
+async def get_observation_series(
+    patient: str = Query(..., description="Patient ID"),
+    type: str = Query(..., description="Test type (HbA1c, Weight, ECG, etc.)"),
+    from_date: Optional[datetime] = Query(None, description="Earliest performed date"),
+    to_date: Optional[datetime] = Query(None, description="Latest performed date"),
+    points: int = Query(200, ge=3, le=2000, description="Maximum points to return"),
+    method: str = Query(series.LTTB, pattern="^(lttb|bucket)$", description="Downsampling method"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """One test's results for a patient, downsampled on the server for trend charts."""
+    db_patient = crud.get_patient_by_id(db, patient)
+    if not db_patient:
+        raise HTTPException(status_code=404, detail="Patient not found")
+
+    with sharding.reader(patient, db) as shard_db:
+        return series.observation_series(shard_db, patient, type, from_date, to_date, points, method)
+
+
+@app.get("/Observation/stream", tags=["Observation"])
+async def stream_observations(
+    patient: Optional[str] = Query(None, description="Only this patient's observations"),
+    interpretation: Optional[str] = Query(None, pattern="^(NORMAL|ABNORMAL|CRITICAL)$"),
+    current_user: User = Depends(get_current_user),
+):
+    """Server-sent events for observations as they are committed (``observation`` and ``dropped`` events)."""
+    return StreamingResponse(
+        streams.sse_events(observation_stream, patient, interpretation, settings.STREAM_KEEPALIVE_SECONDS),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _patient_for_write(db: Session, patient_id: str) -> Optional[models.Patient]:
+    """Look up the patient a write is for; when sharded, without taking the primary's write lock."""
+    if not sharding.SHARDED:
+        return crud.get_patient_by_id(db, patient_id)
+    read_db = SessionLocal()
+    try:
+        return crud.get_patient_by_id(read_db, patient_id)
+    finally:
+        read_db.close()
 
 
 @app.post(
@@ -113,17 +262,18 @@ async def get_observations(
     status_code=status.HTTP_201_CREATED,
     tags=["Observation"],
 )
-async def create_observation(
+def create_observation(
     observation: schemas.ObservationCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_write_db),
 ):
     """Create new observation."""
-    db_patient = crud.get_patient_by_id(db, observation.patient_id)
+    db_patient = _patient_for_write(db, observation.patient_id)
     if not db_patient:
         raise HTTPException(status_code=404, detail="Patient not found")
 
-    db_obs = crud.create_observation(db, observation)
+    with sharding.writer(observation.patient_id, db) as shard_db:
+        db_obs = crud.create_observation(shard_db, observation)
     logger.info("Observation created for %s: %s", db_patient.pseudonym, observation.type)
     return db_obs
 
@@ -131,17 +281,43 @@ async def create_observation(
 @app.get("/MedicationRequest", response_model=list[schemas.MedicationResponse], tags=["Medication"])
 async def get_medications(
     patient: str = Query(..., description="Patient ID"),
+    elements: Optional[str] = Query(None, alias="_elements", description="Fields to return, comma-separated"),
+    summary: Optional[str] = Query(None, alias="_summary", pattern="^(count|false)$", description="count: total only"),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
     """Get all medications for a patient."""
+    fields = _elements(elements, schemas.MedicationResponse)
     db_patient = crud.get_patient_by_id(db, patient)
     if not db_patient:
         raise HTTPException(status_code=404, detail="Patient not found")
 
-    medications = crud.get_medications(db, patient)
+    with sharding.reader(patient, db) as shard_db:
+        if summary == "count":
+            return JSONResponse({"total": crud.count_medications(shard_db, patient)})
+        medications = crud.get_medications(shard_db, patient, fields)
     logger.info("Retrieved %s medications for %s", len(medications), db_patient.pseudonym)
-    return medications
+    return medications if fields is None else JSONResponse(jsonable_encoder(medications))
+
+
+@app.get("/MedicationRequest/search", response_model=schemas.MedicationSearchResults, tags=["Medication"])
+async def search_medications(
+    drug: str = Query(..., min_length=1, description="Drug name, part of one, or a misspelling"),
+    active: bool = Query(False, description="Only prescriptions running today"),
+    after: Optional[str] = Query(None, description="next_after from the previous page"),
+    limit: int = Query(50, ge=1, le=500),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Prescriptions of every drug whose name matches ``drug`` (substring or fuzzy), with each patient's pseudonym."""
+    try:
+        after_key = search.decode_cursor(after, 2) if after else None
+    except search.InvalidCursor as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+    active_on = datetime.utcnow() if active else None
+    pages = sharding.scatter(db, search.search_medications, drug, active_on, after_key, limit)
+    return search.merge_medication_pages(pages, limit)
 
 
 @app.post(
@@ -150,17 +326,18 @@ async def get_medications(
     status_code=status.HTTP_201_CREATED,
     tags=["Medication"],
 )
-async def create_medication(
+def create_medication(
     medication: schemas.MedicationCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_write_db),
 ):
     """Create new medication."""
-    db_patient = crud.get_patient_by_id(db, medication.patient_id)
+    db_patient = _patient_for_write(db, medication.patient_id)
     if not db_patient:
         raise HTTPException(status_code=404, detail="Patient not found")
 
-    db_med = crud.create_medication(db, medication)
+    with sharding.writer(medication.patient_id, db) as shard_db:
+        db_med = crud.create_medication(shard_db, medication)
     logger.info("Medication created for %s: %s", db_patient.pseudonym, medication.drug_name)
     return db_med
 
@@ -170,6 +347,7 @@ async def create_csv_export(
     patient_id: Optional[str] = Query(None, description="Patient ID (optional - exports all if not provided)"),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
+    write_db: Session = Depends(get_write_db),
 ):
     """Create CSV export job."""
     if patient_id:
@@ -180,14 +358,21 @@ async def create_csv_export(
     else:
         logger.info("Creating export for all patients")
 
-    job = crud.create_export_job(db, patient_id)
+    # Job bookkeeping uses the write session; release its write lock before the (slow,
+    # read-only) CSV generation. Waiting for the lock happens in the threadpool, not on the event loop.
+    job = await run_in_threadpool(crud.create_export_job, write_db, patient_id)
+    write_db.close()
 
+    started = time.perf_counter()
     try:
-        zip_path = generate_csv_export(db, job.id, patient_id)
-        job = crud.update_export_job(db, job.id, zip_path, "COMPLETE") or job
+        # Reads every row and, with EXPORT_STORAGE=s3, uploads the ZIP: keep both off the event loop.
+        artifact_key = await run_in_threadpool(generate_csv_export, db, job.id, patient_id)
+        job = await run_in_threadpool(crud.update_export_job, write_db, job.id, artifact_key, "COMPLETE") or job
+        EXPORT_DURATION.observe(time.perf_counter() - started, status="COMPLETE")
         logger.info("Export job %s completed", job.id)
     except Exception as exc:
-        crud.update_export_job(db, job.id, None, "FAILED")
+        EXPORT_DURATION.observe(time.perf_counter() - started, status="FAILED")
+        await run_in_threadpool(crud.update_export_job, write_db, job.id, None, "FAILED")
         logger.error("Export job %s failed: %s", job.id, exc)
         raise HTTPException(status_code=500, detail="Export failed") from exc
 
@@ -210,7 +395,230 @@ async def download_csv_export(
         raise HTTPException(status_code=404, detail="Export file not found")
 
     logger.info("User %s downloading export %s", current_user.username, job_id)
-    return FileResponse(job.csv_path, media_type="application/zip", filename=f"epr_export_{job_id}.zip")
+    return await _artifact_response(job.csv_path, f"epr_export_{job_id}.zip", "application/zip")
+
+
+async def _artifact_response(
+    key: str, filename: str, media_type: str, gzipped: bool = False, accepts_gzip: bool = False
+) -> Response:
+    """Redirect to a pre-signed storage URL when enabled, otherwise stream the artifact through the API."""
+    storage = get_export_storage()
+    if settings.EXPORT_PRESIGNED_URLS:
+        url = await run_in_threadpool(storage.presigned_url, key, filename, settings.EXPORT_PRESIGNED_TTL_SECONDS)
+        if url:
+            return RedirectResponse(url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
+
+    try:
+        size = await run_in_threadpool(storage.size, key)
+        chunks = await run_in_threadpool(storage.iter_bytes, key)
+    except ArtifactNotFound as exc:
+        raise HTTPException(status_code=404, detail="Export file not found") from exc
+
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if gzipped and not accepts_gzip:
+        return StreamingResponse(bulk_export.gunzip(chunks), media_type=media_type, headers=headers)
+    headers["Content-Length"] = str(size)
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
+
+
+@app.get("/$export", status_code=status.HTTP_202_ACCEPTED, tags=["Bulk Data"])
+@app.get("/Patient/$export", status_code=status.HTTP_202_ACCEPTED, tags=["Bulk Data"])
+def bulk_export_kickoff(
+    request: Request,
+    resource_types: Optional[str] = Query(None, alias="_type", description="Comma-separated resource types"),
+    since: Optional[datetime] = Query(None, alias="_since", description="Only resources created at or after"),
+    output_format: Optional[str] = Query(None, alias="_outputFormat"),
+    current_user: User = Depends(get_current_user),
+    write_db: Session = Depends(get_write_db),
+):
+    """Start a FHIR Bulk Data export; poll the Content-Location URL for the manifest."""
+    try:
+        types = bulk_export.parse_types(resource_types)
+    except ValueError as exc:
+        return JSONResponse(bulk_export.operation_outcome(str(exc)), status_code=400)
+    if output_format and output_format not in bulk_export.OUTPUT_FORMATS:
+        return JSONResponse(
+            bulk_export.operation_outcome(f"Unsupported _outputFormat: {output_format}"), status_code=400
+        )
+
+    job = models.BulkExportJob(
+        request_url=str(request.url),
+        resource_types=",".join(types),
+        since=since.replace(tzinfo=None) if since else None,
+        transaction_time=datetime.utcnow(),
+    )
+    job.heartbeat_at = job.transaction_time
+    write_db.add(job)
+    write_db.commit()
+    job_id = job.id
+    write_db.close()
+
+    bulk_export.submit(job_id, SessionLocal, WriteSessionLocal)
+    logger.info("User %s started bulk export %s (%s)", current_user.username, job_id, ",".join(types))
+    return Response(
+        status_code=status.HTTP_202_ACCEPTED,
+        headers={"Content-Location": str(request.url_for("bulk_export_status", job_id=job_id))},
+    )
+
+
+@app.get("/$export-status/{job_id}", tags=["Bulk Data"])
+async def bulk_export_status(
+    job_id: str,
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """202 with X-Progress while running, then the Bulk Data completion manifest."""
+    job = db.get(models.BulkExportJob, job_id)
+    if not job:
+        return JSONResponse(bulk_export.operation_outcome("Export job not found", "not-found"), status_code=404)
+    if job.status in (bulk_export.PENDING, bulk_export.RUNNING) and bulk_export.is_stale(job):
+        # The worker holding it went away after this worker started; fail it rather than answer 202 for ever.
+        await run_in_threadpool(bulk_export.reap_stale_jobs, WriteSessionLocal)
+        db.rollback()  # leave the read snapshot taken before the update
+        db.refresh(job)
+    if job.status in (bulk_export.PENDING, bulk_export.RUNNING):
+        return Response(
+            status_code=status.HTTP_202_ACCEPTED,
+            headers={"X-Progress": job.progress or job.status.lower(), "Retry-After": "2"},
+        )
+    if job.status == bulk_export.FAILED:
+        return JSONResponse(bulk_export.operation_outcome(job.error or "Export failed", "exception"), status_code=500)
+
+    return {
+        "transactionTime": job.transaction_time.isoformat() + "Z",
+        "request": job.request_url,
+        "requiresAccessToken": True,
+        "output": [
+            {
+                "type": item["type"],
+                "url": str(request.url_for("bulk_export_file", job_id=job.id, resource_type=item["type"])),
+                "count": item["count"],
+            }
+            for item in json.loads(job.output or "[]")
+        ],
+        "error": [],
+    }
+
+
+@app.delete("/$export-status/{job_id}", status_code=status.HTTP_202_ACCEPTED, tags=["Bulk Data"])
+def bulk_export_delete(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+    write_db: Session = Depends(get_write_db),
+):
+    """Delete a finished export's files and record."""
+    job = write_db.get(models.BulkExportJob, job_id)
+    if not job:
+        return JSONResponse(bulk_export.operation_outcome("Export job not found", "not-found"), status_code=404)
+    if job.status in (bulk_export.PENDING, bulk_export.RUNNING):
+        return JSONResponse(bulk_export.operation_outcome("Export is still running", "conflict"), status_code=409)
+    bulk_export.delete_job(write_db, job)
+    return Response(status_code=status.HTTP_202_ACCEPTED)
+
+
+@app.get("/$export-file/{job_id}/{resource_type}", tags=["Bulk Data"])
+async def bulk_export_file(
+    job_id: str,
+    resource_type: str,
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """One NDJSON output file, gzip-encoded when stored compressed and the client accepts it."""
+    job = db.get(models.BulkExportJob, job_id)
+    outputs = json.loads(job.output or "[]") if job and job.status == bulk_export.COMPLETE else []
+    item = next((o for o in outputs if o["type"] == resource_type), None)
+    if not item:
+        raise HTTPException(status_code=404, detail="Export file not found")
+
+    logger.info("User %s downloading bulk export %s %s", current_user.username, job_id, resource_type)
+    return await _artifact_response(
+        item["key"],
+        f"{resource_type}.ndjson",
+        bulk_export.NDJSON,
+        gzipped=item["key"].endswith(".gz"),
+        accepts_gzip="gzip" in request.headers.get("accept-encoding", ""),
+    )
+
+
+@app.get("/_changes", response_model=schemas.ChangeList, tags=["Sync"])
+async def list_changes(
+    since: str = Query(
+        "0", pattern=r"^\d+(\.\d+)*$", description="`last_seq` of the last page processed (0 for everything)"
+    ),
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Created patients, observations and medications after ``since``, in commit order within each database."""
+    try:
+        return changes.list_changes(db, since, limit)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+
+@app.get("/analytics/observations", response_model=list[schemas.ObservationCount], tags=["Analytics"])
+async def observation_counts(
+    from_month: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$", description="First month (YYYY-MM)"),
+    to_month: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$", description="Last month (YYYY-MM)"),
+    type: Optional[str] = Query(None, description="Test type (HbA1c, Weight, ECG, etc.)"),
+    interpretation: Optional[str] = Query(None, pattern="^(NORMAL|ABNORMAL|CRITICAL)$"),
+    drug_name: Optional[str] = Query(None, description="Only observations taken while on this drug"),
+    by_drug: bool = Query(False, description="Break counts down by the drugs patients were on"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Observation counts by month, type and interpretation (optionally per drug), from summary tables."""
+    parts = sharding.scatter(
+        db, analytics.observation_counts, from_month, to_month, type, interpretation, drug_name, by_drug
+    )
+    return analytics.merge_counts(parts, ["drug_name", "month", "type", "interpretation"])
+
+
+@app.get("/analytics/medications/active", response_model=list[schemas.ActiveMedicationCount], tags=["Analytics"])
+async def active_medication_counts(
+    on_date: Optional[date] = Query(None, description="Date to count active medications on (default today)"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Active medications per drug on a date, from summary tables."""
+    parts = sharding.scatter(db, analytics.active_medication_counts, on_date or datetime.utcnow().date())
+    return analytics.merge_counts(parts, ["drug_name"], count="active")
+
+
+@app.get("/monitoring/due", response_model=schemas.MonitoringDueList, tags=["Monitoring"])
+async def monitoring_due_list(
+    type: Optional[str] = Query(None, description="Only this test type (default: all monitored tests)"),
+    interval_days: Optional[int] = Query(None, ge=1, description="Override the configured interval(s)"),
+    limit: int = Query(100, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Patients overdue for a monitoring test, or on a monitored drug with no baseline result."""
+    try:
+        intervals = monitoring.configured_intervals(type, interval_days)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+    now = datetime.utcnow()
+    if sharding.SHARDED:
+        # Every shard's first offset + limit + 1 items, merged into the requested page.
+        parts = sharding.scatter(db, monitoring.due_list, now, intervals, settings.MONITORED_DRUGS, offset + limit + 1)
+        items = monitoring.merge_due_lists(parts, limit + 1, offset)
+    else:
+        items = monitoring.due_list(db, now, intervals, settings.MONITORED_DRUGS, limit=limit + 1, offset=offset)
+    next_offset = offset + limit if len(items) > limit else None
+    return {
+        "items": items[:limit],
+        "intervals": intervals,
+        "offset": offset,
+        "limit": limit,
+        "next_offset": next_offset,
+    }
 
 
 @app.get("/health", tags=["System"])
@@ -219,15 +627,62 @@ async def health_check():
     return {"status": "healthy", "version": "1.0.0"}
 
 
+@app.get("/health/live", tags=["System"])
+async def liveness_check():
+    """Liveness probe: the process is up and serving requests (no dependencies checked)."""
+    return {"status": "alive"}
+
+
+@app.get("/health/ready", tags=["System"])
+async def readiness_check(response: Response):
+    """Readiness probe: DB round trip, pool saturation, export queue and disk headroom (cached)."""
+    result = await run_in_threadpool(readiness_probe.status)
+    if result["status"] != "ready":
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return {**result, "version": "1.0.0"}
+
+
+@app.get("/metrics", tags=["System"])
+async def metrics():
+    """Prometheus text-format metrics."""
+    return Response(content=REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+@app.get("/admin/profiles", tags=["Admin"])
+async def list_request_profiles(current_user: User = Depends(require_admin)):
+    """List recently profiled requests (captured with X-EPR-Profile: 1 or ?_profile=1)."""
+    return profiling.list_profiles()
+
+
+@app.get("/admin/profiles/{profile_id}", tags=["Admin"])
+async def get_request_profile(profile_id: str, current_user: User = Depends(require_admin)):
+    """Get a captured request profile with collapsed stacks and SQL timings."""
+    profile = profiling.get_profile(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile
+
+
+@app.get("/admin/slow-queries", tags=["Admin"])
+async def list_slow_queries(
+    limit: int = Query(50, ge=1, le=500),
+    current_user: User = Depends(require_admin),
+):
+    """Slow statements aggregated by normalized SQL, with their query plans."""
+    if slow_query_log := slow_queries.slow_query_log:
+        return {"threshold_ms": slow_query_log.threshold_ms, "queries": slow_query_log.summary(limit)}
+    return {"threshold_ms": None, "queries": []}
+
+
 @app.post("/simulate/events", tags=["Simulator"])
-async def simulate_events(
+def simulate_events(
     patient_id: str = Query(..., description="Patient ID"),
     count: int = Query(10, ge=1, le=50, description="Number of events to generate"),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_write_db),
 ):
     """Generate random observations for a patient."""
-    db_patient = crud.get_patient_by_id(db, patient_id)
+    db_patient = _patient_for_write(db, patient_id)
     if not db_patient:
         raise HTTPException(status_code=404, detail="Patient not found")
 
@@ -260,7 +715,8 @@ async def simulate_events(
             interpretation=interpretation,
             performed_date=datetime.utcnow() - timedelta(days=random.randint(1, 90)),
         )
-        crud.create_observation(db, obs)
+        with sharding.writer(patient_id, db) as shard_db:
+            crud.create_observation(shard_db, obs)
 
     logger.info("Generated %s simulated events for %s", count, db_patient.pseudonym)
     return {"message": f"Created {count} observations", "patient_pseudonym": db_patient.pseudonym}
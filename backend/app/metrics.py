@@ -0,0 +1,336 @@
+﻿import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional, Sequence, Tuple, TypeVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.logging_pipeline import get_dropped_log_count
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250, 1000)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    @abstractmethod
+    def _samples(self) -> list[str]:
+        """Exposition lines for this metric's current values."""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing counter."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, or be read from a callback at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        callback: Optional[Callable[[], float]] = None,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._callbacks: Dict[Tuple[str, ...], Callable[[], float]] = {}
+        if callback is not None:
+            self.set_callback(callback)
+
+    def set_callback(self, callback: Callable[[], float], **labels: str) -> None:
+        """Read the value for ``labels`` from ``callback`` at scrape time (replacing any earlier one)."""
+        with self._lock:
+            self._callbacks[self._key(labels)] = callback
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            values = dict(self._values)
+            callbacks = list(self._callbacks.items())
+        values.update((key, callback()) for key, callback in callbacks)
+        items = sorted(values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    """Cumulative histogram with fixed upper bounds."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = sorted((k, ([*v[0]], v[1], v[2])) for k, v in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+MetricT = TypeVar("MetricT", bound=_Metric)
+
+
+class Registry:
+    """Collection of metrics rendered in the Prometheus text exposition format."""
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: MetricT) -> MetricT:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_REQUESTS = REGISTRY.register(
+    Counter("epr_http_requests_total", "HTTP requests by route, method and status.", ["method", "route", "status"])
+)
+HTTP_LATENCY = REGISTRY.register(
+    Histogram("epr_http_request_duration_seconds", "HTTP request latency by route.", ["method", "route"])
+)
+HTTP_IN_FLIGHT = REGISTRY.register(Gauge("epr_http_requests_in_flight", "HTTP requests currently being served."))
+DB_QUERIES = REGISTRY.register(
+    Histogram("epr_db_queries_per_request", "SQL statements issued per request.", ["route"], COUNT_BUCKETS)
+)
+DB_QUERY_TIME = REGISTRY.register(
+    Histogram("epr_db_query_time_per_request_seconds", "Total SQL time per request.", ["route"], DB_BUCKETS)
+)
+DB_STATEMENT_LATENCY = REGISTRY.register(
+    Histogram("epr_db_statement_duration_seconds", "Duration of individual SQL statements.", buckets=DB_BUCKETS)
+)
+DB_POOL_WAIT = REGISTRY.register(
+    Histogram("epr_db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection.", buckets=DB_BUCKETS)
+)
+DB_POOL_CHECKED_OUT = REGISTRY.register(
+    Gauge("epr_db_pool_checked_out", "Connections currently checked out of each database's pool.", ["database"])
+)
+EXPORT_DURATION = REGISTRY.register(
+    Histogram(
+        "epr_export_job_duration_seconds",
+        "CSV export job duration by outcome.",
+        ["status"],
+        (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0),
+    )
+)
+STREAM_SUBSCRIBERS = REGISTRY.register(Gauge("epr_stream_subscribers", "Open observation stream connections."))
+STREAM_EVENTS_DROPPED = REGISTRY.register(
+    Counter("epr_stream_events_dropped_total", "Stream events dropped because a subscriber's buffer was full.")
+)
+ADMISSION_REJECTED = REGISTRY.register(
+    Counter(
+        "epr_admission_rejected_total",
+        "Requests answered 429 by admission control, by route class and reason.",
+        ["route_class", "reason"],
+    )
+)
+LOG_RECORDS_DROPPED = REGISTRY.register(
+    Gauge("epr_log_records_dropped", "Log records dropped because the log queue was full.", callback=get_dropped_log_count)
+)
+
+
+class RequestStats:
+    """SQL activity attributed to the current request."""
+
+    __slots__ = ("queries", "query_seconds", "statements", "scope")
+
+    def __init__(self, scope: Optional[Scope] = None) -> None:
+        self.scope = scope
+        self.queries = 0
+        self.query_seconds = 0.0
+        # Set to a list (e.g. by the profiler) to also capture (statement, seconds) pairs.
+        self.statements: Optional[list] = None
+
+    @property
+    def endpoint(self) -> str:
+        """Route template of the request (e.g. ``GET /Observation``), once routing has happened."""
+        if self.scope is None:
+            return "unknown"
+        path = getattr(self.scope.get("route"), "path", self.scope.get("path", "unknown"))
+        return f"{self.scope.get('method', '')} {path}".strip()
+
+
+# Holds a mutable RequestStats so threadpool copies of the context report into the same object.
+current_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("current_request_stats", default=None)
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Record statement timings and pool checkout wait for an engine."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+        DB_STATEMENT_LATENCY.observe(elapsed)
+        stats = current_request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.query_seconds += elapsed
+            if stats.statements is not None:
+                stats.statements.append((statement, elapsed))
+
+    def _wrap_pool(pool) -> None:
+        connect = pool.connect
+
+        def timed_connect():
+            started = time.perf_counter()
+            try:
+                return connect()
+            finally:
+                DB_POOL_WAIT.observe(time.perf_counter() - started)
+
+        pool.connect = timed_connect
+
+    _wrap_pool(engine.pool)
+    if hasattr(engine.pool, "checkedout"):
+        # One series per database (primary and each shard); an engine re-created for the same URL takes over.
+        DB_POOL_CHECKED_OUT.set_callback(
+            lambda: engine.pool.checkedout(), database=engine.url.render_as_string(hide_password=True)
+        )
+
+    @event.listens_for(engine, "engine_disposed")
+    def _engine_disposed(target):
+        # dispose() replaces the pool; instrument its successor too.
+        _wrap_pool(target.pool)
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording per-route request counts, latency and SQL activity."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        stats = RequestStats(scope)
+        token = current_request_stats.set(stats)
+        HTTP_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_IN_FLIGHT.dec()
+            current_request_stats.reset(token)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            method = scope["method"]
+            HTTP_REQUESTS.inc(method=method, route=route, status=str(status_code))
+            HTTP_LATENCY.observe(elapsed, method=method, route=route)
+            DB_QUERIES.observe(stats.queries, route=route)
+            DB_QUERY_TIME.observe(stats.query_seconds, route=route)
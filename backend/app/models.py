@@ -1,21 +1,19 @@
 ﻿from datetime import datetime
-import uuid
 
-from sqlalchemy import Column, DateTime, Float, ForeignKey, String
+from sqlalchemy import Column, Date, DateTime, Float, ForeignKey, Index, Integer, String, Text
 from sqlalchemy.orm import declarative_base, relationship
 
-
-Base = declarative_base()
+from app.codes import Coded
+from app.keys import UUIDKey, generate_uuid
 
 
-def generate_uuid() -> str:
-    return str(uuid.uuid4())
+Base = declarative_base()
 
 
 class Patient(Base):
     __tablename__ = "patients"
 
-    id = Column(String, primary_key=True, default=generate_uuid)
+    id = Column(UUIDKey, primary_key=True, default=generate_uuid)
     nhs_hash = Column(String, unique=True, nullable=False, index=True)
     pseudonym = Column(String, unique=True, nullable=False, index=True)
     sex = Column(String, nullable=False)
@@ -28,25 +26,48 @@ class Patient(Base):
 
 class Observation(Base):
     __tablename__ = "observations"
+    __table_args__ = (
+        Index("ix_observations_patient_type_performed_date", "patient_id", "type", "performed_date"),
+    )
 
-    id = Column(String, primary_key=True, default=generate_uuid)
-    patient_id = Column(String, ForeignKey("patients.id"), nullable=False)
-    type = Column(String, nullable=False)
+    id = Column(UUIDKey, primary_key=True, default=generate_uuid)
+    patient_id = Column(UUIDKey, ForeignKey("patients.id"), nullable=False)
+    type = Column(Coded("observation_types"), nullable=False)
     value = Column(Float, nullable=False)
-    unit = Column(String, nullable=False)
-    interpretation = Column(String, nullable=False)
+    unit = Column(Coded("units"), nullable=False)
+    interpretation = Column(Coded("interpretations"), nullable=False)
     performed_date = Column(DateTime, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
 
     patient = relationship("Patient", back_populates="observations")
 
 
+class ArchivedObservation(Base):
+    """Observations moved out of ``observations`` by app.archive; read through ``archive.observations(db)``."""
+
+    __tablename__ = "observations_archive"
+    __table_args__ = (
+        Index("ix_observations_archive_patient_type_performed_date", "patient_id", "type", "performed_date"),
+    )
+
+    id = Column(UUIDKey, primary_key=True)
+    patient_id = Column(UUIDKey, ForeignKey("patients.id"), nullable=False)
+    type = Column(Coded("observation_types"), nullable=False)
+    value = Column(Float, nullable=False)
+    unit = Column(Coded("units"), nullable=False)
+    interpretation = Column(Coded("interpretations"), nullable=False)
+    performed_date = Column(DateTime, nullable=False, index=True)
+    created_at = Column(DateTime, index=True)
+
+
 class Medication(Base):
     __tablename__ = "medications"
+    # Drug-name search pages through one drug's prescriptions in id order (app.search).
+    __table_args__ = (Index("ix_medications_drug_name_id", "drug_name", "id"),)
 
-    id = Column(String, primary_key=True, default=generate_uuid)
-    patient_id = Column(String, ForeignKey("patients.id"), nullable=False)
-    drug_name = Column(String, nullable=False)
+    id = Column(UUIDKey, primary_key=True, default=generate_uuid)
+    patient_id = Column(UUIDKey, ForeignKey("patients.id"), nullable=False, index=True)
+    drug_name = Column(Coded("drug_names"), nullable=False)
     dose = Column(String, nullable=False)
     start_date = Column(DateTime, nullable=False)
     stop_date = Column(DateTime, nullable=True)
@@ -55,11 +76,133 @@ class Medication(Base):
     patient = relationship("Patient", back_populates="medications")
 
 
+# Code tables (app.codes): coded columns store the id of their value's row here.
+
+
+class ObservationType(Base):
+    __tablename__ = "observation_types"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+
+
+class Unit(Base):
+    __tablename__ = "units"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+
+
+class Interpretation(Base):
+    __tablename__ = "interpretations"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+
+
+class DrugName(Base):
+    """Drug names prescribed in this database; SQLite indexes them in drug_name_search (FTS5) for app.search."""
+
+    __tablename__ = "drug_names"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+
+
+class LatestObservation(Base):
+    """Most recent result per patient and test type, maintained by app.monitoring on every write.
+
+    Rows with a NULL performed_date mark monitored tests with no result yet for a
+    patient prescribed one of MONITORED_DRUGS.
+    """
+
+    __tablename__ = "latest_observations"
+    __table_args__ = (Index("ix_latest_observations_type_performed_date", "type", "performed_date", "patient_id"),)
+
+    patient_id = Column(UUIDKey, ForeignKey("patients.id"), primary_key=True)
+    type = Column(Coded("observation_types"), primary_key=True)
+    value = Column(Float, nullable=True)
+    unit = Column(Coded("units"), nullable=True)
+    interpretation = Column(Coded("interpretations"), nullable=True)
+    performed_date = Column(DateTime, nullable=True)
+
+
 class ExportJob(Base):
     __tablename__ = "export_jobs"
 
-    id = Column(String, primary_key=True, default=generate_uuid)
-    patient_id = Column(String, ForeignKey("patients.id"), nullable=True)
+    id = Column(UUIDKey, primary_key=True, default=generate_uuid)
+    patient_id = Column(UUIDKey, ForeignKey("patients.id"), nullable=True)
     csv_path = Column(String, nullable=True)
     status = Column(String, default="PENDING")
     created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class BulkExportJob(Base):
+    """FHIR Bulk Data ($export) job; ``output`` is the JSON list of NDJSON files once complete."""
+
+    __tablename__ = "bulk_export_jobs"
+
+    id = Column(UUIDKey, primary_key=True, default=generate_uuid)
+    status = Column(String, nullable=False, default="PENDING")
+    progress = Column(String, nullable=True)
+    request_url = Column(String, nullable=False)
+    resource_types = Column(String, nullable=False)
+    since = Column(DateTime, nullable=True)
+    transaction_time = Column(DateTime, nullable=True)
+    output = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # Refreshed by the worker holding the job while it is queued or running; a stale value means that worker is gone.
+    heartbeat_at = Column(DateTime, nullable=True)
+
+
+# Summary tables below are maintained incrementally by app.analytics on every write.
+
+
+class ObservationMonthlyCount(Base):
+    """Observations per month of performed_date, test type and interpretation."""
+
+    __tablename__ = "observation_monthly_counts"
+
+    month = Column(String, primary_key=True)  # YYYY-MM
+    type = Column(String, primary_key=True)
+    interpretation = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class ObservationDrugMonthlyCount(Base):
+    """Observations counted against each drug the patient was on when the test was performed."""
+
+    __tablename__ = "observation_drug_monthly_counts"
+
+    drug_name = Column(String, primary_key=True)
+    month = Column(String, primary_key=True)
+    type = Column(String, primary_key=True)
+    interpretation = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class MedicationDailyActivity(Base):
+    """Medications starting and stopping per drug and day; running sums give active counts."""
+
+    __tablename__ = "medication_daily_activity"
+
+    drug_name = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    starts = Column(Integer, nullable=False, default=0)
+    stops = Column(Integer, nullable=False, default=0)
+
+
+class ChangeLogEntry(Base):
+    """Append-only record of created resources, paged by GET /_changes."""
+
+    __tablename__ = "change_log"
+    # AUTOINCREMENT so SQLite never reuses a sequence number, even after old entries are pruned.
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    resource_type = Column(String, nullable=False)
+    resource_id = Column(UUIDKey, nullable=False)
+    patient_id = Column(UUIDKey, nullable=True)
+    action = Column(String, nullable=False, default="create")
+    changed_at = Column(DateTime, default=datetime.utcnow, nullable=False)
@@ -0,0 +1,219 @@
+﻿import heapq
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Optional
+
+from sqlalchemy import delete, exists, func, insert, literal, or_, select, union_all
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from app import archive, codes, models
+from app.config import settings
+
+
+OVERDUE = "OVERDUE"
+NO_BASELINE = "NO_BASELINE"
+
+
+def _upsert(db: Session, table):
+    """Dialect ``insert`` for ON CONFLICT statements, or None when the ORM fallback is needed."""
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        return sqlite_insert(table)
+    if dialect == "postgresql":
+        return pg_insert(table)
+    return None
+
+
+def record_observation(db: Session, obs: models.Observation) -> None:
+    """Keep latest_observations pointing at the newest result per (patient, type), in the caller's transaction."""
+    table = models.LatestObservation.__table__
+    values = {
+        "patient_id": obs.patient_id,
+        "type": obs.type,
+        "value": obs.value,
+        "unit": obs.unit,
+        "interpretation": obs.interpretation,
+        "performed_date": obs.performed_date,
+    }
+    stmt = _upsert(db, table)
+    if stmt is not None:
+        stmt = stmt.values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["patient_id", "type"],
+            set_={name: stmt.excluded[name] for name in ("value", "unit", "interpretation", "performed_date")},
+            # Fill a no-baseline placeholder, but never let a back-dated result replace a newer one.
+            where=or_(table.c.performed_date.is_(None), stmt.excluded.performed_date > table.c.performed_date),
+        )
+        db.execute(stmt)
+        return
+
+    latest = db.get(models.LatestObservation, {"patient_id": obs.patient_id, "type": obs.type})
+    if latest is None:
+        db.add(models.LatestObservation(**values))
+    elif latest.performed_date is None or obs.performed_date > latest.performed_date:
+        for name, value in values.items():
+            setattr(latest, name, value)
+
+
+def record_medication(db: Session, med: models.Medication) -> None:
+    """Add no-baseline placeholders for each monitored test when a monitored drug is prescribed."""
+    if med.drug_name not in settings.MONITORED_DRUGS:
+        return
+    rows = [{"patient_id": med.patient_id, "type": test_type} for test_type in settings.MONITORING_INTERVAL_DAYS]
+    if not rows:
+        return
+    codes.intern(db, models.LatestObservation.type, *settings.MONITORING_INTERVAL_DAYS)
+    stmt = _upsert(db, models.LatestObservation.__table__)
+    if stmt is not None:
+        db.execute(stmt.on_conflict_do_nothing(index_elements=["patient_id", "type"]), rows)
+        return
+
+    for row in rows:
+        if db.get(models.LatestObservation, row) is None:
+            db.add(models.LatestObservation(**row))
+
+
+def due_list(
+    db: Session,
+    now: datetime,
+    intervals: dict[str, int],
+    drugs: list[str],
+    limit: int = 100,
+    offset: int = 0,
+) -> list[dict]:
+    """Monitoring items due at ``now``, most urgent first.
+
+    A patient is due for a test when their latest result for it is older than
+    its interval, or when they are currently on one of ``drugs`` and have no
+    result yet (a placeholder row). Both are range scans over
+    ix_latest_observations_type_performed_date, one pair per test.
+    """
+    latest = models.LatestObservation
+    med = models.Medication
+    patient = models.Patient
+    on_drug = exists().where(
+        med.patient_id == latest.patient_id,
+        med.drug_name.in_(drugs),
+        med.start_date <= now,
+        or_(med.stop_date.is_(None), med.stop_date >= now),
+    )
+
+    def part(status: str, *conditions):
+        return (
+            select(
+                latest.patient_id.label("patient_id"),
+                patient.pseudonym.label("pseudonym"),
+                latest.type.label("type"),
+                literal(status).label("status"),
+                latest.performed_date.label("last_performed_date"),
+            )
+            .join(patient, patient.id == latest.patient_id)
+            .where(*conditions)
+        )
+
+    parts = []
+    for test_type, days in intervals.items():
+        parts.append(part(OVERDUE, latest.type == test_type, latest.performed_date < now - timedelta(days=days)))
+        if drugs:
+            # Placeholders only count while the patient is still on a monitored drug.
+            parts.append(part(NO_BASELINE, latest.type == test_type, latest.performed_date.is_(None), on_drug))
+    if not parts:
+        return []
+
+    # Ordered like ix_latest_observations_type_performed_date, so each test's range scan is read in
+    # order and merged, stopping after the requested page. NULL dates (NO_BASELINE) sort first.
+    query = union_all(*parts).order_by("last_performed_date", "patient_id", "type").limit(limit).offset(offset)
+    rows = db.execute(query)
+    return [
+        {
+            "patient_id": row.patient_id,
+            "pseudonym": row.pseudonym,
+            "type": row.type,
+            "status": row.status,
+            "last_performed_date": row.last_performed_date,
+            "days_since": (now - row.last_performed_date).days if row.last_performed_date else None,
+        }
+        for row in rows
+    ]
+
+
+def merge_due_lists(parts: list[list[dict]], limit: int, offset: int = 0) -> list[dict]:
+    """Merge per-shard due lists (each fetched from offset 0) into one page in due_list order."""
+    # Shards hold different patients, so ties end at patient_id; each shard's own order (by its type
+    # codes) is kept for one patient's items.
+    ordered = heapq.merge(
+        *parts,
+        key=lambda item: (
+            item["last_performed_date"] is not None,
+            item["last_performed_date"] or datetime.min,
+            item["patient_id"],
+        ),
+    )
+    return list(islice(ordered, offset, offset + limit))
+
+
+def configured_intervals(test_type: Optional[str] = None, interval_days: Optional[int] = None) -> dict[str, int]:
+    """MONITORING_INTERVAL_DAYS, optionally narrowed to one test and/or overridden with one interval."""
+    intervals = dict(settings.MONITORING_INTERVAL_DAYS)
+    if test_type:
+        if test_type not in intervals and not interval_days:
+            raise ValueError(f"{test_type} is not a monitored test; pass interval_days")
+        intervals = {test_type: intervals.get(test_type, 0)}
+    if interval_days:
+        intervals = {name: interval_days for name in intervals}
+    return intervals
+
+
+def rebuild_latest(db: Session) -> None:
+    """Recompute latest_observations from observations (archived too) and medications (for existing databases)."""
+    obs = archive.observations(db)
+    ranked = select(
+        obs.patient_id,
+        obs.type,
+        obs.value,
+        obs.unit,
+        obs.interpretation,
+        obs.performed_date,
+        func.row_number()
+        .over(partition_by=(obs.patient_id, obs.type), order_by=(obs.performed_date.desc(), obs.created_at.desc()))
+        .label("rank"),
+    ).subquery()
+    columns = ["patient_id", "type", "value", "unit", "interpretation", "performed_date"]
+    db.execute(delete(models.LatestObservation))
+    db.execute(
+        insert(models.LatestObservation).from_select(
+            columns, select(*(ranked.c[name] for name in columns)).where(ranked.c.rank == 1)
+        )
+    )
+
+    # No-baseline placeholders for everyone ever prescribed a monitored drug; due_list checks it is current.
+    latest = models.LatestObservation
+    med = models.Medication
+    monitored = settings.MONITORING_INTERVAL_DAYS if settings.MONITORED_DRUGS else {}
+    codes.intern(db, latest.type, *monitored)
+    for test_type in monitored:
+        missing = ~exists().where(latest.patient_id == med.patient_id, latest.type == test_type)
+        patients = select(med.patient_id, literal(test_type, latest.type.type))
+        patients = patients.where(med.drug_name.in_(settings.MONITORED_DRUGS), missing)
+        db.execute(insert(latest).from_select(["patient_id", "type"], patients.distinct()))
+    db.commit()
+
+
+def ensure_latest(db: Session) -> None:
+    """Build latest_observations if it is empty but observations exist (first start after upgrade)."""
+    if db.query(models.LatestObservation).first() is None and db.query(models.Observation).first() is not None:
+        rebuild_latest(db)
+
+
+if __name__ == "__main__":
+    from app.sharding import SHARDS
+
+    for shard in SHARDS:
+        session = shard.WriteSessionLocal()
+        try:
+            rebuild_latest(session)
+        finally:
+            session.close()
+    print("Latest-observation index rebuilt.")
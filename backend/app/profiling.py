@@ -0,0 +1,183 @@
+﻿import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime
+from typing import Optional
+from urllib.parse import parse_qs
+
+from fastapi import HTTPException
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.auth import get_current_user
+from app.metrics import RequestStats, current_request_stats
+
+
+PROFILE_HEADER = b"x-epr-profile"
+PROFILE_QUERY_PARAM = "_profile"
+SAMPLE_INTERVAL_SECONDS = 0.002
+MAX_STORED_PROFILES = 20
+TOP_FUNCTIONS = 25
+
+_profiles: deque = deque(maxlen=MAX_STORED_PROFILES)
+_profiles_lock = threading.Lock()
+
+
+class SamplingProfiler:
+    """Samples the Python stack of one thread at a fixed interval from a background thread."""
+
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL_SECONDS):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="epr-profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(reversed(stack))] += 1
+
+
+def _summarise(stacks: Counter) -> dict:
+    inclusive: Counter = Counter()
+    exclusive: Counter = Counter()
+    for stack, count in stacks.items():
+        exclusive[stack[-1]] += count
+        for name in set(stack):
+            inclusive[name] += count
+    return {
+        "collapsed": [f"{';'.join(stack)} {count}" for stack, count in stacks.most_common()],
+        "top_functions": [
+            {"function": name, "total_samples": count, "self_samples": exclusive.get(name, 0)}
+            for name, count in inclusive.most_common(TOP_FUNCTIONS)
+        ],
+    }
+
+
+def _profile_requested(scope: Scope) -> bool:
+    for key, value in scope.get("headers", []):
+        if key == PROFILE_HEADER:
+            return value.lower() in (b"1", b"true", b"yes")
+    query_string = scope.get("query_string", b"")
+    if PROFILE_QUERY_PARAM.encode() not in query_string:
+        return False
+    values = parse_qs(query_string.decode("latin-1")).get(PROFILE_QUERY_PARAM, [])
+    return any(value.lower() in ("1", "true", "yes") for value in values)
+
+
+def _admin_username(scope: Scope) -> Optional[str]:
+    for key, value in scope.get("headers", []):
+        if key == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() != "bearer" or not token:
+                return None
+            try:
+                user = get_current_user(token)
+            except HTTPException:
+                return None
+            return user.username if user.role == "admin" else None
+    return None
+
+
+def list_profiles() -> list[dict]:
+    """Summaries of recently captured profiles, newest first."""
+    with _profiles_lock:
+        profiles = list(_profiles)
+    keys = ("id", "method", "path", "status", "username", "started_at", "duration_ms", "samples", "sql_count", "sql_ms")
+    return [{key: profile[key] for key in keys} for profile in reversed(profiles)]
+
+
+def get_profile(profile_id: str) -> Optional[dict]:
+    """Full profile (collapsed stacks, top functions and SQL statements) by ID."""
+    with _profiles_lock:
+        return next((profile for profile in _profiles if profile["id"] == profile_id), None)
+
+
+class ProfilingMiddleware:
+    """Profiles a single request when an admin sends ``X-EPR-Profile: 1`` or ``?_profile=1``.
+
+    Requests without the flag are passed straight through. Samples are taken
+    from the event-loop thread, so concurrent requests on the same worker may
+    appear in the profile.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not _profile_requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        username = _admin_username(scope)
+        if username is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex[:12]
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = [*message.get("headers", []), (b"x-epr-profile-id", profile_id.encode())]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        stats = current_request_stats.get()
+        token = None
+        if stats is None:
+            stats = RequestStats(scope)
+            token = current_request_stats.set(stats)
+        stats.statements = []
+
+        profiler = SamplingProfiler(threading.get_ident())
+        started_at = datetime.utcnow()
+        started = time.perf_counter()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.stop()
+            duration = time.perf_counter() - started
+            statements, stats.statements = stats.statements, None
+            if token is not None:
+                current_request_stats.reset(token)
+
+            profile = {
+                "id": profile_id,
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status_code,
+                "username": username,
+                "started_at": started_at.isoformat(),
+                "duration_ms": round(duration * 1000, 2),
+                "samples": sum(profiler.stacks.values()),
+                "sample_interval_ms": SAMPLE_INTERVAL_SECONDS * 1000,
+                "sql_count": len(statements),
+                "sql_ms": round(sum(elapsed for _, elapsed in statements) * 1000, 2),
+                # Statement text only; bound parameters are never stored.
+                "sql": [
+                    {"statement": statement, "duration_ms": round(elapsed * 1000, 3)} for statement, elapsed in statements
+                ],
+                **_summarise(profiler.stacks),
+            }
+            with _profiles_lock:
+                _profiles.append(profile)
@@ -1,40 +1,128 @@
-﻿import logging
+﻿import json
+import logging
 import re
+from typing import Any
 
 from fastapi import FastAPI
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import settings
+from app.logging_pipeline import start_log_pipeline
+
+
+# 10-digit NHS numbers, optionally grouped 3-3-4 with spaces or dashes.
+NHS_NUMBER_PATTERN = re.compile(r"\b\d{3}[ \-]?\d{3}[ \-]?\d{4}\b")
+REDACTED_NHS = "[REDACTED-NHS]"
+
+
+def redact_text(text: str) -> str:
+    """Replace potential NHS numbers in text."""
+    return NHS_NUMBER_PATTERN.sub(REDACTED_NHS, text)
+
+
+def redact_value(value: Any) -> Any:
+    """Recursively redact potential NHS numbers in a decoded JSON value."""
+    if isinstance(value, str):
+        return redact_text(value)
+    if isinstance(value, int) and not isinstance(value, bool) and 10**9 <= value < 10**10:
+        return REDACTED_NHS
+    if isinstance(value, list):
+        return [redact_value(item) for item in value]
+    if isinstance(value, dict):
+        return {key: redact_value(item) for key, item in value.items()}
+    return value
+
+
+def redact_body(body: bytes, content_type: bytes) -> bytes:
+    """Redact a response body, keeping JSON bodies valid JSON."""
+    text = body.decode("utf-8", errors="replace")
+    if content_type.startswith(b"application/json"):
+        try:
+            return json.dumps(redact_value(json.loads(text)), separators=(",", ":")).encode()
+        except ValueError:
+            pass
+    return redact_text(text).encode()
 
 
 class RedactionFilter(logging.Filter):
-    """Redacts 10-digit sequences from log messages (potential NHS numbers)."""
+    """Redacts potential NHS numbers from log messages, arguments and tracebacks."""
+
+    _formatter = logging.Formatter()
 
     def filter(self, record: logging.LogRecord) -> bool:
-        if isinstance(record.msg, str):
-            record.msg = re.sub(r"\b\d{10}\b", "[REDACTED-NHS]", record.msg)
+        if record.args:
+            # Merge args first so values passed as %s arguments are covered too.
+            record.msg = redact_text(record.getMessage())
+            record.args = None
+        elif isinstance(record.msg, str):
+            record.msg = redact_text(record.msg)
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self._formatter.formatException(record.exc_info)
+        if record.exc_text:
+            record.exc_text = redact_text(record.exc_text)
+        if record.stack_info:
+            record.stack_info = redact_text(record.stack_info)
         return True
 
 
 def setup_log_redaction() -> None:
-    """Configure log redaction for root and uvicorn loggers."""
-    redaction_filter = RedactionFilter()
+    """Route root and uvicorn logs through the queued pipeline with redaction on the listener thread."""
+    start_log_pipeline(filters=[RedactionFilter()], queue_size=settings.LOG_QUEUE_SIZE)
+
+
+class RedactionMiddleware:
+    """Pure ASGI middleware that redacts NHS numbers echoed back in error responses.
+
+    Successful and streaming responses are forwarded untouched; only JSON/text
+    bodies of 4xx/5xx responses (e.g. validation errors quoting the input) are
+    buffered and rewritten.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Message = {}
+        body_parts: list[bytes] = []
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                if message["status"] < 400 or not _content_type(message.get("headers", [])).startswith(
+                    (b"application/json", b"text/")
+                ):
+                    await send(message)
+                    return
+                start_message = message
+                return
+
+            if not start_message or message["type"] != "http.response.body":
+                await send(message)
+                return
 
-    root_logger = logging.getLogger()
-    for handler in root_logger.handlers:
-        handler.addFilter(redaction_filter)
+            body_parts.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
 
-    for logger_name in ["uvicorn", "uvicorn.access", "uvicorn.error"]:
-        logger = logging.getLogger(logger_name)
-        for handler in logger.handlers:
-            handler.addFilter(redaction_filter)
+            body = redact_body(b"".join(body_parts), _content_type(start_message.get("headers", [])))
+            headers = [(k, v) for k, v in start_message.get("headers", []) if k.lower() != b"content-length"]
+            headers.append((b"content-length", str(len(body)).encode()))
+            await send({**start_message, "headers": headers})
+            await send({"type": "http.response.body", "body": body})
 
+        await self.app(scope, receive, send_wrapper)
 
-class RedactionMiddleware(BaseHTTPMiddleware):
-    """Pass-through middleware; log sanitization is handled via logging filters."""
 
-    async def dispatch(self, request: Request, call_next):
-        response = await call_next(request)
-        return response
+def _content_type(headers: list) -> bytes:
+    for key, value in headers:
+        if key.lower() == b"content-type":
+            return value
+    return b""
 
 
 def add_redaction_middleware(app: FastAPI) -> None:
@@ -1,5 +1,5 @@
 ﻿from datetime import datetime
-from typing import Optional
+from typing import Any, Optional, Union
 
 from pydantic import BaseModel, ConfigDict, Field
 
@@ -62,6 +62,21 @@ class MedicationResponse(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class PatientSearchResults(BaseModel):
+    items: list[PatientResponse]
+    next_after: Optional[str] = Field(..., description="Pass as `after` to fetch the next page")
+
+
+class MedicationSearchItem(MedicationResponse):
+    pseudonym: str
+
+
+class MedicationSearchResults(BaseModel):
+    drug_names: list[str] = Field(..., description="Drug names matching the query, best match first")
+    items: list[MedicationSearchItem]
+    next_after: Optional[str] = Field(..., description="Pass as `after` to fetch the next page")
+
+
 class ExportJobResponse(BaseModel):
     id: str
     patient_id: Optional[str]
@@ -69,3 +84,67 @@ class ExportJobResponse(BaseModel):
     created_at: datetime
 
     model_config = ConfigDict(from_attributes=True)
+
+
+class ObservationCount(BaseModel):
+    month: str
+    type: str
+    interpretation: str
+    drug_name: Optional[str] = None
+    count: int
+
+
+class ActiveMedicationCount(BaseModel):
+    drug_name: str
+    active: int
+
+
+class MonitoringDueItem(BaseModel):
+    patient_id: str
+    pseudonym: str
+    type: str
+    status: str = Field(..., description="OVERDUE or NO_BASELINE")
+    last_performed_date: Optional[datetime]
+    days_since: Optional[int]
+
+
+class MonitoringDueList(BaseModel):
+    items: list[MonitoringDueItem]
+    intervals: dict[str, int]
+    offset: int
+    limit: int
+    next_offset: Optional[int]
+
+
+class SeriesPoint(BaseModel):
+    performed_date: datetime
+    value: float
+    min: Optional[float] = None
+    max: Optional[float] = None
+    count: int = 1
+
+
+class ObservationSeries(BaseModel):
+    patient_id: str
+    type: str
+    unit: Optional[str]
+    method: str = Field(..., description="raw, lttb or bucket")
+    total: int = Field(..., description="Observations in the requested range before downsampling")
+    points: list[SeriesPoint]
+
+
+class ChangeEntry(BaseModel):
+    seq: int = Field(..., description="Sequence number within the change log (primary or shard) holding the entry")
+    resource_type: str = Field(..., description="Patient, Observation or MedicationRequest")
+    resource_id: str
+    patient_id: Optional[str]
+    action: str
+    changed_at: datetime
+    resource: Optional[dict[str, Any]] = None
+
+
+class ChangeList(BaseModel):
+    changes: list[ChangeEntry]
+    # One sequence number per change log ("12.40.33") when sharded, so each log resumes from its own position.
+    last_seq: Union[int, str] = Field(..., description="Pass as `since` to fetch the next page")
+    has_more: bool
@@ -0,0 +1,187 @@
+﻿import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import case, func, or_, select, text, union_all
+from sqlalchemy.orm import Session
+
+from app import models
+
+
+# Fuzzy drug matches need at least this share of the query's trigrams ("Klozapine" finds "Clozapine").
+MIN_TRIGRAM_SHARE = 0.6
+MAX_DRUG_NAMES = 20
+
+# SQLite only: a trigram FTS5 index over the drug_names code table, kept in sync by triggers on insert and delete.
+_SQLITE_INDEX = [
+    "CREATE VIRTUAL TABLE drug_name_search "
+    "USING fts5(name, content='drug_names', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS drug_names_search_insert AFTER INSERT ON drug_names BEGIN "
+    "INSERT INTO drug_name_search(rowid, name) VALUES (new.id, new.name); END",
+    "CREATE TRIGGER IF NOT EXISTS drug_names_search_delete AFTER DELETE ON drug_names BEGIN "
+    "INSERT INTO drug_name_search(drug_name_search, rowid, name) VALUES ('delete', old.id, old.name); END",
+]
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(*key) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> list:
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError, ValueError) as exc:
+        raise InvalidCursor("Invalid cursor") from exc
+    if not isinstance(key, list) or len(key) != size or not all(isinstance(part, str) for part in key):
+        raise InvalidCursor("Invalid cursor")
+    return key
+
+
+def search_patients(db: Session, prefix: str, after: Optional[str] = None, limit: int = 50) -> dict:
+    """Patients whose pseudonym starts with ``prefix``, in pseudonym order, one range scan of its index."""
+    prefix = prefix.strip().upper()
+    patient = models.Patient
+    # One lower bound, so SQLite seeks straight to it rather than filtering from the prefix.
+    if after and after >= prefix:
+        query = db.query(patient).filter(patient.pseudonym > after)
+    else:
+        query = db.query(patient).filter(patient.pseudonym >= prefix)
+    if prefix:
+        # [prefix, prefix with its last character incremented) is exactly the strings starting with prefix.
+        query = query.filter(patient.pseudonym < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+    rows = query.order_by(patient.pseudonym).limit(limit + 1).all()
+    return {"items": rows[:limit], "next_after": rows[limit - 1].pseudonym if len(rows) > limit else None}
+
+
+def _trigrams(value: str) -> set[str]:
+    value = value.lower()
+    return {value[i : i + 3] for i in range(len(value) - 2)}
+
+
+def match_drug_names(db: Session, query: str, limit: int = MAX_DRUG_NAMES) -> list[str]:
+    """Drug names matching ``query``: by substring if any contain it, else (SQLite) by shared trigrams.
+
+    Only the vocabulary of distinct names is searched, so this stays fast however
+    many medications there are.
+    """
+    query = query.strip()
+    names = models.DrugName.name
+    grams = _trigrams(query)
+    if len(grams) < 2 or db.get_bind().dialect.name != "sqlite":
+        # Too short to fuzz: case-insensitive substring (prefix matches first).
+        pattern = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        rows = db.scalars(
+            select(names)
+            .where(func.lower(names).like(f"%{pattern.lower()}%", escape="\\"))
+            .order_by(func.lower(names).like(f"{pattern.lower()}%", escape="\\").desc(), names)
+            .limit(limit)
+        )
+        return list(rows)
+
+    # Any shared trigram makes a candidate; substring matches win outright, otherwise rank
+    # misspellings by the share of the query's trigrams each name contains.
+    match = " OR ".join('"' + gram.replace('"', '""') + '"' for gram in sorted(grams))
+    fts = text("SELECT name FROM drug_name_search WHERE drug_name_search MATCH :match")
+    candidates = list(db.scalars(fts, {"match": match}))
+    substring = sorted(name for name in candidates if query.lower() in name.lower())
+    if substring:
+        return substring[:limit]
+    scored = [(-len(grams & _trigrams(name)) / len(grams), name) for name in candidates]
+    return [name for share, name in sorted(scored) if -share >= MIN_TRIGRAM_SHARE][:limit]
+
+
+def search_medications(
+    db: Session,
+    query: str,
+    active_on: Optional[datetime] = None,
+    after: Optional[list[str]] = None,
+    limit: int = 50,
+) -> dict:
+    """Medications of every drug matching ``query``, in (drug name, id) order, with the patient's pseudonym.
+
+    Each matching drug's next ``limit + 1`` ids are read along
+    ix_medications_drug_name_id from the ``after`` key, so a page costs the
+    same however deep it is. ``active_on`` keeps only prescriptions running on
+    that date.
+    """
+    names = match_drug_names(db, query)
+    med = models.Medication
+    parts = []
+    for name in sorted(names):
+        if after and name < after[0]:
+            continue
+        ids = select(med.id).where(med.drug_name == name)
+        if after and name == after[0]:
+            ids = ids.where(med.id > after[1])
+        if active_on:
+            ids = ids.where(med.start_date <= active_on, or_(med.stop_date.is_(None), med.stop_date >= active_on))
+        parts.append(select(ids.order_by(med.id).limit(limit + 1).subquery()))
+    if not parts:
+        return {"drug_names": names, "items": [], "next_after": None}
+
+    # Plain rows rather than ORM objects: nothing here is modified. drug_name holds code ids, so the
+    # name order comes from the sorted names rather than the column.
+    name_order = case(*((med.drug_name == name, rank) for rank, name in enumerate(sorted(names))))
+    rows = db.execute(
+        select(*med.__table__.columns, models.Patient.pseudonym)
+        .join(models.Patient, models.Patient.id == med.patient_id)
+        .where(med.id.in_(union_all(*parts)))
+        .order_by(name_order, med.id)
+        .limit(limit + 1)
+    ).all()
+    items = [dict(row._mapping) for row in rows[:limit]]
+    next_after = encode_cursor(items[-1]["drug_name"], items[-1]["id"]) if len(rows) > limit else None
+    return {"drug_names": names, "items": items, "next_after": next_after}
+
+
+def merge_medication_pages(pages: list[dict], limit: int) -> dict:
+    """Combine per-shard search pages (each up to ``limit`` items) into one page in (drug name, id) order."""
+    if len(pages) == 1:
+        return pages[0]
+    # Each shard ranks only the names it holds; keep every name at its best rank.
+    ranks: dict[str, int] = {}
+    for page in pages:
+        for rank, name in enumerate(page["drug_names"]):
+            ranks[name] = min(rank, ranks.get(name, rank))
+    names = sorted(ranks, key=lambda name: (ranks[name], name))
+    items = sorted((item for page in pages for item in page["items"]), key=lambda item: (item["drug_name"], item["id"]))
+    more = len(items) > limit or any(page["next_after"] for page in pages)
+    items = items[:limit]
+    next_after = encode_cursor(items[-1]["drug_name"], items[-1]["id"]) if more and items else None
+    return {"drug_names": names[:MAX_DRUG_NAMES], "items": items, "next_after": next_after}
+
+
+def rebuild_search_index(db: Session) -> None:
+    """Re-read every drug name into the FTS index (SQLite)."""
+    if db.get_bind().dialect.name == "sqlite":
+        db.execute(text("INSERT INTO drug_name_search(drug_name_search) VALUES ('rebuild')"))
+        db.commit()
+
+
+def ensure_search_index(db: Session) -> None:
+    """Create the FTS index (SQLite) over drug names already coded, if it does not exist yet."""
+    if db.get_bind().dialect.name != "sqlite":
+        return
+    if db.scalar(text("SELECT 1 FROM sqlite_master WHERE name = 'drug_name_search'")) is None:
+        for statement in _SQLITE_INDEX:
+            db.execute(text(statement))
+        rebuild_search_index(db)
+
+
+if __name__ == "__main__":
+    from app.sharding import SHARDS
+
+    for shard in SHARDS:
+        session = shard.WriteSessionLocal()
+        try:
+            ensure_search_index(session)
+            rebuild_search_index(session)
+        finally:
+            session.close()
+    print("Drug-name search index rebuilt.")
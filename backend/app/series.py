@@ -0,0 +1,124 @@
+﻿from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import Integer, cast, func
+from sqlalchemy.orm import Session
+
+from app import archive
+
+
+LTTB = "lttb"
+BUCKET = "bucket"
+RAW = "raw"
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _epoch_days(db: Session, column):
+    """SQL expression for ``column`` as fractional days since 1970-01-01."""
+    if db.get_bind().dialect.name == "postgresql":
+        return func.extract("epoch", column) / 86400.0
+    return func.julianday(column) - 2440587.5
+
+
+def _floor(db: Session, expression):
+    """floor() for non-negative values; SQLite only has it when built with math functions."""
+    if db.get_bind().dialect.name == "postgresql":
+        return func.floor(expression)
+    return cast(expression, Integer)
+
+
+def _from_epoch_days(days: float) -> datetime:
+    return _EPOCH + timedelta(days=days)
+
+
+def lttb(points: list[tuple[float, float]], threshold: int) -> list[int]:
+    """Indices of the points kept by Largest-Triangle-Three-Buckets downsampling.
+
+    ``points`` are (x, y) pairs sorted by x. The first and last points are always
+    kept; each bucket in between contributes the point forming the largest
+    triangle with the previously kept point and the next bucket's average.
+    """
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+
+    kept = [0]
+    width = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * width) + 1
+        end = int((i + 1) * width) + 1
+        next_end = min(int((i + 2) * width) + 1, n)
+        next_bucket = points[end:next_end] or points[n - 1 :]
+        avg_x = sum(x for x, _ in next_bucket) / len(next_bucket)
+        avg_y = sum(y for _, y in next_bucket) / len(next_bucket)
+
+        ax, ay = points[a]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            x, y = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        kept.append(best)
+        a = best
+    kept.append(n - 1)
+    return kept
+
+
+def observation_series(
+    db: Session,
+    patient_id: str,
+    test_type: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    points: int = 200,
+    method: str = LTTB,
+) -> dict:
+    """One patient's results for one test, downsampled to at most ``points`` points.
+
+    Series that already fit are returned as-is (method ``raw``). Otherwise
+    ``bucket`` averages fixed-width time buckets in a single GROUP BY, and
+    ``lttb`` keeps the visually significant original results.
+    """
+    obs = archive.observations(db, start)
+    conditions = [obs.patient_id == patient_id, obs.type == test_type]
+    if start:
+        conditions.append(obs.performed_date >= start)
+    if end:
+        conditions.append(obs.performed_date <= end)
+
+    days = _epoch_days(db, obs.performed_date)
+    total, first, last, unit = db.query(func.count(), func.min(days), func.max(days), func.max(obs.unit)).filter(
+        *conditions
+    ).one()
+    result = {"patient_id": patient_id, "type": test_type, "unit": unit, "total": total, "points": []}
+
+    if total <= points:
+        rows = db.query(obs.performed_date, obs.value).filter(*conditions).order_by(obs.performed_date)
+        result["method"] = RAW
+        result["points"] = [{"performed_date": performed, "value": value} for performed, value in rows]
+        return result
+
+    result["method"] = method
+    if method == BUCKET:
+        # Widen a hair so the newest result falls in the last bucket rather than one past it.
+        width = ((last - first) or 1.0) / points * (1 + 1e-9)
+        bucket = _floor(db, (days - first) / width)
+        rows = (
+            db.query(func.avg(days), func.avg(obs.value), func.min(obs.value), func.max(obs.value), func.count())
+            .filter(*conditions)
+            .group_by(bucket)
+            .order_by(bucket)
+        )
+        result["points"] = [
+            {"performed_date": _from_epoch_days(at), "value": value, "min": low, "max": high, "count": count}
+            for at, value, low, high, count in rows
+        ]
+        return result
+
+    rows = db.query(obs.performed_date, days, obs.value).filter(*conditions).order_by(obs.performed_date).all()
+    kept = lttb([(x, y) for _, x, y in rows], points)
+    result["points"] = [{"performed_date": rows[i][0], "value": rows[i][2]} for i in kept]
+    return result
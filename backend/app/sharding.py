@@ -0,0 +1,301 @@
+﻿import argparse
+import contextvars
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, Optional, TypeVar
+
+from sqlalchemy import delete, select, union
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from app import codes, models
+from app.config import settings
+from app.database import SessionLocal, WriteSessionLocal, create_database_engine, create_sessionmakers, engine
+
+
+T = TypeVar("T")
+
+# Tables holding one patient's clinical records, moved together by the rebalancer.
+PATIENT_TABLES = [
+    models.Observation.__table__,
+    models.ArchivedObservation.__table__,
+    models.Medication.__table__,
+    models.LatestObservation.__table__,
+]
+
+
+class Shard:
+    """One database holding the clinical records of the patients that hash to it."""
+
+    def __init__(self, index: int, url: str, engine: Engine, session: sessionmaker, write_session: sessionmaker):
+        self.index = index
+        self.url = url
+        self.engine = engine
+        self.SessionLocal = session
+        self.WriteSessionLocal = write_session
+
+
+def _open_shard(index: int, url: str) -> Shard:
+    shard_engine = create_database_engine(url)
+    return Shard(index, url, shard_engine, *create_sessionmakers(shard_engine))
+
+
+SHARDED = bool(settings.SHARD_DATABASE_URLS)
+if SHARDED:
+    SHARDS = [_open_shard(index, url) for index, url in enumerate(settings.SHARD_DATABASE_URLS)]
+else:
+    SHARDS = [Shard(0, settings.DATABASE_URL, engine, SessionLocal, WriteSessionLocal)]
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Jump consistent hash: going from n to n + 1 buckets moves only 1/(n + 1) of the keys."""
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return b
+
+
+def shard_index(patient_id: str, count: Optional[int] = None) -> int:
+    """Stable shard number for a patient (the same in every worker and across restarts)."""
+    count = len(SHARDS) if count is None else count
+    if count == 1:
+        return 0
+    key = int.from_bytes(hashlib.blake2b(patient_id.encode(), digest_size=8).digest(), "big")
+    return jump_hash(key, count)
+
+
+def shard_for(patient_id: str) -> Shard:
+    return SHARDS[shard_index(patient_id)]
+
+
+@contextmanager
+def reader(patient_id: str, db: Session) -> Iterator[Session]:
+    """Session for reading a patient's clinical records: ``db`` itself unless sharded."""
+    if not SHARDED:
+        yield db
+        return
+    shard_db = shard_for(patient_id).SessionLocal()
+    try:
+        yield shard_db
+    finally:
+        shard_db.close()
+
+
+@contextmanager
+def writer(patient_id: str, db: Session) -> Iterator[Session]:
+    """Write session on the database holding a patient's clinical records: ``db`` itself unless sharded.
+
+    Only that shard's write lock is taken, so writes for patients on
+    different shards commit in parallel.
+    """
+    if not SHARDED:
+        yield db
+        return
+    shard_db = shard_for(patient_id).WriteSessionLocal()
+    try:
+        yield shard_db
+    finally:
+        shard_db.close()
+
+
+def readers(db: Session) -> Iterator[Session]:
+    """Each shard's read session in turn (just ``db`` when unsharded)."""
+    if not SHARDED:
+        yield db
+        return
+    for shard in SHARDS:
+        shard_db = shard.SessionLocal()
+        try:
+            yield shard_db
+        finally:
+            shard_db.close()
+
+
+def scatter(db: Session, fn: Callable[..., T], *args) -> list[T]:
+    """``fn(session, *args)`` on every shard in parallel, results in shard order (``[fn(db, *args)]`` unsharded)."""
+    if not SHARDED:
+        return [fn(db, *args)]
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=len(SHARDS), thread_name_prefix="shard")
+
+    def run(shard: Shard) -> T:
+        shard_db = shard.SessionLocal()
+        try:
+            return fn(shard_db, *args)
+        finally:
+            shard_db.close()
+
+    # Each task runs in a copy of the caller's context, so its queries count towards the request's metrics.
+    futures = [_executor.submit(contextvars.copy_context().run, run, shard) for shard in SHARDS]
+    return [future.result() for future in futures]
+
+
+def group_by_shard(items: Iterable[T], patient_id: Callable[[T], str]) -> dict[int, list[T]]:
+    grouped: dict[int, list[T]] = {}
+    for item in items:
+        grouped.setdefault(shard_index(patient_id(item)), []).append(item)
+    return grouped
+
+
+@contextmanager
+def shard_reader(index: int, db: Session) -> Iterator[Session]:
+    """Read session on shard ``index`` (``db`` itself when unsharded)."""
+    if not SHARDED:
+        yield db
+        return
+    shard_db = SHARDS[index].SessionLocal()
+    try:
+        yield shard_db
+    finally:
+        shard_db.close()
+
+
+def copy_patient(patient: models.Patient) -> None:
+    """Copy a new (flushed, not yet committed) patient row to its shard, so shard-local queries can join on patients.
+
+    Called before the primary commits: if the copy fails the patient is never
+    created, and if the primary's commit fails afterwards the copy is an
+    orphan no record refers to (the merge makes a retry of the copy harmless).
+    The primary stays the directory for patient lookups; patient rows never
+    change after creation, so a copy that exists cannot go stale.
+    """
+    if not SHARDED:
+        return
+    columns = {column.name: getattr(patient, column.name) for column in models.Patient.__table__.columns}
+    shard_db = shard_for(patient.id).WriteSessionLocal()
+    try:
+        shard_db.merge(models.Patient(**columns))
+        shard_db.commit()
+    finally:
+        shard_db.close()
+
+
+def _move_patients(
+    source: Session, target: Session, patient_ids: list[str], keep_patients: bool, move_changes: bool = False
+) -> int:
+    """Copy the patients' rows from ``source`` to ``target``, commit, then delete them from ``source``.
+
+    Copies ignore rows already present, so an interrupted move can be re-run.
+    With ``move_changes``, their change-log entries are appended to the
+    target's log too (with new sequence numbers, so consumers may see them
+    twice). Returns the number of clinical rows moved.
+    """
+    moved = 0
+    if move_changes:
+        log = models.ChangeLogEntry.__table__
+        entries = [
+            {name: value for name, value in row._mapping.items() if name != "seq"}
+            for row in source.execute(select(log).where(log.c.patient_id.in_(patient_ids)).order_by(log.c.seq))
+        ]
+        if entries:
+            target.execute(log.insert(), entries)
+    for table in [models.Patient.__table__] + PATIENT_TABLES:
+        key = table.c.id if table is models.Patient.__table__ else table.c.patient_id
+        rows = [dict(row._mapping) for row in source.execute(select(table).where(key.in_(patient_ids)))]
+        if rows:
+            codes.intern_rows(target, table, rows)
+            target.execute(sqlite_insert(table).on_conflict_do_nothing(), rows)
+            if table is not models.Patient.__table__:
+                moved += len(rows)
+    target.commit()
+    for table in PATIENT_TABLES + ([models.ChangeLogEntry.__table__] if move_changes else []):
+        source.execute(delete(table).where(table.c.patient_id.in_(patient_ids)))
+    if not keep_patients:
+        source.execute(delete(models.Patient).where(models.Patient.id.in_(patient_ids)))
+    source.commit()
+    return moved
+
+
+def _drain(source_factory: sessionmaker, url: str, is_primary: bool, batch_size: int) -> int:
+    """Move every patient in one source database whose shard is elsewhere; returns clinical rows moved."""
+    source = source_factory()
+    try:
+        patient_ids = select(models.Patient.id)
+        if not is_primary:
+            # Shard copies of patient rows, plus any records whose copy is missing.
+            patient_ids = union(patient_ids, *(select(table.c.patient_id) for table in PATIENT_TABLES))
+        moving = group_by_shard(source.scalars(patient_ids).all(), lambda patient_id: patient_id)
+        source.rollback()
+
+        # The feed only reads the primary's and current shards' logs; entries in any other database move too.
+        retired = not is_primary and url not in {shard.url for shard in SHARDS}
+        moved = 0
+        for index, ids in moving.items():
+            if SHARDS[index].url == url:
+                continue
+            target = SHARDS[index].WriteSessionLocal()
+            try:
+                for start in range(0, len(ids), batch_size):
+                    # The primary is the patient directory: it keeps its rows and they are copied out.
+                    batch = ids[start : start + batch_size]
+                    moved += _move_patients(source, target, batch, keep_patients=is_primary, move_changes=retired)
+            finally:
+                target.close()
+        return moved
+    finally:
+        source.close()
+
+
+def rebalance(source_urls: list[str], batch_size: int = 500) -> dict[str, int]:
+    """Move patients' clinical records from ``source_urls`` to their shard under SHARD_DATABASE_URLS.
+
+    Sources may be the previous shard list, the primary (to split an
+    unsharded database, or to restore shard copies of patient rows) or both.
+    Run it with the API stopped. Summary tables hold per-database partial
+    counts, so they are rebuilt everywhere afterwards. Code tables are also
+    per database: rows are copied as strings and coded again on arrival.
+    Change-log entries stay where they were written (the feed looks their
+    resources up on the patient's current shard), except in a source that is
+    no longer a shard, whose entries move with their patients.
+    Returns clinical rows moved per source.
+    """
+    from app import analytics, search
+
+    if not SHARDED:
+        raise ValueError("SHARD_DATABASE_URLS is not configured")
+    for shard in SHARDS:
+        models.Base.metadata.create_all(bind=shard.engine)
+
+    shards_by_url = {shard.url: shard for shard in SHARDS}
+    factories = {shard.url: shard.WriteSessionLocal for shard in SHARDS}
+    moved: dict[str, int] = {}
+    for url in dict.fromkeys(source_urls):
+        if url == settings.DATABASE_URL:
+            factories[url] = WriteSessionLocal
+        elif url not in shards_by_url:
+            factories[url] = create_sessionmakers(create_database_engine(url))[1]
+        moved[url] = _drain(factories[url], url, url == settings.DATABASE_URL, batch_size)
+
+    for factory in factories.values():
+        db = factory()
+        try:
+            analytics.rebuild_summaries(db)
+            search.ensure_search_index(db)
+        finally:
+            db.close()
+    return moved
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move patients' clinical records to their shard.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    rebalance_parser = subcommands.add_parser("rebalance", help="Redistribute records after SHARD_DATABASE_URLS changes")
+    rebalance_parser.add_argument(
+        "--from",
+        dest="sources",
+        nargs="+",
+        help="Databases to move records out of (default: the primary and every configured shard)",
+    )
+    rebalance_parser.add_argument("--batch-size", type=int, default=500, help="Patients per transaction")
+    args = parser.parse_args()
+
+    sources = args.sources or [settings.DATABASE_URL] + [shard.url for shard in SHARDS]
+    for url, count in rebalance(sources, args.batch_size).items():
+        print(f"{url}: moved {count} rows")
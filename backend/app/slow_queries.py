@@ -0,0 +1,170 @@
+﻿import logging
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Any, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.metrics import current_request_stats
+from app.redaction import redact_value
+
+
+logger = logging.getLogger("app.slow_queries")
+
+MAX_PARAM_LENGTH = 40
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_statement(statement: str) -> str:
+    """Collapse whitespace and literals so equivalent statements aggregate together."""
+    normalized = _STRING_LITERAL.sub("?", statement)
+    normalized = _NUMBER_LITERAL.sub("?", normalized)
+    normalized = _WHITESPACE.sub(" ", normalized).strip()
+    return _PLACEHOLDER_LIST.sub("(...)", normalized)
+
+
+def _redact_parameters(parameters: Any) -> Any:
+    def shorten(value: Any) -> Any:
+        if isinstance(value, bytes):
+            value = value.hex()  # e.g. UUIDKey ids; JSON has no bytes
+        if isinstance(value, str) and len(value) > MAX_PARAM_LENGTH:
+            return value[:MAX_PARAM_LENGTH] + "..."
+        return value
+
+    redacted = redact_value(list(parameters) if isinstance(parameters, tuple) else parameters)
+    if isinstance(redacted, dict):
+        return {key: shorten(value) for key, value in redacted.items()}
+    if isinstance(redacted, list):
+        return [shorten(value) for value in redacted]
+    return shorten(redacted)
+
+
+class SlowQueryLog:
+    """Aggregates statements slower than a threshold by normalized statement text."""
+
+    def __init__(self, threshold_ms: float):
+        self.threshold_ms = threshold_ms
+        self._entries: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        statement: str,
+        duration_ms: float,
+        endpoint: str,
+        parameters: Any,
+        plan_provider,
+    ) -> None:
+        key = normalize_statement(statement)
+        with self._lock:
+            entry = self._entries.get(key)
+            needs_plan = entry is None or entry["plan"] is None
+        # The plan is captured once per normalized statement, outside the lock.
+        plan = plan_provider() if needs_plan else None
+
+        with self._lock:
+            entry = self._entries.setdefault(
+                key,
+                {
+                    "statement": key,
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "endpoints": Counter(),
+                    "plan": None,
+                    "last_parameters": None,
+                    "last_seen": None,
+                },
+            )
+            entry["count"] += 1
+            entry["total_ms"] += duration_ms
+            entry["max_ms"] = max(entry["max_ms"], duration_ms)
+            entry["endpoints"][endpoint] += 1
+            entry["last_parameters"] = _redact_parameters(parameters)
+            entry["last_seen"] = datetime.utcnow().isoformat()
+            if entry["plan"] is None:
+                entry["plan"] = plan
+
+        logger.warning(
+            "Slow query (%.1f ms) from %s: %s | params=%s | plan=%s",
+            duration_ms,
+            endpoint,
+            key,
+            entry["last_parameters"],
+            "; ".join(entry["plan"] or []),
+        )
+
+    def summary(self, limit: int = 50) -> list[dict]:
+        """Aggregated slow statements ordered by total time spent."""
+        with self._lock:
+            entries = [
+                {
+                    **entry,
+                    "total_ms": round(entry["total_ms"], 2),
+                    "max_ms": round(entry["max_ms"], 2),
+                    "mean_ms": round(entry["total_ms"] / entry["count"], 2),
+                    "endpoints": dict(entry["endpoints"]),
+                }
+                for entry in self._entries.values()
+            ]
+        return sorted(entries, key=lambda entry: entry["total_ms"], reverse=True)[:limit]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+slow_query_log: Optional[SlowQueryLog] = None
+
+
+def _explain_query_plan(conn, statement: str, parameters: Any) -> Optional[list[str]]:
+    if conn.dialect.name != "sqlite" or not statement.lstrip().upper().startswith("SELECT"):
+        return None
+    # Use a raw DBAPI cursor so the EXPLAIN itself does not fire engine events.
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+        return [row[-1] for row in cursor.fetchall()]
+    except Exception as exc:  # noqa: BLE001 - plan capture must never break the query
+        return [f"EXPLAIN failed: {exc}"]
+    finally:
+        cursor.close()
+
+
+def instrument_slow_queries(engine: Engine, threshold_ms: float) -> Optional[SlowQueryLog]:
+    """Record statements slower than ``threshold_ms`` (disabled when <= 0)."""
+    global slow_query_log
+    if threshold_ms <= 0:
+        return None
+    # Engines instrumented later (database shards) share the first engine's log.
+    if slow_query_log is None:
+        slow_query_log = SlowQueryLog(threshold_ms)
+    log = slow_query_log
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("slow_query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration_ms = (time.perf_counter() - conn.info["slow_query_start_time"].pop()) * 1000
+        if duration_ms < log.threshold_ms:
+            return
+        stats = current_request_stats.get()
+        endpoint = stats.endpoint if stats is not None else "background"
+        log.record(
+            statement,
+            duration_ms,
+            endpoint,
+            parameters,
+            lambda: None if executemany else _explain_query_plan(conn, statement, parameters),
+        )
+
+    return log
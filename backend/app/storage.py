@@ -0,0 +1,194 @@
+﻿import os
+import shutil
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Iterator, Optional
+
+from app.config import settings
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ArtifactNotFound(Exception):
+    """Raised when an export artifact is missing from storage."""
+
+
+class ArtifactStorage(ABC):
+    """Where export artifacts live, addressed by key (e.g. ``<job_id>.zip``)."""
+
+    @abstractmethod
+    def save(
+        self,
+        key: str,
+        source_path: str,
+        content_type: str = "application/zip",
+        content_encoding: Optional[str] = None,
+    ) -> None:
+        """Store the file at ``source_path`` under ``key``; the source may be moved."""
+
+    @abstractmethod
+    def size(self, key: str) -> int:
+        """Size in bytes; raises ArtifactNotFound."""
+
+    @abstractmethod
+    def iter_bytes(self, key: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """Stream the artifact in chunks; raises ArtifactNotFound."""
+
+    def presigned_url(self, key: str, filename: str, expires_in: int) -> Optional[str]:
+        """Time-limited URL the client can fetch directly, or None if unsupported."""
+        return None
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Remove the artifact; a missing key is not an error."""
+
+
+class LocalStorage(ArtifactStorage):
+    """Artifacts on the local filesystem (use a shared volume when running several nodes)."""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        # Older jobs stored "exports/<id>.zip"; only the file name is ever used.
+        return os.path.join(self.root, os.path.basename(key))
+
+    def save(
+        self,
+        key: str,
+        source_path: str,
+        content_type: str = "application/zip",
+        content_encoding: Optional[str] = None,
+    ) -> None:
+        shutil.move(source_path, self._path(key))
+
+    def size(self, key: str) -> int:
+        try:
+            return os.path.getsize(self._path(key))
+        except FileNotFoundError as exc:
+            raise ArtifactNotFound(key) from exc
+
+    def iter_bytes(self, key: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        try:
+            f = open(self._path(key), "rb")
+        except FileNotFoundError as exc:
+            raise ArtifactNotFound(key) from exc
+
+        def chunks() -> Iterator[bytes]:
+            with f:
+                while chunk := f.read(chunk_size):
+                    yield chunk
+
+        return chunks()
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class S3Storage(ArtifactStorage):
+    """Artifacts in an S3-compatible bucket (AWS S3, MinIO, or a local moto server). Requires boto3."""
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = "",
+        endpoint_url: Optional[str] = None,
+        region: Optional[str] = None,
+        access_key_id: Optional[str] = None,
+        secret_access_key: Optional[str] = None,
+    ):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError as exc:
+            raise RuntimeError("EXPORT_STORAGE=s3 requires boto3 (pip install boto3)") from exc
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self._client_error = ClientError
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url or None,
+            region_name=region or None,
+            aws_access_key_id=access_key_id or None,
+            aws_secret_access_key=secret_access_key or None,
+        )
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}{os.path.basename(key)}"
+
+    def _not_found(self, exc) -> bool:
+        return exc.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+    def save(
+        self,
+        key: str,
+        source_path: str,
+        content_type: str = "application/zip",
+        content_encoding: Optional[str] = None,
+    ) -> None:
+        extra = {"ContentType": content_type}
+        if content_encoding:
+            # Lets pre-signed downloads be decompressed transparently by HTTP clients.
+            extra["ContentEncoding"] = content_encoding
+        # upload_file switches to multipart uploads for large artifacts.
+        self.client.upload_file(source_path, self.bucket, self._key(key), ExtraArgs=extra)
+        os.remove(source_path)
+
+    def size(self, key: str) -> int:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(key))["ContentLength"]
+        except self._client_error as exc:
+            if self._not_found(exc):
+                raise ArtifactNotFound(key) from exc
+            raise
+
+    def iter_bytes(self, key: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        try:
+            body = self.client.get_object(Bucket=self.bucket, Key=self._key(key))["Body"]
+        except self._client_error as exc:
+            if self._not_found(exc):
+                raise ArtifactNotFound(key) from exc
+            raise
+
+        def chunks() -> Iterator[bytes]:
+            try:
+                yield from body.iter_chunks(chunk_size)
+            finally:
+                body.close()
+
+        return chunks()
+
+    def presigned_url(self, key: str, filename: str, expires_in: int) -> Optional[str]:
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": self._key(key),
+                "ResponseContentDisposition": f'attachment; filename="{filename}"',
+            },
+            ExpiresIn=expires_in,
+        )
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+
+@lru_cache(maxsize=1)
+def get_export_storage() -> ArtifactStorage:
+    """Storage backend selected by EXPORT_STORAGE (``local`` or ``s3``)."""
+    if settings.EXPORT_STORAGE == "s3":
+        return S3Storage(
+            bucket=settings.S3_BUCKET,
+            prefix=settings.S3_PREFIX,
+            endpoint_url=settings.S3_ENDPOINT_URL,
+            region=settings.S3_REGION,
+            access_key_id=settings.S3_ACCESS_KEY_ID,
+            secret_access_key=settings.S3_SECRET_ACCESS_KEY,
+        )
+    return LocalStorage(settings.EXPORT_DIR)
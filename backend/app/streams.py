@@ -0,0 +1,201 @@
+﻿import asyncio
+import contextvars
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import event
+from sqlalchemy.orm import Session, sessionmaker
+
+from app import models
+from app.metrics import STREAM_EVENTS_DROPPED, STREAM_SUBSCRIBERS
+
+
+logger = logging.getLogger(__name__)
+
+# Re-read this far behind the cursor: concurrent transactions may commit out of created_at order.
+OVERLAP = timedelta(seconds=2)
+
+
+class Subscription:
+    """One stream client: its filters and a bounded buffer that drops the oldest events when full."""
+
+    def __init__(self, patient_id: Optional[str], interpretation: Optional[str], buffer_size: int):
+        self.patient_id = patient_id
+        self.interpretation = interpretation
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=buffer_size)
+        self.dropped = 0
+
+    def matches(self, item: dict) -> bool:
+        if self.patient_id and item["patient_id"] != self.patient_id:
+            return False
+        return not self.interpretation or item["interpretation"] == self.interpretation
+
+    def offer(self, item: dict) -> None:
+        """Queue ``item`` without ever waiting on the consumer."""
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            STREAM_EVENTS_DROPPED.inc()
+        self.queue.put_nowait(item)
+
+
+class ObservationBroadcaster:
+    """Fans newly committed observations out to stream subscribers in this worker.
+
+    One background task per worker tails the observations table (on every
+    database in ``session_factories``: each shard, or just the primary), so
+    writes handled by other workers are seen too, while anyone is subscribed,
+    and is woken immediately by commits in this worker. Subscribers never block it:
+    each has its own bounded buffer.
+    """
+
+    def __init__(self, session_factories: list[sessionmaker], poll_seconds: float, buffer_size: int):
+        self.session_factories = session_factories
+        self.poll_seconds = poll_seconds
+        self.buffer_size = buffer_size
+        self._subscribers: set[Subscription] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._cursor = datetime.utcnow()
+        self._seen: dict[str, datetime] = {}
+
+    def subscribe(self, patient_id: Optional[str] = None, interpretation: Optional[str] = None) -> Subscription:
+        subscription = Subscription(patient_id, interpretation, self.buffer_size)
+        self._subscribers.add(subscription)
+        STREAM_SUBSCRIBERS.inc()
+        if self._task is None or self._task.done():
+            self._loop = asyncio.get_running_loop()
+            self._wake = asyncio.Event()
+            self._cursor = datetime.utcnow()
+            self._seen.clear()
+            # A fresh context, so the tail's queries are not attributed to the first subscriber's request.
+            self._task = asyncio.create_task(self._run(), context=contextvars.Context())
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        if subscription in self._subscribers:
+            self._subscribers.remove(subscription)
+            STREAM_SUBSCRIBERS.dec()
+        if not self._subscribers and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def notify(self) -> None:
+        """Poll now rather than at the next interval; safe to call from any thread."""
+        loop, wake = self._loop, self._wake
+        if self._task is None or loop is None or wake is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(wake.set)
+
+    async def close(self) -> None:
+        for subscription in list(self._subscribers):
+            self.unsubscribe(subscription)
+
+    def publish(self, item: dict) -> None:
+        for subscription in list(self._subscribers):
+            if subscription.matches(item):
+                subscription.offer(item)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                items = await run_in_threadpool(self._fetch)
+            except Exception:
+                logger.exception("Observation stream poll failed")
+                continue
+            for item in items:
+                self.publish(item)
+
+    def _fetch(self) -> list[dict]:
+        """Observations created since the cursor that have not been published yet."""
+        obs = models.Observation
+        rows = []
+        for session_factory in self.session_factories:
+            db: Session = session_factory()
+            try:
+                rows += (
+                    db.query(obs, models.Patient.pseudonym)
+                    .join(models.Patient, models.Patient.id == obs.patient_id)
+                    .filter(obs.created_at > self._cursor - OVERLAP)
+                    .order_by(obs.created_at, obs.id)
+                    .all()
+                )
+            finally:
+                db.close()
+        if len(self.session_factories) > 1:
+            rows.sort(key=lambda row: (row[0].created_at, row[0].id))
+
+        items = []
+        for row, pseudonym in rows:
+            if row.id in self._seen:
+                continue
+            self._seen[row.id] = row.created_at
+            self._cursor = max(self._cursor, row.created_at)
+            items.append(
+                {
+                    "id": row.id,
+                    "patient_id": row.patient_id,
+                    "pseudonym": pseudonym,
+                    "type": row.type,
+                    "value": row.value,
+                    "unit": row.unit,
+                    "interpretation": row.interpretation,
+                    "performed_date": row.performed_date.isoformat(),
+                    "created_at": row.created_at.isoformat(),
+                }
+            )
+        horizon = self._cursor - OVERLAP
+        self._seen = {key: created for key, created in self._seen.items() if created >= horizon}
+        return items
+
+
+def watch_commits(broadcaster: ObservationBroadcaster) -> None:
+    """Wake ``broadcaster`` whenever a session in this process commits new observations."""
+
+    @event.listens_for(Session, "after_flush")
+    def _after_flush(session, flush_context):
+        if any(isinstance(obj, models.Observation) for obj in session.new):
+            session.info["observations_written"] = True
+
+    @event.listens_for(Session, "after_commit")
+    def _after_commit(session):
+        if session.info.pop("observations_written", False):
+            broadcaster.notify()
+
+    @event.listens_for(Session, "after_rollback")
+    def _after_rollback(session):
+        session.info.pop("observations_written", None)
+
+
+async def sse_events(
+    broadcaster: ObservationBroadcaster,
+    patient_id: Optional[str],
+    interpretation: Optional[str],
+    keepalive_seconds: float,
+) -> AsyncIterator[str]:
+    """Server-sent event stream for one subscriber; unsubscribes when the client goes away."""
+    subscription = broadcaster.subscribe(patient_id, interpretation)
+    try:
+        yield ": connected\n\n"
+        while True:
+            try:
+                item = await asyncio.wait_for(subscription.queue.get(), timeout=keepalive_seconds)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if subscription.dropped:
+                # Tell the client it missed events so it can re-query instead of trusting the stream.
+                yield f"event: dropped\ndata: {json.dumps({'count': subscription.dropped})}\n\n"
+                subscription.dropped = 0
+            yield f"id: {item['id']}\nevent: observation\ndata: {json.dumps(item)}\n\n"
+    finally:
+        broadcaster.unsubscribe(subscription)
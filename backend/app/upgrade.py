@@ -0,0 +1,149 @@
+﻿"""Rebuild tables created before a column's storage changed (first start after upgrade).
+
+Two column types store something other than what the API sees:
+
+- ``Coded`` columns (app.codes) hold code-table ids where older databases
+  hold the strings;
+- ``UUIDKey`` columns (app.keys) hold 16-byte UUIDs where older databases
+  hold the 36-character text.
+
+A table with any column still in its old form is copied once into its model's
+layout, converting every such column in the same pass. Run ``python -m
+app.upgrade`` to do this outside the API's startup and VACUUM the freed pages.
+
+Nullable columns added to a model since its table was created are added in
+place first (existing rows get NULL).
+"""
+from typing import Optional
+
+from sqlalchemy import Integer, LargeBinary, inspect, text
+from sqlalchemy.orm import Session
+
+from app.codes import Coded
+from app.keys import UUIDKey, key_bytes
+
+
+def _stored_key(value: Optional[str]) -> Optional[bytes]:
+    # Returning None for text that is not a UUID fails the NOT NULL check, which aborts the upgrade.
+    stored = key_bytes(value)
+    return stored or None
+
+
+def _conversion(db: Session, column, declared, legacy: str) -> Optional[str]:
+    """SQL computing ``column`` from the ``legacy`` table, or None if its stored form is already current."""
+    if isinstance(column.type, Coded) and not isinstance(declared, Integer):
+        db.execute(
+            text(
+                f"INSERT INTO {column.type.table} (name) SELECT DISTINCT {column.name} FROM {legacy} "
+                f"WHERE {column.name} IS NOT NULL ON CONFLICT (name) DO NOTHING"
+            )
+        )
+        return f"(SELECT id FROM {column.type.table} WHERE name = {legacy}.{column.name})"
+    if isinstance(column.type, UUIDKey) and not isinstance(declared, LargeBinary):
+        if db.get_bind().dialect.name == "sqlite":
+            return f"uuid_bytes({legacy}.{column.name})"
+        return f"decode(replace({legacy}.{column.name}, '-', ''), 'hex')"
+    return None
+
+
+def _add_missing_columns(db: Session, inspector, table) -> bool:
+    """ALTER TABLE ADD COLUMN for each nullable model column the table lacks; True if any was added."""
+    declared = {column["name"] for column in inspector.get_columns(table.name)}
+    missing = [column for column in table.columns if column.name not in declared]
+    for column in missing:
+        if not column.nullable:
+            raise RuntimeError(f"{table.name}.{column.name} is NOT NULL and cannot be added to existing rows")
+        column_type = column.type.compile(dialect=db.get_bind().dialect)
+        db.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+    return bool(missing)
+
+
+def _outdated(inspector, table) -> bool:
+    declared = {column["name"]: column["type"] for column in inspector.get_columns(table.name)}
+    return any(
+        isinstance(column.type, Coded) and not isinstance(declared[column.name], Integer)
+        or isinstance(column.type, UUIDKey) and not isinstance(declared[column.name], LargeBinary)
+        for column in table.columns
+    )
+
+
+def _rebuild(db: Session, table) -> None:
+    """Copy ``table`` into a fresh table of its model's layout, converting outdated columns."""
+    legacy = f"{table.name}_legacy"
+    sqlite = db.get_bind().dialect.name == "sqlite"
+    declared = {column["name"]: column["type"] for column in inspect(db.connection()).get_columns(table.name)}
+    sequence = None
+    if sqlite:
+        # Keep other tables' foreign keys pointing at the name rather than following the rename.
+        db.execute(text("PRAGMA legacy_alter_table = ON"))
+        if table.dialect_options["sqlite"]["autoincrement"]:
+            sequence = db.scalar(text("SELECT seq FROM sqlite_sequence WHERE name = :name"), {"name": table.name})
+    for index in inspect(db.connection()).get_indexes(table.name):
+        db.execute(text(f"DROP INDEX {index['name']}"))
+    db.execute(text(f"ALTER TABLE {table.name} RENAME TO {legacy}"))
+    table.create(bind=db.connection())
+    names = [column.name for column in table.columns]
+    values = [_conversion(db, column, declared[column.name], legacy) or column.name for column in table.columns]
+    db.execute(text(f"INSERT INTO {table.name} ({', '.join(names)}) SELECT {', '.join(values)} FROM {legacy}"))
+    db.execute(text(f"DROP TABLE {legacy}"))
+    if sequence is not None:
+        # Sequence numbers of pruned rows are never handed out again.
+        db.execute(
+            text("UPDATE sqlite_sequence SET seq = max(seq, :seq) WHERE name = :name"),
+            {"seq": sequence, "name": table.name},
+        )
+    if sqlite:
+        db.execute(text("PRAGMA legacy_alter_table = OFF"))
+
+
+def upgrade_tables(db: Session) -> list[str]:
+    """Move tables holding code strings or text UUIDs onto their current layout, in one transaction.
+
+    Returns the names of the tables changed; VACUUM afterwards (``python -m
+    app.upgrade``) to give the pages freed by rebuilds back.
+    """
+    from app import models
+
+    inspector = inspect(db.connection())
+    extended = [
+        table.name
+        for table in models.Base.metadata.sorted_tables
+        if inspector.has_table(table.name) and _add_missing_columns(db, inspector, table)
+    ]
+    inspector = inspect(db.connection())
+    outdated = [
+        table
+        for table in models.Base.metadata.sorted_tables
+        if inspector.has_table(table.name) and _outdated(inspector, table)
+    ]
+    if outdated and db.get_bind().dialect.name == "sqlite":
+        db.connection().connection.dbapi_connection.create_function(
+            "uuid_bytes", 1, _stored_key, deterministic=True
+        )
+    for table in outdated:
+        _rebuild(db, table)
+    db.commit()
+    return list(dict.fromkeys(extended + [table.name for table in outdated]))
+
+
+if __name__ == "__main__":
+    from app.config import settings
+    from app.database import WriteSessionLocal, engine
+    from app.sharding import SHARDS
+
+    # The primary first: it keeps patients, the change log and export jobs when observations are sharded.
+    databases = {settings.DATABASE_URL: (engine, WriteSessionLocal)}
+    databases.update({shard.url: (shard.engine, shard.WriteSessionLocal) for shard in SHARDS})
+    for url, (database_engine, write_session) in databases.items():
+        session = write_session()
+        try:
+            tables = upgrade_tables(session)
+        finally:
+            session.close()
+        print(f"{url}: {', '.join(tables) or 'already current'}")
+        if url.startswith("sqlite"):
+            connection = database_engine.raw_connection()
+            try:
+                connection.execute("VACUUM")
+            finally:
+                connection.close()
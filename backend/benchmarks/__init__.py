@@ -0,0 +1 @@
+﻿"""Benchmarks for the EPR backend (run from backend/ with ``python -m benchmarks.<name>``)."""
@@ -0,0 +1,156 @@
+﻿"""Clinician read latency beside a runaway script, with and without admission control.
+
+Starts uvicorn on a seeded dataset twice, with ADMISSION_ENABLED false and
+then true. Each time, the admin user runs a script that calls
+POST /simulate/events in tight loops, ignoring Retry-After, while clinicians
+read GET /Observation with a short think time. Reports the clinicians'
+throughput, p50/p95/p99 and errors, and how many of the script's requests
+were served or rejected with 429.
+
+Usage (from backend/):
+    python -m benchmarks.admission
+    python -m benchmarks.admission --patients 10000 --runaway 16 --clinicians 8 --duration 20
+
+Requires httpx.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.api_load import BACKEND_DIR, _free_port, percentile
+from benchmarks.datasets import BENCH_SECRET_SALT, DATA_DIR, build_dataset, sample_patient_ids
+
+
+async def _login(client: httpx.AsyncClient, username: str, password: str) -> dict[str, str]:
+    resp = await client.post("/oauth/token", data={"username": username, "password": password})
+    resp.raise_for_status()
+    return {"Authorization": f"Bearer {resp.json()['access_token']}"}
+
+
+async def measure(args, port: int, patient_ids: list[str]) -> dict:
+    limits = httpx.Limits(max_connections=args.runaway + args.clinicians + 4)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60) as client:
+        for _ in range(100):
+            try:
+                if (await client.get("/health/live")).status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.1)
+        admin = await _login(client, "admin", "admin123")
+        clinician = await _login(client, "clinician", "password123")
+
+        latencies: list[float] = []
+        errors = 0
+        runaway: dict[str, int] = {"served": 0, "rejected": 0, "failed": 0}
+        deadline = time.perf_counter() + args.duration
+
+        async def run_script(seed: int) -> None:
+            rng = random.Random(seed)
+            while time.perf_counter() < deadline:
+                params = {"patient_id": rng.choice(patient_ids), "count": args.events}
+                try:
+                    resp = await client.post("/simulate/events", params=params, headers=admin)
+                except httpx.TransportError:
+                    runaway["failed"] += 1
+                    continue
+                outcome = "rejected" if resp.status_code == 429 else "served" if resp.status_code < 400 else "failed"
+                runaway[outcome] += 1
+
+        async def run_clinician(seed: int) -> None:
+            nonlocal errors
+            rng = random.Random(seed)
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    params = {"patient": rng.choice(patient_ids)}
+                    resp = await client.get("/Observation", params=params, headers=clinician)
+                    ok = resp.status_code < 400
+                except httpx.TransportError:
+                    ok = False
+                latencies.append(time.perf_counter() - started)
+                if not ok:
+                    errors += 1
+                await asyncio.sleep(args.think_ms / 1000)
+
+        await asyncio.gather(
+            *(run_script(args.seed + i) for i in range(args.runaway)),
+            *(run_clinician(args.seed + 1000 + i) for i in range(args.clinicians)),
+        )
+
+    latencies.sort()
+    return {
+        "clinician": {
+            "count": len(latencies),
+            "errors": errors,
+            "throughput_rps": round(len(latencies) / args.duration, 2),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        },
+        "runaway": {name: round(count / args.duration, 2) for name, count in runaway.items()},
+    }
+
+
+def run(args, seeded, admission: bool) -> dict:
+    # A fresh copy per run, so the first run's writes do not slow the second.
+    run_db = DATA_DIR / f"run_{os.getpid()}.db"
+    run_db.write_bytes(seeded.read_bytes())
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{run_db}", "ADMISSION_ENABLED": str(admission).lower()}
+    patient_ids = sample_patient_ids(run_db, seed=args.seed)
+
+    port = _free_port()
+    command = [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port)]
+    server = subprocess.Popen(
+        command + ["--no-access-log"], cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        return asyncio.run(measure(args, port, patient_ids))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        for path in (run_db, *run_db.parent.glob(f"{run_db.name}-*"), run_db.with_name(f"{run_db.name}.startup.lock")):
+            path.unlink(missing_ok=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--observations", type=int, default=10, help="Observations per patient")
+    parser.add_argument("--medications", type=int, default=2, help="Medications per patient")
+    parser.add_argument("--runaway", type=int, default=8, help="Concurrent loops of the runaway script")
+    parser.add_argument("--events", type=int, default=10, help="Observations per POST /simulate/events")
+    parser.add_argument("--clinicians", type=int, default=4, help="Concurrent clinicians reading")
+    parser.add_argument("--think-ms", type=float, default=100, help="Pause between a clinician's requests")
+    parser.add_argument("--duration", type=float, default=10.0, help="Measured seconds per run")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", action="store_true", help="Print the raw JSON report")
+    args = parser.parse_args()
+
+    os.environ.setdefault("SECRET_SALT", BENCH_SECRET_SALT)
+    seeded = build_dataset(args.patients, args.observations, args.medications, seed=args.seed)
+    results = {mode: run(args, seeded, mode == "on") for mode in ("off", "on")}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{args.runaway} runaway loops of POST /simulate/events, {args.clinicians} clinicians reading /Observation")
+    print(f"\n{'admission':<10} {'reads/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}"
+          f" {'script served/s':>16} {'429/s':>8}")
+    for mode, result in results.items():
+        reads, script = result["clinician"], result["runaway"]
+        print(
+            f"{mode:<10} {reads['throughput_rps']:>8.1f} {reads['p50_ms']:>8.1f} {reads['p95_ms']:>8.1f}"
+            f" {reads['p99_ms']:>8.1f} {reads['errors']:>7} {script['served']:>16.1f} {script['rejected']:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+﻿"""Mixed clinician workload against the EPR API.
+
+Seeds (or reuses) a dataset, then drives the app either in-process over
+ASGI or over a local uvicorn server, and writes per-endpoint throughput
+and latency percentiles as JSON.
+
+Usage (from backend/):
+    python -m benchmarks.api_load --patients 1000 --mode inprocess
+    python -m benchmarks.api_load --patients 100000 --mode uvicorn --concurrency 16 --duration 30
+    python -m benchmarks.compare results/old.json results/new.json
+
+Requires httpx.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+import httpx
+
+from benchmarks.datasets import DATA_DIR, benchmark_env, build_dataset, nhs_number_for, sample_patient_ids
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_MIX = {
+    "GET /Patient": 35,
+    "GET /Observation": 30,
+    "GET /MedicationRequest": 15,
+    "POST /Observation": 15,
+    "POST /export/csv": 5,
+}
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def parse_mix(value: Optional[str]) -> dict[str, int]:
+    if not value:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.rpartition("=")
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"Unknown operation {name!r}; choose from {', '.join(DEFAULT_MIX)}")
+        mix[name] = int(weight)
+    return mix
+
+
+class Workload:
+    """Chooses operations by weight and issues them with a shared client."""
+
+    def __init__(self, client: httpx.AsyncClient, patients: int, patient_ids: list[str], mix: dict[str, int], seed: int):
+        self.client = client
+        self.patients = patients
+        self.patient_ids = patient_ids
+        self.operations = list(mix)
+        self.weights = [mix[name] for name in self.operations]
+        self.rng = random.Random(seed)
+        self.headers: dict[str, str] = {}
+
+    async def login(self) -> None:
+        resp = await self.client.post("/oauth/token", data={"username": "clinician", "password": "password123"})
+        resp.raise_for_status()
+        self.headers = {"Authorization": f"Bearer {resp.json()['access_token']}"}
+
+    async def run_one(self) -> tuple[str, float, bool]:
+        operation = self.rng.choices(self.operations, self.weights)[0]
+        patient_id = self.rng.choice(self.patient_ids)
+        started = time.perf_counter()
+        try:
+            resp = await self._request(operation, patient_id)
+        except httpx.TransportError:
+            # The server closed the connection (e.g. after a 500); count it rather than abort the run.
+            return operation, time.perf_counter() - started, False
+        elapsed = time.perf_counter() - started
+        return operation, elapsed, resp.status_code < 400
+
+    async def _request(self, operation: str, patient_id: str) -> httpx.Response:
+        if operation == "GET /Patient":
+            nhs_number = nhs_number_for(self.rng.randrange(self.patients))
+            return await self.client.get("/Patient", params={"identifier": nhs_number}, headers=self.headers)
+        elif operation == "GET /Observation":
+            return await self.client.get("/Observation", params={"patient": patient_id}, headers=self.headers)
+        elif operation == "GET /MedicationRequest":
+            return await self.client.get("/MedicationRequest", params={"patient": patient_id}, headers=self.headers)
+        elif operation == "POST /Observation":
+            performed = datetime(2025, 1, 1) - timedelta(days=self.rng.randint(0, 365))
+            payload = {
+                "patient_id": patient_id,
+                "type": "Weight",
+                "value": round(self.rng.uniform(60, 90), 2),
+                "unit": "kg",
+                "interpretation": "NORMAL",
+                "performed_date": performed.isoformat(),
+            }
+            return await self.client.post("/Observation", json=payload, headers=self.headers)
+        else:
+            return await self.client.post("/export/csv", params={"patient_id": patient_id}, headers=self.headers)
+
+
+async def drive(client: httpx.AsyncClient, args, patient_ids: list[str]) -> dict:
+    mix = parse_mix(args.mix)
+    latencies: dict[str, list[float]] = {name: [] for name in mix}
+    errors: dict[str, int] = {name: 0 for name in mix}
+
+    workers = [Workload(client, args.patients, patient_ids, mix, args.seed + i) for i in range(args.concurrency)]
+    for worker in workers:
+        await worker.login()
+
+    warmup_deadline = time.perf_counter() + args.warmup
+    deadline = warmup_deadline + args.duration
+
+    async def run(worker: Workload) -> None:
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                return
+            operation, elapsed, ok = await worker.run_one()
+            if now < warmup_deadline:
+                continue
+            latencies[operation].append(elapsed)
+            if not ok:
+                errors[operation] += 1
+
+    await asyncio.gather(*(run(worker) for worker in workers))
+
+    endpoints = {}
+    all_latencies: list[float] = []
+    for name, values in latencies.items():
+        values.sort()
+        all_latencies.extend(values)
+        endpoints[name] = {
+            "count": len(values),
+            "errors": errors[name],
+            "throughput_rps": round(len(values) / args.duration, 2),
+            "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+            "p50_ms": round(percentile(values, 50) * 1000, 3),
+            "p95_ms": round(percentile(values, 95) * 1000, 3),
+            "p99_ms": round(percentile(values, 99) * 1000, 3),
+        }
+    all_latencies.sort()
+    total = {
+        "count": len(all_latencies),
+        "errors": sum(errors.values()),
+        "throughput_rps": round(len(all_latencies) / args.duration, 2),
+        "p50_ms": round(percentile(all_latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(all_latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(all_latencies, 99) * 1000, 3),
+    }
+    return {"endpoints": endpoints, "total": total}
+
+
+async def run_inprocess(args, patient_ids: list[str]) -> dict:
+    from app.main import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            return await drive(client, args, patient_ids)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run_uvicorn(args, patient_ids: list[str], env: dict[str, str], app: str = "app.main:app") -> dict:
+    port = _free_port()
+    command = [sys.executable, "-m", "uvicorn", app, "--host", "127.0.0.1", "--port", str(port)]
+    command += ["--workers", str(args.workers), "--no-access-log"]
+    server = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+            for _ in range(200):
+                try:
+                    if (await client.get("/health")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError("uvicorn did not become healthy")
+            return await drive(client, args, patient_ids)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=1000, help="Dataset size, e.g. 1000, 100000, 1000000")
+    parser.add_argument("--observations", type=int, default=10, help="Observations per patient")
+    parser.add_argument("--medications", type=int, default=2, help="Medications per patient")
+    parser.add_argument("--mode", choices=["inprocess", "uvicorn"], default="inprocess")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent simulated clinicians")
+    parser.add_argument("--duration", type=float, default=10.0, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Unmeasured warm-up seconds")
+    parser.add_argument("--mix", help="Operation weights, e.g. 'GET /Patient=50,POST /Observation=50'")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser
+
+
+def run_benchmark(args) -> dict:
+    """Seed (or reuse) the dataset, drive the workload against a fresh copy and return the report."""
+    # Benchmark a copy so writes do not change the cached dataset between runs.
+    run_db = DATA_DIR / f"run_{os.getpid()}.db"
+    env = benchmark_env(f"sqlite:///{run_db}")
+    # Settings are read on first import of app.config, which seeding may trigger.
+    os.environ.update(env)
+
+    seeded = build_dataset(args.patients, args.observations, args.medications, seed=args.seed)
+    run_db.write_bytes(seeded.read_bytes())
+
+    patient_ids = sample_patient_ids(run_db, seed=args.seed)
+    try:
+        if args.mode == "inprocess":
+            results = asyncio.run(run_inprocess(args, patient_ids))
+        else:
+            results = asyncio.run(run_uvicorn(args, patient_ids, env))
+    finally:
+        for path in (run_db, *run_db.parent.glob(f"{run_db.name}-*"), run_db.with_name(f"{run_db.name}.startup.lock")):
+            path.unlink(missing_ok=True)
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.utcnow().isoformat(),
+            "mode": args.mode,
+            "workers": args.workers if args.mode == "uvicorn" else 1,
+            "patients": args.patients,
+            "observations_per_patient": args.observations,
+            "medications_per_patient": args.medications,
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "mix": parse_mix(args.mix),
+            "python": sys.version.split()[0],
+        },
+        **results,
+    }
+
+
+def main() -> None:
+    parser = build_parser()
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes (uvicorn mode)")
+    parser.add_argument("--output", type=Path, help="Write JSON results here (default: stdout only)")
+    args = parser.parse_args()
+
+    output = json.dumps(run_benchmark(args), indent=2)
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(output + "\n", encoding="utf-8")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
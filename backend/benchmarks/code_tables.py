@@ -0,0 +1,127 @@
+﻿"""Storage and scan time of coded clinical tables against the old string layout.
+
+Seeds (or reuses) a dataset, which is written with code ids, and rewrites a
+copy with the strings inline (the layout before code tables). The string
+copy is then migrated back with ``app.upgrade.upgrade_tables``, as the API
+does on its first start after upgrading. Reports for each layout:
+
+- bytes per table and index, after VACUUM;
+- timings for typical scans, through plain sqlite3 so that only storage is
+  measured. Reading every row includes turning the codes back into strings.
+
+Usage (from backend/):
+    python -m benchmarks.code_tables
+    python -m benchmarks.code_tables --patients 200000 --observations 10 --repeats 5
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import statistics
+import time
+from pathlib import Path
+
+from benchmarks.datasets import BENCH_SECRET_SALT, DATA_DIR, build_dataset
+from benchmarks.layouts import migrate, older_layout, table_sizes
+
+
+TABLES = ["observations", "medications", "latest_observations"]
+
+
+def _scans(path: Path, coded: bool, repeats: int) -> dict[str, float]:
+    """Median milliseconds of each scan against one layout."""
+    conn = sqlite3.connect(path)
+    try:
+        codes = {}
+        for table in ("observation_types", "units", "interpretations", "drug_names"):
+            codes[table] = dict(conn.execute(f"SELECT name, id FROM {table}")) if coded else {}
+
+        def key(table: str, name: str):
+            return codes[table][name] if coded else name
+
+        names = {table: {code: name for name, code in ids.items()} for table, ids in codes.items()}
+
+        def read_all():
+            rows = conn.execute("SELECT id, patient_id, type, value, unit, interpretation FROM observations")
+            if not coded:
+                return sum(1 for _ in rows)
+            types, units, results = names["observation_types"], names["units"], names["interpretations"]
+            return sum(1 for row in rows if (types[row[2]], units[row[4]], results[row[5]]))
+
+        cases = {
+            "observations by type and result (full scan)": lambda: conn.execute(
+                "SELECT type, interpretation, count(*) FROM observations GROUP BY type, interpretation"
+            ).fetchall(),
+            "observations in kg (full scan)": lambda: conn.execute(
+                "SELECT count(*) FROM observations WHERE unit = ?", (key("units", "kg"),)
+            ).fetchall(),
+            "every observation row, decoded": read_all,
+            "Clozapine prescriptions (index range)": lambda: conn.execute(
+                "SELECT count(*) FROM medications WHERE drug_name = ?", (key("drug_names", "Clozapine"),)
+            ).fetchall(),
+            "latest HbA1c results (index range)": lambda: conn.execute(
+                "SELECT count(*) FROM latest_observations WHERE type = ? AND performed_date IS NOT NULL",
+                (key("observation_types", "HbA1c"),),
+            ).fetchall(),
+        }
+        timings = {}
+        for name, fn in cases.items():
+            fn()  # warm the page cache
+            samples = []
+            for _ in range(repeats):
+                started = time.perf_counter()
+                fn()
+                samples.append(time.perf_counter() - started)
+            timings[name] = statistics.median(samples) * 1000
+        return timings
+    finally:
+        conn.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=100000)
+    parser.add_argument("--observations", type=int, default=10, help="Observations per patient")
+    parser.add_argument("--medications", type=int, default=2, help="Medications per patient")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    os.environ.setdefault("SECRET_SALT", BENCH_SECRET_SALT)
+    seeded = build_dataset(args.patients, args.observations, args.medications)
+    coded = DATA_DIR / f"run_{os.getpid()}_coded.db"
+    strings = DATA_DIR / f"run_{os.getpid()}_strings.db"
+    migrated = DATA_DIR / f"run_{os.getpid()}_migrated.db"
+    try:
+        shutil.copyfile(seeded, coded)
+        conn = sqlite3.connect(coded)
+        conn.execute("VACUUM")
+        conn.close()
+        from app.codes import Coded
+
+        older_layout(coded, strings, (Coded,))
+        shutil.copyfile(strings, migrated)
+        migration = migrate(migrated)
+
+        print(f"{args.patients:,} patients, {args.observations} observations and {args.medications} medications each")
+        print(f"Migration of the string layout (upgrade_tables): {migration:.1f} s\n")
+        before, after, check = (table_sizes(path, TABLES) for path in (strings, coded, migrated))
+        print(f"{'table + indexes':<42} {'strings MB':>11} {'coded MB':>11} {'change':>8}")
+        for table in TABLES:
+            change = after[table] / before[table] - 1
+            print(f"{table:<42} {before[table] / 1e6:>11.1f} {after[table] / 1e6:>11.1f} {change:>8.0%}")
+        total = sum(after.values()) / sum(before.values()) - 1
+        print(f"{'total':<42} {sum(before.values()) / 1e6:>11.1f} {sum(after.values()) / 1e6:>11.1f} {total:>8.0%}")
+        print(f"{'database file':<42} {strings.stat().st_size / 1e6:>11.1f} {coded.stat().st_size / 1e6:>11.1f}")
+        print(f"{'string copy after migration':<42} {'':>11} {sum(check.values()) / 1e6:>11.1f}")
+
+        before, after = _scans(strings, False, args.repeats), _scans(coded, True, args.repeats)
+        print(f"\n{'scan':<42} {'strings ms':>11} {'coded ms':>11} {'change':>8}")
+        for name in before:
+            print(f"{name:<42} {before[name]:>11.1f} {after[name]:>11.1f} {after[name] / before[name] - 1:>8.0%}")
+    finally:
+        for path in (coded, strings, migrated):
+            path.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    main()
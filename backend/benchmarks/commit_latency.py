@@ -0,0 +1,28 @@
+﻿"""The EPR app with a fixed delay added to every write commit, for benchmarks.
+
+On a fast local disk with ``synchronous=NORMAL`` a commit costs almost
+nothing, so a write transaction holds its SQLite lock only for the CPU work
+of the request, and on a single core nothing else could run in the meantime
+anyway. With durable or network-attached storage each commit waits on the
+disk with the write lock held; this module emulates that wait, so the time a
+database's lock is held but the CPU is free can be benchmarked on any
+machine. Run as ``uvicorn benchmarks.commit_latency:app`` with
+``BENCH_COMMIT_LATENCY_MS`` set.
+"""
+import os
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.main import app  # noqa: F401 - served by uvicorn
+
+COMMIT_LATENCY = float(os.environ.get("BENCH_COMMIT_LATENCY_MS", "0")) / 1000
+
+
+@event.listens_for(Engine, "commit")
+def _flush_to_storage(conn):
+    # The commit event fires before COMMIT is sent, so the write lock (and writer queue) is still held here.
+    if COMMIT_LATENCY and conn.get_execution_options().get("sqlite_immediate", False):
+        time.sleep(COMMIT_LATENCY)
+
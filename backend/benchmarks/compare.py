@@ -0,0 +1,49 @@
+﻿"""Compare two api_load result files.
+
+Usage: python -m benchmarks.compare BASELINE.json CANDIDATE.json [--threshold 10]
+
+Exits non-zero when any endpoint's p95 latency regresses (or throughput
+drops) by more than the threshold percentage.
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+
+def _change(old: float, new: float) -> float:
+    return (new - old) / old * 100 if old else 0.0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument("candidate", type=Path)
+    parser.add_argument("--threshold", type=float, default=10.0, help="Allowed regression in percent")
+    args = parser.parse_args()
+
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+    candidate = json.loads(args.candidate.read_text(encoding="utf-8"))
+
+    regressions = []
+    print(f"{'endpoint':<24}{'rps old':>10}{'rps new':>10}{'p95 old':>10}{'p95 new':>10}{'p95 chg':>10}")
+    for name, new in {**candidate["endpoints"], "TOTAL": candidate["total"]}.items():
+        old = baseline["total"] if name == "TOTAL" else baseline["endpoints"].get(name)
+        if old is None:
+            continue
+        p95_change = _change(old["p95_ms"], new["p95_ms"])
+        rps_change = _change(old["throughput_rps"], new["throughput_rps"])
+        print(
+            f"{name:<24}{old['throughput_rps']:>10.1f}{new['throughput_rps']:>10.1f}"
+            f"{old['p95_ms']:>10.2f}{new['p95_ms']:>10.2f}{p95_change:>+9.1f}%"
+        )
+        if p95_change > args.threshold or rps_change < -args.threshold:
+            regressions.append(name)
+
+    if regressions:
+        print(f"Regressed beyond {args.threshold}%: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+﻿"""Bytes on the wire vs latency for response compression over a slow link.
+
+Starts uvicorn on a seeded dataset behind a local TCP proxy that adds
+round-trip delay and caps bandwidth (a remote clinic on a thin link), then
+fetches large JSON responses with each Accept-Encoding and reports the
+median latency and bytes transferred. It also times each codec in-process
+on the same bodies, so the CPU side of the trade-off is visible.
+
+Usage (from backend/):
+    python -m benchmarks.compression
+    python -m benchmarks.compression --patients 2000 --observations 200 --bandwidth-kbps 2000 --rtt-ms 80
+
+Requires httpx (and brotli for the br rows).
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Optional
+
+import httpx
+
+from benchmarks.api_load import BACKEND_DIR, _free_port
+from benchmarks.datasets import DATA_DIR, benchmark_env, build_dataset, sample_patient_ids
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ENCODINGS = ["identity", "gzip", "br"]
+
+
+class ThrottledProxy:
+    """TCP proxy adding half the RTT each way and serialising bytes at a fixed bandwidth."""
+
+    def __init__(self, upstream_port: int, bandwidth_bytes: float, rtt: float):
+        self.upstream_port = upstream_port
+        self.bandwidth_bytes = bandwidth_bytes
+        self.delay = rtt / 2
+        self.downstream_bytes = 0
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> int:
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, client_reader, client_writer) -> None:
+        upstream_reader, upstream_writer = await asyncio.open_connection("127.0.0.1", self.upstream_port)
+        try:
+            await asyncio.gather(
+                self.pipe(client_reader, upstream_writer, downstream=False),
+                self.pipe(upstream_reader, client_writer, downstream=True),
+                return_exceptions=True,
+            )
+        except asyncio.CancelledError:
+            # Keep-alive connections still open when the run ends.
+            upstream_writer.close()
+            client_writer.close()
+
+    async def pipe(self, reader, writer, downstream: bool) -> None:
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def deliver() -> None:
+            link_free = 0.0
+            while True:
+                arrived, chunk = await queue.get()
+                if chunk is None:
+                    break
+                # Propagation delay overlaps; serialisation on the link does not.
+                start = max(arrived + self.delay, link_free)
+                link_free = start + len(chunk) / self.bandwidth_bytes
+                await asyncio.sleep(max(0.0, link_free - loop.time()))
+                writer.write(chunk)
+                await writer.drain()
+            writer.close()
+
+        sender = asyncio.create_task(deliver())
+        try:
+            while chunk := await reader.read(16384):
+                if downstream:
+                    self.downstream_bytes += len(chunk)
+                queue.put_nowait((loop.time(), chunk))
+        finally:
+            queue.put_nowait((loop.time(), None))
+            await sender
+
+
+def codec_costs(body: bytes, repeats: int = 5) -> list[dict]:
+    """In-process size and compression time for each codec and level."""
+    codecs = [(f"gzip-{level}", lambda data, level=level: gzip.compress(data, level, mtime=0)) for level in (1, 6, 9)]
+    if brotli is not None:
+        codecs += [(f"br-{quality}", lambda data, q=quality: brotli.compress(data, quality=q)) for quality in (1, 4, 6, 11)]
+    rows = []
+    for name, compress in codecs:
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            compressed = compress(body)
+            timings.append(time.perf_counter() - started)
+        rows.append(
+            {
+                "codec": name,
+                "bytes": len(compressed),
+                "ratio": round(len(body) / len(compressed), 1),
+                "compress_ms": round(statistics.median(timings) * 1000, 2),
+            }
+        )
+    return rows
+
+
+async def measure(args, port: int, requests: dict[str, tuple[str, dict]]) -> dict:
+    proxy = ThrottledProxy(port, args.bandwidth_kbps * 1000 / 8, args.rtt_ms / 1000)
+    proxy_port = await proxy.start()
+    results: dict = {}
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60) as direct:
+            for _ in range(200):
+                try:
+                    if (await direct.get("/health")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError("uvicorn did not become healthy")
+            resp = await direct.post("/oauth/token", data={"username": "clinician", "password": "password123"})
+            auth = {"Authorization": f"Bearer {resp.json()['access_token']}"}
+
+            for name, (path, params) in requests.items():
+                raw = (await direct.get(path, params=params, headers={**auth, "Accept-Encoding": "identity"})).content
+                results[name] = {"body_bytes": len(raw), "link": {}, "codecs": codec_costs(raw)}
+
+        for encoding in ENCODINGS:
+            if encoding == "br" and brotli is None:
+                continue
+            headers = {**auth, "Accept-Encoding": encoding}
+            # One keep-alive connection, as a browser tab or the Streamlit client would use.
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{proxy_port}", timeout=120) as client:
+                await client.get("/health")
+                for name, (path, params) in requests.items():
+                    latencies, wire = [], []
+                    for _ in range(args.requests):
+                        before = proxy.downstream_bytes
+                        started = time.perf_counter()
+                        resp = await client.get(path, params=params, headers=headers)
+                        latencies.append(time.perf_counter() - started)
+                        wire.append(proxy.downstream_bytes - before)
+                        resp.raise_for_status()
+                    results[name]["link"][encoding] = {
+                        "content_encoding": resp.headers.get("content-encoding", "identity"),
+                        "wire_bytes": int(statistics.median(wire)),
+                        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+                    }
+    finally:
+        await proxy.close()
+    return results
+
+
+def print_report(report: dict) -> None:
+    meta = report["meta"]
+    print(f"\nLink: {meta['bandwidth_kbps']} kbit/s, {meta['rtt_ms']} ms RTT; {meta['requests']} requests each\n")
+    for name, result in report["results"].items():
+        print(f"{name}  ({result['body_bytes']:,} bytes uncompressed)")
+        for encoding, row in result["link"].items():
+            print(f"  {encoding:<9} {row['wire_bytes']:>11,} B on the wire  p50 {row['p50_ms']:>9.1f} ms")
+        for row in result["codecs"]:
+            print(f"  {row['codec']:<9} {row['bytes']:>11,} B  x{row['ratio']:<5}  {row['compress_ms']:>7.2f} ms to compress")
+        print()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--observations", type=int, default=100, help="Observations per patient")
+    parser.add_argument("--medications", type=int, default=2, help="Medications per patient")
+    parser.add_argument("--bandwidth-kbps", type=float, default=4000, help="Link bandwidth in kbit/s")
+    parser.add_argument("--rtt-ms", type=float, default=60, help="Link round-trip time")
+    parser.add_argument("--requests", type=int, default=5, help="Requests per endpoint and encoding")
+    parser.add_argument("--changes", type=int, default=1000, help="Page size for GET /_changes")
+    parser.add_argument("--json", action="store_true", help="Print the raw JSON report")
+    args = parser.parse_args()
+
+    run_db = DATA_DIR / f"run_{os.getpid()}.db"
+    env = benchmark_env(f"sqlite:///{run_db}")
+    os.environ.update(env)
+    seeded = build_dataset(args.patients, args.observations, args.medications)
+    run_db.write_bytes(seeded.read_bytes())
+    patient_id = sample_patient_ids(run_db, limit=1)[0]
+    requests = {
+        "GET /Observation": ("/Observation", {"patient": patient_id}),
+        "GET /_changes": ("/_changes", {"limit": args.changes}),
+    }
+
+    port = _free_port()
+    command = [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port)]
+    server = subprocess.Popen(
+        command + ["--no-access-log"], cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        results = asyncio.run(measure(args, port, requests))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        for path in (run_db, *run_db.parent.glob(f"{run_db.name}-*"), run_db.with_name(f"{run_db.name}.startup.lock")):
+            path.unlink(missing_ok=True)
+
+    report = {
+        "meta": {
+            "patients": args.patients,
+            "observations_per_patient": args.observations,
+            "bandwidth_kbps": args.bandwidth_kbps,
+            "rtt_ms": args.rtt_ms,
+            "requests": args.requests,
+        },
+        "results": results,
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+﻿"""Deterministic seeded SQLite datasets for benchmarks.
+
+Datasets are cached under ``benchmarks/.data`` keyed by their shape, so
+repeated runs (and runs on different commits) hit identical data.
+"""
+import os
+import random
+import sqlite3
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+DATA_DIR = Path(__file__).resolve().parent / ".data"
+BENCH_SECRET_SALT = "benchmark-salt"
+NHS_NUMBER_BASE = 9000000000
+
+TEST_TYPES = [
+    ("HbA1c", "mmol/mol", (20, 42)),
+    ("Weight", "kg", (60, 90)),
+    ("ECG", "ms", (350, 450)),
+    ("FBC", "x10^9/L", (4, 11)),
+    ("LFT", "U/L", (10, 40)),
+]
+DRUGS = [
+    ("Olanzapine", "10mg"),
+    ("Quetiapine", "200mg"),
+    ("Risperidone", "4mg"),
+    ("Aripiprazole", "15mg"),
+    ("Clozapine", "300mg"),
+    ("Metformin", "500mg"),
+    ("Atorvastatin", "20mg"),
+]
+INTERPRETATIONS = ["NORMAL", "ABNORMAL", "CRITICAL"]
+SEXES = ["M", "F", "Other"]
+AGE_BANDS = ["18-25", "26-35", "36-45", "46-55", "56-65", "66-75", "76+"]
+BATCH_SIZE = 10000
+# Part of the cache key: bumped whenever the on-disk layout changes (2: coded test types, units and drugs;
+# 3: 16-byte time-ordered UUID keys).
+LAYOUT_VERSION = 3
+
+
+def nhs_number_for(index: int) -> str:
+    """NHS number of the ``index``-th seeded patient."""
+    return f"{NHS_NUMBER_BASE + index:010d}"
+
+
+def dataset_path(patients: int, observations: int, medications: int) -> Path:
+    return DATA_DIR / f"epr_v{LAYOUT_VERSION}_p{patients}_o{observations}_m{medications}.db"
+
+
+def _ensure_env() -> None:
+    # app.hashing reads settings at import time.
+    os.environ.setdefault("SECRET_SALT", BENCH_SECRET_SALT)
+
+
+def benchmark_env(database_url: str, **overrides: str) -> dict[str, str]:
+    """Environment for the app under benchmark: this process's, on ``database_url``, plus ``overrides``."""
+    return {
+        **os.environ,
+        "DATABASE_URL": database_url,
+        "SECRET_SALT": os.environ.get("SECRET_SALT", BENCH_SECRET_SALT),
+        # Measure capacity, not the per-user limits (one benchmark user would exhaust its buckets at once).
+        "ADMISSION_ENABLED": os.environ.get("ADMISSION_ENABLED", "false"),
+        **overrides,
+    }
+
+
+def build_dataset(patients: int, observations: int = 10, medications: int = 2, seed: int = 42) -> Path:
+    """Create (or reuse) a seeded database and return its path."""
+    path = dataset_path(patients, observations, medications)
+    if path.exists():
+        return path
+
+    _ensure_env()
+    from app import models
+    from app.analytics import rebuild_summaries
+    from app.changes import backfill_changes
+    from app.monitoring import rebuild_latest
+    from app.search import ensure_search_index
+    from app.hashing import generate_pseudonym, hash_nhs_number
+    from app.keys import time_ordered_uuid
+
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    partial = path.with_suffix(".partial")
+    if partial.exists():
+        partial.unlink()
+
+    engine = create_engine(f"sqlite:///{partial}")
+    models.Base.metadata.create_all(bind=engine)
+    engine.dispose()
+
+    rng = random.Random(seed)
+    uuid_rng = random.Random(seed + 1)
+    now = datetime(2025, 1, 1)
+
+    created_ids = iter(range(int(now.timestamp() * 1000), 1 << 48))
+
+    def new_id() -> bytes:
+        # Stored form of app.keys.generate_uuid, one millisecond apart in creation order.
+        return time_ordered_uuid(next(created_ids), uuid_rng.getrandbits(80)).bytes
+
+    # Code tables (app.codes): rows store each string's id.
+    code_tables = {
+        "observation_types": [test_type for test_type, _, _ in TEST_TYPES],
+        "units": list(dict.fromkeys(unit for _, unit, _ in TEST_TYPES)),
+        "interpretations": INTERPRETATIONS,
+        "drug_names": [drug for drug, _ in DRUGS],
+    }
+    code = {table: {name: index + 1 for index, name in enumerate(names)} for table, names in code_tables.items()}
+
+    conn = sqlite3.connect(partial)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    try:
+        for table, ids in code.items():
+            rows = [(id_, name) for name, id_ in ids.items()]
+            conn.executemany(f"INSERT INTO {table} (id, name) VALUES (?, ?)", rows)
+        for start in range(0, patients, BATCH_SIZE):
+            patient_rows, obs_rows, med_rows = [], [], []
+            for index in range(start, min(start + BATCH_SIZE, patients)):
+                patient_id = new_id()
+                created = str(now - timedelta(days=rng.randint(0, 3650)))
+                patient_rows.append(
+                    (
+                        patient_id,
+                        hash_nhs_number(nhs_number_for(index)),
+                        generate_pseudonym(index + 1),
+                        rng.choice(SEXES),
+                        rng.choice(AGE_BANDS),
+                        created,
+                    )
+                )
+                for _ in range(observations):
+                    test_type, unit, (low, high) = rng.choice(TEST_TYPES)
+                    rand = rng.random()
+                    interpretation = "NORMAL" if rand < 0.7 else "ABNORMAL" if rand < 0.9 else "CRITICAL"
+                    performed = str(now - timedelta(days=rng.randint(0, 1825), minutes=rng.randint(0, 1439)))
+                    value = round(rng.uniform(low, high), 2)
+                    obs_rows.append(
+                        (
+                            new_id(),
+                            patient_id,
+                            code["observation_types"][test_type],
+                            value,
+                            code["units"][unit],
+                            code["interpretations"][interpretation],
+                            performed,
+                            performed,
+                        )
+                    )
+                for _ in range(medications):
+                    drug, dose = rng.choice(DRUGS)
+                    started = now - timedelta(days=rng.randint(0, 1825))
+                    stopped = str(started + timedelta(days=rng.randint(30, 365))) if rng.random() < 0.3 else None
+                    med_rows.append(
+                        (new_id(), patient_id, code["drug_names"][drug], dose, str(started), stopped, str(started))
+                    )
+
+            conn.executemany(
+                "INSERT INTO patients (id, nhs_hash, pseudonym, sex, age_band, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                patient_rows,
+            )
+            conn.executemany(
+                "INSERT INTO observations (id, patient_id, type, value, unit, interpretation, performed_date, "
+                "created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                obs_rows,
+            )
+            conn.executemany(
+                "INSERT INTO medications (id, patient_id, drug_name, dose, start_date, stop_date, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                med_rows,
+            )
+            conn.commit()
+        # As the API runs it: code-table reads on a second connection proceed beside the rebuilds below.
+        conn.execute("PRAGMA journal_mode=WAL")
+    finally:
+        conn.close()
+
+    engine = create_engine(f"sqlite:///{partial}")
+    with Session(engine) as db:
+        rebuild_summaries(db)
+        rebuild_latest(db)
+        backfill_changes(db)
+        ensure_search_index(db)
+    engine.dispose()
+
+    partial.rename(path)
+    return path
+
+
+def sample_patient_ids(path: Path, limit: int = 5000, seed: int = 42) -> list[str]:
+    """A deterministic sample of patient IDs from a dataset."""
+    conn = sqlite3.connect(path)
+    try:
+        ids = [str(uuid.UUID(bytes=row[0])) for row in conn.execute("SELECT id FROM patients ORDER BY rowid")]
+    finally:
+        conn.close()
+    rng = random.Random(seed)
+    return rng.sample(ids, min(limit, len(ids)))
@@ -0,0 +1,103 @@
+﻿"""Older on-disk layouts of a benchmark dataset, and the bytes each b-tree takes.
+
+Datasets are written in the current layout. ``older_layout`` copies one with
+chosen column types stored as they were before (code strings inline, UUIDs as
+text), which ``app.upgrade.upgrade_tables`` then migrates as the API does on
+its first start after upgrading.
+"""
+import shutil
+import sqlite3
+import time
+import uuid
+from pathlib import Path
+
+
+def older_layout(source: Path, target: Path, column_types: tuple) -> None:
+    """Copy ``source`` to ``target`` with every column of ``column_types`` (Coded, UUIDKey) in its old form."""
+    from sqlalchemy import MetaData, String
+    from sqlalchemy.dialects import sqlite
+    from sqlalchemy.schema import CreateIndex, CreateTable
+
+    from app import models
+    from app.codes import Coded
+
+    metadata = MetaData()
+    for table in models.Base.metadata.sorted_tables:
+        table.to_metadata(metadata)
+
+    shutil.copyfile(source, target)
+    conn = sqlite3.connect(target)
+    conn.create_function("uuid_text", 1, lambda value: value and str(uuid.UUID(bytes=value)), deterministic=True)
+    try:
+        for table in models.Base.metadata.sorted_tables:
+            changed = [column for column in table.columns if isinstance(column.type, column_types)]
+            if not changed:
+                continue
+            plain = metadata.tables[table.name]
+            for column in changed:
+                plain.c[column.name].type = String()
+            indexes = conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (table.name,)
+            ).fetchall()
+            for (name,) in indexes:
+                conn.execute(f"DROP INDEX {name}")
+            conn.execute(f"ALTER TABLE {table.name} RENAME TO {table.name}_current")
+            conn.execute(str(CreateTable(plain).compile(dialect=sqlite.dialect())))
+            for index in plain.indexes:
+                conn.execute(str(CreateIndex(index).compile(dialect=sqlite.dialect())))
+            values = [
+                column.name
+                if column not in changed
+                else f"(SELECT name FROM {column.type.table} WHERE id = {table.name}_current.{column.name})"
+                if isinstance(column.type, Coded)
+                else f"uuid_text({column.name})"
+                for column in table.columns
+            ]
+            names = ", ".join(column.name for column in table.columns)
+            conn.execute(f"INSERT INTO {table.name} ({names}) SELECT {', '.join(values)} FROM {table.name}_current")
+            conn.execute(f"DROP TABLE {table.name}_current")
+        conn.commit()
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+def migrate(path: Path) -> float:
+    """Seconds ``app.upgrade.upgrade_tables`` takes to bring an older layout up to date (VACUUM not included)."""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+
+    from app.upgrade import upgrade_tables
+
+    started = time.perf_counter()
+    engine = create_engine(f"sqlite:///{path}")
+    try:
+        with Session(engine) as db:
+            upgrade_tables(db)
+    finally:
+        engine.dispose()
+    elapsed = time.perf_counter() - started
+    conn = sqlite3.connect(path)
+    conn.execute("VACUUM")
+    conn.close()
+    return elapsed
+
+
+def btree_sizes(path: Path) -> dict[str, tuple[str, int]]:
+    """Table and index name -> (owning table, bytes), from dbstat."""
+    conn = sqlite3.connect(path)
+    try:
+        owner = dict(conn.execute("SELECT name, tbl_name FROM sqlite_master WHERE type IN ('table', 'index')"))
+        sizes = conn.execute("SELECT name, sum(pgsize) FROM dbstat GROUP BY name")
+        return {name: (owner.get(name, name), size) for name, size in sizes}
+    finally:
+        conn.close()
+
+
+def table_sizes(path: Path, tables: list[str]) -> dict[str, int]:
+    """Bytes used by each of ``tables`` together with its indexes."""
+    sizes = dict.fromkeys(tables, 0)
+    for table, size in btree_sizes(path).values():
+        if table in sizes:
+            sizes[table] += size
+    return sizes
@@ -0,0 +1,104 @@
+﻿"""Per-request overhead of the redaction middleware.
+
+Drives a minimal FastAPI app directly over ASGI (no sockets) and compares:
+- no middleware
+- the previous pass-through ``BaseHTTPMiddleware``
+- the pure ASGI ``RedactionMiddleware``
+
+Usage: python -m benchmarks.middleware_overhead [--requests N]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from fastapi import FastAPI
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from app.redaction import RedactionMiddleware
+
+
+class PassThroughMiddleware(BaseHTTPMiddleware):
+    """The pre-ASGI implementation, kept here as the comparison baseline."""
+
+    async def dispatch(self, request, call_next):
+        return await call_next(request)
+
+
+def build_app(middleware=None) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/ping")
+    async def ping():
+        return {"status": "ok"}
+
+    if middleware is not None:
+        app.add_middleware(middleware)
+    return app
+
+
+async def drive(app, requests: int) -> float:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/ping",
+        "raw_path": b"/ping",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("bench", 80),
+    }
+
+    never = asyncio.Event()
+
+    def make_receive():
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await never.wait()
+
+        return receive
+
+    async def send(message):
+        pass
+
+    for _ in range(200):
+        await app(dict(scope), make_receive(), send)
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(scope), make_receive(), send)
+    return (time.perf_counter() - started) / requests * 1_000_000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    variants = {
+        "none": build_app(),
+        "base_http_middleware": build_app(PassThroughMiddleware),
+        "asgi_redaction_middleware": build_app(RedactionMiddleware),
+    }
+    results = {name: asyncio.run(drive(app, args.requests)) for name, app in variants.items()}
+    baseline = results["none"]
+    print(json.dumps(
+        {
+            name: {"us_per_request": round(us, 1), "overhead_us": round(us - baseline, 1)}
+            for name, us in results.items()
+        },
+        indent=2,
+    ))
+
+
+if __name__ == "__main__":
+    main()
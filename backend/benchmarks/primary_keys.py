@@ -0,0 +1,147 @@
+﻿"""Insert rate and index size of 16-byte time-ordered keys against the old text UUIDs.
+
+Seeds (or reuses) a dataset, whose keys are stored as in ``app.keys``, and
+rewrites a copy with every key as 36 characters of random (version 4) text,
+the layout before. For each layout it reports:
+
+- bytes per table and per index of observations, after VACUUM;
+- the rate of appending observations and their change-log entries in
+  transactions of ``--batch`` rows, as the API does (WAL, synchronous=NORMAL),
+  with new keys generated the way each layout's API generated them, and the
+  index sizes those inserts leave behind.
+
+The text copy is then migrated with ``app.upgrade.upgrade_tables``, timed.
+
+Usage (from backend/):
+    python -m benchmarks.primary_keys
+    python -m benchmarks.primary_keys --patients 200000 --inserts 200000 --batch 1
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from benchmarks.datasets import BENCH_SECRET_SALT, DATA_DIR, build_dataset
+from benchmarks.layouts import btree_sizes, migrate, older_layout, table_sizes
+
+
+TABLES = ["patients", "observations", "medications", "latest_observations", "change_log"]
+
+
+def _insert(path: Path, compact: bool, rows: int, batch: int, seed: int = 7) -> float:
+    """Observations (with change-log entries) appended per second to the database at ``path``."""
+    from app.keys import time_ordered_uuid
+
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    try:
+        patients = [row[0] for row in conn.execute("SELECT id FROM patients")]
+        millis = int(time.time() * 1000)
+
+        def new_id(offset: int):
+            if compact:
+                return time_ordered_uuid(millis + offset, rng.getrandbits(80)).bytes
+            return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+        now = datetime(2025, 1, 1)
+        elapsed = 0.0
+        for start in range(0, rows, batch):
+            observations, changes = [], []
+            for offset in range(start, min(start + batch, rows)):
+                patient_id, obs_id = rng.choice(patients), new_id(offset)
+                created = str(now + timedelta(seconds=offset))
+                observations.append((obs_id, patient_id, rng.randint(1, 5), rng.uniform(20, 90), 1, 1, created, created))
+                changes.append(("Observation", obs_id, patient_id, "create", created))
+            started = time.perf_counter()
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT INTO observations (id, patient_id, type, value, unit, interpretation, performed_date, "
+                "created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                observations,
+            )
+            conn.executemany(
+                "INSERT INTO change_log (resource_type, resource_id, patient_id, action, changed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                changes,
+            )
+            conn.execute("COMMIT")
+            elapsed += time.perf_counter() - started
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return rows / elapsed
+    finally:
+        conn.close()
+
+
+def _observation_btrees(path: Path) -> dict[str, int]:
+    """Bytes of the observations table and each of its indexes, under layout-independent names."""
+    sizes = {}
+    for name, (table, size) in btree_sizes(path).items():
+        if table == "observations":
+            sizes["primary key (autoindex)" if name.startswith("sqlite_autoindex") else name] = size
+    return dict(sorted(sizes.items()))
+
+
+def _print_sizes(title: str, before: dict[str, int], after: dict[str, int]) -> None:
+    print(f"{title:<48} {'text MB':>9} {'16-byte MB':>11} {'change':>8}")
+    for name in before:
+        change = after[name] / before[name] - 1
+        print(f"{name:<48} {before[name] / 1e6:>9.1f} {after[name] / 1e6:>11.1f} {change:>8.0%}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=100000)
+    parser.add_argument("--observations", type=int, default=10, help="Observations per patient")
+    parser.add_argument("--medications", type=int, default=2, help="Medications per patient")
+    parser.add_argument("--inserts", type=int, default=100000, help="Observations appended per layout")
+    parser.add_argument("--batch", type=int, default=10, help="Observations per transaction")
+    args = parser.parse_args()
+
+    os.environ.setdefault("SECRET_SALT", BENCH_SECRET_SALT)
+    from app.keys import UUIDKey
+
+    seeded = build_dataset(args.patients, args.observations, args.medications)
+    compact = DATA_DIR / f"run_{os.getpid()}_compact.db"
+    text = DATA_DIR / f"run_{os.getpid()}_text.db"
+    migrated = DATA_DIR / f"run_{os.getpid()}_migrated.db"
+    try:
+        shutil.copyfile(seeded, compact)
+        conn = sqlite3.connect(compact)
+        conn.execute("VACUUM")
+        conn.close()
+        older_layout(compact, text, (UUIDKey,))
+        shutil.copyfile(text, migrated)
+        migration = migrate(migrated)
+
+        print(f"{args.patients:,} patients, {args.observations} observations and {args.medications} medications each")
+        print(f"Migration of the text layout (upgrade_tables): {migration:.1f} s\n")
+        before, after, check = (table_sizes(path, TABLES) for path in (text, compact, migrated))
+        _print_sizes("table + indexes", before, after)
+        total = sum(after.values()) / sum(before.values()) - 1
+        print(f"{'total':<48} {sum(before.values()) / 1e6:>9.1f} {sum(after.values()) / 1e6:>11.1f} {total:>8.0%}")
+        print(f"{'text copy after migration':<48} {'':>9} {sum(check.values()) / 1e6:>11.1f}\n")
+        _print_sizes("observations b-tree", _observation_btrees(text), _observation_btrees(compact))
+
+        rates = {
+            "text": _insert(text, False, args.inserts, args.batch),
+            "compact": _insert(compact, True, args.inserts, args.batch),
+        }
+        print(f"\nAppending {args.inserts:,} observations and change-log entries, {args.batch} per transaction:")
+        change = rates["compact"] / rates["text"] - 1
+        print(f"{'rows/s':<48} {rates['text']:>9,.0f} {rates['compact']:>11,.0f} {change:>8.0%}")
+        _print_sizes("observations b-tree after appending", _observation_btrees(text), _observation_btrees(compact))
+    finally:
+        for path in (compact, text, migrated):
+            for suffix in ("", "-wal", "-shm"):
+                Path(f"{path}{suffix}").unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+﻿"""Per-endpoint SQL statement budgets, to catch N+1 regressions.
+
+Runs a fixed request scenario against a small and a larger dataset and
+counts the SQL statements each request issues. The build fails (non-zero
+exit) when a request exceeds its declared budget or when its count
+changes with dataset size.
+
+Usage (from backend/): python -m benchmarks.query_budget [--large 50]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+
+# Budgets are the maximum statements per request, whatever the dataset size. Every write adds
+# one statement for its change-log entry. Observation and medication writes also include three
+# statements maintaining the analytics summary tables, and observation writes (and
+# monitored-drug prescriptions) one more for the latest-result index. Medication writes also look up
+# the newest archived observation to see whether the archive overlaps the prescription. A test type,
+# unit, interpretation or drug name written for the first time adds one statement for its code (the
+# scenario's observation has a new unit, its prescription a new drug, and simulated events a new unit),
+# and a filter on a string with no code re-reads that code table (the due list's never-prescribed drugs).
+BUDGETS = {
+    "GET /Patient": 1,
+    "GET /Patient?_elements": 1,
+    "GET /Patient/search": 1,
+    "POST /Patient": 5,
+    "GET /Observation": 2,
+    "GET /Observation?_elements": 2,
+    "GET /Observation?_summary=count": 2,
+    "GET /Observation/series": 3,
+    "GET /Observation/series?method=bucket": 3,
+    "POST /Observation": 10,
+    "GET /MedicationRequest": 2,
+    "GET /MedicationRequest?_summary=count": 2,
+    "POST /MedicationRequest": 10,
+    "GET /MedicationRequest/search": 2,
+    "POST /export/csv": 8,
+    "POST /export/csv?patient_id": 9,
+    "GET /export/csv/{job_id}": 1,
+    "GET /monitoring/due": 2,
+    "GET /_changes": 4,
+    "POST /simulate/events?count=5": 38,
+}
+
+
+class QueryCounter:
+    """Statements executed on an engine while the counter is active."""
+
+    def __init__(self) -> None:
+        self.statements: list[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+
+@contextmanager
+def count_queries(engine: Engine) -> Iterator[QueryCounter]:
+    """Count SQL statements issued on ``engine`` within the block."""
+    counter = QueryCounter()
+
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter.statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, "before_cursor_execute", _before_cursor_execute)
+
+
+def _seed(session_factory, patients: int) -> list[str]:
+    from app import crud, schemas
+
+    db = session_factory()
+    try:
+        patient_ids = []
+        for index in range(patients):
+            patient = crud.create_patient(
+                db, schemas.PatientCreate(nhs_number=f"{8000000000 + index}", sex="F", age_band="26-35")
+            )
+            patient_ids.append(patient.id)
+            for days_ago in range(5):
+                crud.create_observation(
+                    db,
+                    schemas.ObservationCreate(
+                        patient_id=patient.id,
+                        type="HbA1c",
+                        value=40 + days_ago,
+                        unit="mmol/mol",
+                        interpretation="NORMAL",
+                        performed_date=datetime.utcnow() - timedelta(days=days_ago),
+                    ),
+                )
+            crud.create_medication(
+                db,
+                schemas.MedicationCreate(
+                    patient_id=patient.id,
+                    drug_name="Olanzapine",
+                    dose="10mg",
+                    start_date=datetime.utcnow() - timedelta(days=30),
+                ),
+            )
+        return patient_ids
+    finally:
+        db.close()
+
+
+def measure(db_path: Path, patients: int) -> dict[str, int]:
+    """Statement count per scenario step against a fresh database of ``patients`` patients."""
+    from fastapi.testclient import TestClient
+
+    from app import models, search
+    from app.database import get_db, get_write_db
+    from app.main import app
+
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    models.Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = session_factory()
+    try:
+        search.ensure_search_index(db)
+    finally:
+        db.close()
+    patient_ids = _seed(session_factory, patients)
+
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_write_db] = override_get_db
+    counts: dict[str, int] = {}
+    try:
+        with TestClient(app) as client:
+            token = client.post("/oauth/token", data={"username": "admin", "password": "admin123"}).json()
+            headers = {"Authorization": f"Bearer {token['access_token']}"}
+            patient_id = patient_ids[0]
+            now = datetime.utcnow().isoformat()
+
+            def call(name: str, method: str, url: str, **kwargs):
+                with count_queries(engine) as counter:
+                    resp = client.request(method, url, headers=headers, **kwargs)
+                if resp.status_code >= 400:
+                    raise RuntimeError(f"{name} failed with {resp.status_code}: {resp.text}")
+                counts[name] = counter.count
+                return resp
+
+            call("GET /Patient", "GET", "/Patient", params={"identifier": "8000000000"})
+            call("GET /Patient?_elements", "GET", "/Patient", params={"identifier": "8000000000", "_elements": "pseudonym"})
+            call("GET /Patient/search", "GET", "/Patient/search", params={"pseudonym": "PAT-00000"})
+            call("POST /Patient", "POST", "/Patient", json={"nhs_number": "7999999999", "sex": "M", "age_band": "36-45"})
+            call("GET /Observation", "GET", "/Observation", params={"patient": patient_id})
+            narrow = {"patient": patient_id, "_elements": "performed_date"}
+            call("GET /Observation?_elements", "GET", "/Observation", params=narrow)
+            count = {"patient": patient_id, "_summary": "count"}
+            call("GET /Observation?_summary=count", "GET", "/Observation", params=count)
+            series_params = {"patient": patient_id, "type": "HbA1c", "points": 3}
+            call("GET /Observation/series", "GET", "/Observation/series", params=series_params)
+            call(
+                "GET /Observation/series?method=bucket",
+                "GET",
+                "/Observation/series",
+                params={**series_params, "method": "bucket"},
+            )
+            call(
+                "POST /Observation",
+                "POST",
+                "/Observation",
+                json={
+                    "patient_id": patient_id,
+                    "type": "Weight",
+                    "value": 70.0,
+                    "unit": "kg",
+                    "interpretation": "NORMAL",
+                    "performed_date": now,
+                },
+            )
+            call("GET /MedicationRequest", "GET", "/MedicationRequest", params={"patient": patient_id})
+            call("GET /MedicationRequest?_summary=count", "GET", "/MedicationRequest", params=count)
+            call(
+                "POST /MedicationRequest",
+                "POST",
+                "/MedicationRequest",
+                json={"patient_id": patient_id, "drug_name": "Metformin", "dose": "500mg", "start_date": now},
+            )
+            call("GET /MedicationRequest/search", "GET", "/MedicationRequest/search", params={"drug": "olanzpine"})
+            job = call("POST /export/csv", "POST", "/export/csv").json()
+            call("POST /export/csv?patient_id", "POST", "/export/csv", params={"patient_id": patient_id})
+            call("GET /export/csv/{job_id}", "GET", f"/export/csv/{job['id']}")
+            call("GET /monitoring/due", "GET", "/monitoring/due", params={"limit": 10})
+            call("GET /_changes", "GET", "/_changes", params={"limit": 100})
+            # Simulated dates are random; seed so both dataset sizes see the same events.
+            random.seed(0)
+            call("POST /simulate/events?count=5", "POST", "/simulate/events", params={"patient_id": patient_id, "count": 5})
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+        app.dependency_overrides.pop(get_write_db, None)
+        engine.dispose()
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--small", type=int, default=2, help="Patients in the small dataset")
+    parser.add_argument("--large", type=int, default=25, help="Patients in the large dataset")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print counts for every request")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.setdefault("SECRET_SALT", "query-budget-salt")
+        # App startup creates tables in DATABASE_URL; keep that away from the working directory.
+        os.environ["DATABASE_URL"] = f"sqlite:///{Path(tmp) / 'app.db'}"
+        # One process, so code tables never change behind the cache: re-read them only on the first miss,
+        # rather than depending on how long each run takes.
+        os.environ["CODE_CACHE_RELOAD_SECONDS"] = "3600"
+        # Both dataset sizes replay the same requests as one user, which would run out of export tokens.
+        os.environ["ADMISSION_ENABLED"] = "false"
+        small = measure(Path(tmp) / "small.db", args.small)
+        large = measure(Path(tmp) / "large.db", args.large)
+
+    failures = []
+    for name, budget in BUDGETS.items():
+        small_count, large_count = small.get(name), large.get(name)
+        if args.verbose:
+            print(f"{name:<40} budget={budget:<3} small={small_count} large={large_count}")
+        if large_count is None or small_count is None:
+            failures.append(f"{name}: not exercised")
+        elif max(small_count, large_count) > budget:
+            failures.append(f"{name}: {max(small_count, large_count)} statements (budget {budget})")
+        elif small_count != large_count:
+            failures.append(f"{name}: {small_count} statements with {args.small} patients, {large_count} with {args.large}")
+
+    if failures:
+        print("Query budget exceeded:")
+        for failure in failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print(f"All {len(BUDGETS)} endpoints within query budget.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+﻿"""Latency of pseudonym-prefix and drug-name search pages on a large dataset.
+
+Seeds (or reuses) a dataset with many medications per patient, prepares a
+copy the way the API does at startup (indexes and the FTS5 trigram index of
+drug names), then times each search, including a page far down the result
+list reached by following ``next_after`` cursors. A substring LIKE over the
+drug name of every medication row is timed alongside as the unindexed
+baseline.
+
+Usage (from backend/):
+    python -m benchmarks.search
+    python -m benchmarks.search --patients 200000 --medications 10 --pages 500
+"""
+import argparse
+import os
+import statistics
+import time
+from datetime import datetime
+
+from benchmarks.datasets import BENCH_SECRET_SALT, DATA_DIR, build_dataset
+
+
+def timed(fn, repeats: int) -> tuple[float, float, object]:
+    timings, result = [], None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return statistics.median(timings) * 1000, timings[int(len(timings) * 0.95) - 1] * 1000, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=200000)
+    parser.add_argument("--observations", type=int, default=1, help="Observations per patient")
+    parser.add_argument("--medications", type=int, default=5, help="Medications per patient")
+    parser.add_argument("--limit", type=int, default=50, help="Page size")
+    parser.add_argument("--pages", type=int, default=200, help="Pages to follow before timing the deep page")
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    run_db = DATA_DIR / f"run_{os.getpid()}.db"
+    # The unindexed baseline would flood the slow-query log.
+    os.environ.update({"DATABASE_URL": f"sqlite:///{run_db}", "SHARD_DATABASE_URLS": "[]", "SLOW_QUERY_MS": "0"})
+    os.environ.setdefault("SECRET_SALT", BENCH_SECRET_SALT)
+    seeded = build_dataset(args.patients, args.observations, args.medications)
+    run_db.write_bytes(seeded.read_bytes())
+
+    from sqlalchemy import func, text
+
+    from app import models, search
+    from app.database import SessionLocal, engine, init_database
+
+    try:
+        started = time.perf_counter()
+        init_database()
+        print(f"Startup preparation (indexes, FTS index): {time.perf_counter() - started:.1f} s")
+
+        db = SessionLocal()
+        try:
+            total = db.scalar(text("SELECT count(*) FROM medications"))
+            print(f"{args.patients:,} patients, {total:,} medications, page size {args.limit}\n")
+
+            def follow(query: str, pages: int):
+                after = None
+                for _ in range(pages):
+                    page = search.search_medications(db, query, after=after, limit=args.limit)
+                    if not page["next_after"]:
+                        break
+                    after = search.decode_cursor(page["next_after"], 2)
+                return after
+
+            deep_after = follow("Clozapine", args.pages)
+            patient_after = search.search_patients(db, "PAT-0", limit=args.limit * args.pages)["next_after"]
+            cases = {
+                "pseudonym prefix PAT-00012": lambda: search.search_patients(db, "PAT-00012", limit=args.limit),
+                f"pseudonym prefix PAT-0, page {args.pages + 1}": lambda: search.search_patients(
+                    db, "PAT-0", patient_after, args.limit
+                ),
+                "drug Clozapine": lambda: search.search_medications(db, "Clozapine", limit=args.limit),
+                f"drug Clozapine, page {args.pages + 1}": lambda: search.search_medications(
+                    db, "Clozapine", after=deep_after, limit=args.limit
+                ),
+                "drug 'pine' (substring)": lambda: search.search_medications(db, "pine", limit=args.limit),
+                "drug 'Klozapine' (fuzzy)": lambda: search.search_medications(db, "Klozapine", limit=args.limit),
+                # Seeded prescriptions run up to 2025-01-01.
+                "drug Clozapine, active 2024-06-01": lambda: search.search_medications(
+                    db, "Clozapine", active_on=datetime(2024, 6, 1), limit=args.limit
+                ),
+                "baseline: LIKE '%clozapine%' count": lambda: db.query(models.Medication)
+                .join(models.DrugName, models.DrugName.id == models.Medication.drug_name)
+                .filter(func.lower(models.DrugName.name).like("%clozapine%"))
+                .count(),
+            }
+            print(f"{'search':<42} {'p50 ms':>9} {'p95 ms':>9}  result")
+            for name, fn in cases.items():
+                p50, p95, result = timed(fn, args.repeats)
+                if isinstance(result, dict):
+                    summary = f"{len(result['items'])} items"
+                    if "drug_names" in result:
+                        summary += f", drugs {result['drug_names']}"
+                else:
+                    summary = f"{result:,} rows"
+                print(f"{name:<42} {p50:>9.2f} {p95:>9.2f}  {summary}")
+        finally:
+            db.close()
+    finally:
+        engine.dispose()
+        for path in (run_db, *run_db.parent.glob(f"{run_db.name}-*"), run_db.with_name(f"{run_db.name}.startup.lock")):
+            path.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    main()
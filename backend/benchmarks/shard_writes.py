@@ -0,0 +1,110 @@
+﻿"""Write throughput of POST /Observation as the database is split into shards.
+
+For each shard count, copies the seeded dataset, splits it with
+``python -m app.sharding rebalance`` (0 keeps the single unsharded
+database) and drives a write-only workload against uvicorn with several
+workers. Reports writes/second, p95 latency, errors and the speed-up over
+the first shard count. Each shard has its own SQLite write lock (and its own
+change log), so writes for patients on different shards never queue behind
+each other; only the patient lookup reads the primary.
+
+A write holds its database's lock for the CPU work of the request plus the
+commit's flush to storage. On a local SSD that flush is nearly free, so with
+fewer cores than workers the run is CPU-bound and sharding cannot help;
+``--commit-latency-ms`` adds a fixed flush delay to every commit (served by
+``benchmarks.commit_latency``) to model durable or network-attached storage,
+where the lock, not the CPU, limits a single database.
+
+Usage (from backend/):
+    python -m benchmarks.shard_writes --shards 0 2 4 --workers 4 --patients 10000 --concurrency 32
+    python -m benchmarks.shard_writes --shards 0 2 4 --commit-latency-ms 10
+
+Requires httpx. Without commit latency, speed-up is bounded by the number of CPU cores available.
+"""
+import asyncio
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from benchmarks.api_load import BACKEND_DIR, build_parser, run_uvicorn
+from benchmarks.datasets import BENCH_SECRET_SALT, DATA_DIR, benchmark_env, build_dataset, sample_patient_ids
+
+
+def _database_files(db: Path) -> list[Path]:
+    return [db, *db.parent.glob(f"{db.name}-*"), db.with_name(f"{db.name}.startup.lock")]
+
+
+def run_shards(args, shards: int) -> dict:
+    """Drive the write workload against a fresh copy of the dataset split into ``shards`` databases."""
+    run_db = DATA_DIR / f"run_{os.getpid()}.db"
+    shard_dbs = [DATA_DIR / f"run_{os.getpid()}_shard{index}.db" for index in range(shards)]
+    env = benchmark_env(
+        f"sqlite:///{run_db}",
+        SHARD_DATABASE_URLS=json.dumps([f"sqlite:///{path}" for path in shard_dbs]),
+        BENCH_COMMIT_LATENCY_MS=str(args.commit_latency_ms),
+    )
+    seeded = build_dataset(args.patients, args.observations, args.medications, seed=args.seed)
+    run_db.write_bytes(seeded.read_bytes())
+    patient_ids = sample_patient_ids(run_db, seed=args.seed)
+    try:
+        if shards:
+            subprocess.run(
+                [sys.executable, "-m", "app.sharding", "rebalance"],
+                cwd=BACKEND_DIR,
+                env=env,
+                check=True,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        return asyncio.run(run_uvicorn(args, patient_ids, env, app="benchmarks.commit_latency:app"))
+    finally:
+        for db in (run_db, *shard_dbs):
+            for path in _database_files(db):
+                path.unlink(missing_ok=True)
+
+
+def main() -> None:
+    parser = build_parser()
+    parser.description = __doc__
+    parser.set_defaults(mode="uvicorn", concurrency=32, mix="POST /Observation=100")
+    parser.add_argument("--shards", type=int, nargs="+", default=[0, 2, 4], help="Shard counts to compare (0: unsharded)")
+    parser.add_argument("--workers", type=int, default=4, help=f"uvicorn worker processes (CPUs: {os.cpu_count()})")
+    parser.add_argument(
+        "--commit-latency-ms", type=float, default=0.0, help="Storage flush delay added to every write commit"
+    )
+    parser.add_argument("--output", type=Path, help="Write JSON results here (default: stdout only)")
+    args = parser.parse_args()
+    # Settings are read on first import of app.config, which seeding may trigger.
+    os.environ.setdefault("SECRET_SALT", BENCH_SECRET_SALT)
+
+    runs = []
+    for shards in args.shards:
+        results = run_shards(args, shards)
+        runs.append({"shards": shards, "total": results["total"]})
+
+    baseline = runs[0]["total"]["throughput_rps"] or 1.0
+    print(f"{'shards':>6} {'writes/s':>10} {'speed-up':>9} {'p95 ms':>9} {'errors':>7}")
+    for run in runs:
+        total = run["total"]
+        print(
+            f"{run['shards']:>6} {total['throughput_rps']:>10.1f} {total['throughput_rps'] / baseline:>8.2f}x "
+            f"{total['p95_ms']:>9.1f} {total['errors']:>7}"
+        )
+
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        meta = {
+            "patients": args.patients,
+            "workers": args.workers,
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "commit_latency_ms": args.commit_latency_ms,
+            "cpus": os.cpu_count(),
+        }
+        args.output.write_text(json.dumps({"meta": meta, "runs": runs}, indent=2) + "\n", encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+﻿"""Throughput of the EPR API as uvicorn worker processes are added.
+
+Runs the api_load workload in uvicorn mode once per worker count against
+the same dataset and reports requests/second, p95 latency, errors and the
+speed-up over the first worker count. Errors on POST /Observation would
+indicate SQLite write-lock contention between workers.
+
+Usage (from backend/):
+    python -m benchmarks.worker_scaling --workers 1 2 4 --patients 10000 --concurrency 32
+
+Requires httpx. Speed-up is bounded by the number of CPU cores available.
+"""
+import json
+import os
+from pathlib import Path
+
+from benchmarks.api_load import build_parser, run_benchmark
+
+
+def main() -> None:
+    parser = build_parser()
+    parser.description = __doc__
+    parser.set_defaults(mode="uvicorn", concurrency=32)
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=[1, 2, 4], help=f"Worker counts to compare (CPUs: {os.cpu_count()})"
+    )
+    parser.add_argument("--output", type=Path, help="Write JSON results here (default: stdout only)")
+    args = parser.parse_args()
+
+    worker_counts = args.workers
+    runs = []
+    for workers in worker_counts:
+        args.workers = workers
+        report = run_benchmark(args)
+        runs.append({"workers": workers, "total": report["total"], "endpoints": report["endpoints"]})
+
+    baseline = runs[0]["total"]["throughput_rps"] or 1.0
+    print(f"{'workers':>7} {'req/s':>10} {'speed-up':>9} {'p95 ms':>9} {'errors':>7}")
+    for run in runs:
+        total = run["total"]
+        print(
+            f"{run['workers']:>7} {total['throughput_rps']:>10.1f} {total['throughput_rps'] / baseline:>8.2f}x "
+            f"{total['p95_ms']:>9.1f} {total['errors']:>7}"
+        )
+
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        meta = {**report["meta"], "workers": worker_counts}
+        args.output.write_text(json.dumps({"meta": meta, "runs": runs}, indent=2) + "\n", encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
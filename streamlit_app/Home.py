@@ -8,6 +8,15 @@ from app.api_client import EPRClientError, UnauthorizedError
 from app.session import get_known_patients, init_session_state, logout, require_auth
 
 
+@st.cache_data(ttl=30, show_spinner=False)
+def api_status(base_url: str) -> dict:
+    """API health, cached per backend URL so page renders do not each hit the API."""
+    try:
+        return {"ok": True, **st.session_state.api_client.health_check()}
+    except EPRClientError as exc:
+        return {"ok": False, "error": str(exc)}
+
+
 st.set_page_config(page_title="NHS Mock EPR", page_icon="🏥", layout="wide")
 init_session_state()
 require_auth()
@@ -29,9 +38,12 @@ known_patients = get_known_patients()
 today_tests = 0
 if st.session_state.selected_patient:
     try:
-        observations = client.get_observations(st.session_state.selected_patient["id"])
         today_key = date.today().isoformat()
-        today_tests = sum(1 for obs in observations if str(obs.get("performed_date", "")).startswith(today_key))
+        today_tests = client.count_observations(
+            st.session_state.selected_patient["id"],
+            from_date=f"{today_key}T00:00:00",
+            to_date=f"{today_key}T23:59:59.999999",
+        )
     except (UnauthorizedError, EPRClientError):
         today_tests = 0
 
@@ -59,12 +71,12 @@ else:
     st.info("No activity yet in this session.")
 
 st.subheader("System Status")
-try:
-    health = client.health_check()
+health = api_status(client.base_url)
+if health["ok"]:
     st.success(
         f"Connected to EPR API: {health.get('status', 'unknown')} "
         f"(v{health.get('version', 'n/a')} - {health.get('response_ms', 0)} ms)"
     )
-except EPRClientError as exc:
-    st.error(f"API status check failed: {exc}")
+else:
+    st.error(f"API status check failed: {health['error']}")
 
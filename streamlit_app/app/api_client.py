@@ -1,8 +1,13 @@
 from __future__ import annotations
 
+import json
+import math
+import threading
 import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional
 
 import requests
 
@@ -19,15 +24,86 @@ class NotFoundError(EPRClientError):
     """Raised when a resource is not found."""
 
 
+class RateLimitedError(EPRClientError):
+    """Raised when the API keeps answering 429; ``retry_after`` is its last requested wait in seconds."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
 class EPRClient:
+    # Renew the access token this many seconds before it expires.
+    REFRESH_MARGIN_SECONDS = 60
+    # Waits asked for by Retry-After up to this long are slept through before retrying; longer ones are reported.
+    MAX_RETRY_AFTER_SECONDS = 10
+
     def __init__(self, base_url: str, timeout: int = 20):
         self.base_url = base_url.rstrip("/")
         self.timeout = timeout
         self.token: Optional[str] = None
+        self.refresh_token: Optional[str] = None
+        self.token_expires_at: Optional[float] = None
         self.session = requests.Session()
+        self._refresh_lock = threading.Lock()
 
-    def set_token(self, token: Optional[str]) -> None:
+    def set_token(
+        self,
+        token: Optional[str],
+        refresh_token: Optional[str] = None,
+        expires_in: Optional[int] = None,
+    ) -> None:
         self.token = token
+        self.refresh_token = refresh_token if token else None
+        self.token_expires_at = time.monotonic() + expires_in if token and expires_in else None
+
+    def _token_due_for_refresh(self) -> bool:
+        if not self.refresh_token or self.token_expires_at is None:
+            return False
+        return time.monotonic() >= self.token_expires_at - self.REFRESH_MARGIN_SECONDS
+
+    def _refresh_access_token(self, stale_token: Optional[str] = None) -> bool:
+        """Exchange the refresh token for a new token pair; safe to call from several threads."""
+        with self._refresh_lock:
+            if self.token != stale_token and not self._token_due_for_refresh():
+                # Another thread renewed the token while we waited for the lock.
+                return True
+            if not self.refresh_token:
+                return False
+            try:
+                resp = self.session.post(
+                    f"{self.base_url}/oauth/token",
+                    headers={"Accept": "application/json"},
+                    data={"grant_type": "refresh_token", "refresh_token": self.refresh_token},
+                    timeout=self.timeout,
+                )
+            except requests.RequestException:
+                return False
+            if resp.status_code != 200:
+                # The refresh token is no longer accepted; fall back to a fresh login.
+                self.refresh_token = None
+                return False
+            body = resp.json()
+            self.set_token(body["access_token"], body.get("refresh_token"), body.get("expires_in"))
+            return True
+
+    @staticmethod
+    def _retry_after(resp: requests.Response) -> Optional[float]:
+        """Seconds the response's Retry-After header asks for (delay or HTTP date), if it has one."""
+        value = resp.headers.get("Retry-After", "").strip()
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            when = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+        return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
 
     def _headers(self) -> Dict[str, str]:
         headers = {"Accept": "application/json"}
@@ -45,13 +121,18 @@ class EPRClient:
         data: Optional[Dict[str, Any]] = None,
         auth_required: bool = True,
         retries: int = 2,
+        stream: bool = False,
     ) -> requests.Response:
         url = f"{self.base_url}{path}"
+        if auth_required and self._token_due_for_refresh():
+            self._refresh_access_token(self.token)
         if auth_required and not self.token:
             raise UnauthorizedError("Session expired. Please log in again.")
 
         attempt = 0
+        refreshed = False
         while True:
+            sent_token = self.token
             try:
                 resp = self.session.request(
                     method=method,
@@ -61,6 +142,7 @@ class EPRClient:
                     json=json,
                     data=data,
                     timeout=self.timeout,
+                    stream=stream,
                 )
             except requests.RequestException as exc:
                 if attempt < retries:
@@ -70,14 +152,23 @@ class EPRClient:
                 raise EPRClientError("Could not connect to EPR API. Please try again.") from exc
 
             if resp.status_code == 401:
+                if auth_required and not refreshed and self._refresh_access_token(sent_token):
+                    refreshed = True
+                    continue
                 raise UnauthorizedError("Your session is no longer valid. Please log in again.")
             if resp.status_code == 404:
                 raise NotFoundError("Requested record was not found.")
-            if resp.status_code >= 500:
-                if attempt < retries:
+            if resp.status_code == 429 or resp.status_code >= 500:
+                # A 429 was refused before doing anything, so even writes are safe to repeat.
+                wait = self._retry_after(resp)
+                if attempt < retries and (wait is None or wait <= self.MAX_RETRY_AFTER_SECONDS):
                     attempt += 1
-                    time.sleep(0.5 * attempt)
+                    resp.close()
+                    time.sleep(0.5 * attempt if wait is None else wait)
                     continue
+                if resp.status_code == 429:
+                    seconds = math.ceil(wait) if wait is not None else 1
+                    raise RateLimitedError(f"The EPR API is busy. Please retry in {seconds} s.", wait)
                 raise EPRClientError("EPR server error. Please retry in a moment.")
             if resp.status_code >= 400:
                 detail = ""
@@ -99,7 +190,7 @@ class EPRClient:
         )
         token_body = token_resp.json()
         access_token = token_body["access_token"]
-        self.set_token(access_token)
+        self.set_token(access_token, token_body.get("refresh_token"), token_body.get("expires_in"))
 
         user_resp = self._request("GET", "/oauth/userinfo")
         user = user_resp.json()
@@ -109,14 +200,96 @@ class EPRClient:
         resp = self._request("GET", "/Patient", params={"identifier": nhs_number})
         return resp.json()
 
+    def search_patients(self, pseudonym: str, after: Optional[str] = None, limit: int = 50) -> Dict[str, Any]:
+        params: Dict[str, Any] = {"pseudonym": pseudonym, "limit": limit}
+        if after:
+            params["after"] = after
+        resp = self._request("GET", "/Patient/search", params=params)
+        return resp.json()
+
+    def search_medications(
+        self, drug: str, active: bool = False, after: Optional[str] = None, limit: int = 50
+    ) -> Dict[str, Any]:
+        params: Dict[str, Any] = {"drug": drug, "limit": limit}
+        if active:
+            params["active"] = "true"
+        if after:
+            params["after"] = after
+        resp = self._request("GET", "/MedicationRequest/search", params=params)
+        return resp.json()
+
     def create_patient(self, nhs_number: str, sex: str, age_band: str) -> Dict[str, Any]:
         resp = self._request("POST", "/Patient", json={"nhs_number": nhs_number, "sex": sex, "age_band": age_band})
         return resp.json()
 
-    def get_observations(self, patient_id: str) -> List[Dict[str, Any]]:
-        resp = self._request("GET", "/Observation", params={"patient": patient_id})
+    def get_observations(
+        self,
+        patient_id: str,
+        from_date: Optional[str] = None,
+        to_date: Optional[str] = None,
+        elements: Optional[List[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """A patient's observations; with ``elements``, only those fields (and ``id``) of each."""
+        params: Dict[str, Any] = {"patient": patient_id}
+        if from_date:
+            params["from_date"] = from_date
+        if to_date:
+            params["to_date"] = to_date
+        if elements:
+            params["_elements"] = ",".join(elements)
+        resp = self._request("GET", "/Observation", params=params)
+        return resp.json()
+
+    def count_observations(
+        self, patient_id: str, from_date: Optional[str] = None, to_date: Optional[str] = None
+    ) -> int:
+        params: Dict[str, Any] = {"patient": patient_id, "_summary": "count"}
+        if from_date:
+            params["from_date"] = from_date
+        if to_date:
+            params["to_date"] = to_date
+        resp = self._request("GET", "/Observation", params=params)
+        return resp.json()["total"]
+
+    def get_observation_series(
+        self,
+        patient_id: str,
+        test_type: str,
+        from_date: Optional[str] = None,
+        to_date: Optional[str] = None,
+        points: int = 200,
+        method: str = "lttb",
+    ) -> Dict[str, Any]:
+        params: Dict[str, Any] = {"patient": patient_id, "type": test_type, "points": points, "method": method}
+        if from_date:
+            params["from_date"] = from_date
+        if to_date:
+            params["to_date"] = to_date
+        resp = self._request("GET", "/Observation/series", params=params)
         return resp.json()
 
+    def stream_observations(
+        self, patient_id: Optional[str] = None, interpretation: Optional[str] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """Yield server-sent events (``{"event": ..., "data": ...}``), starting with ``open``, until the connection closes."""
+        params = {"patient": patient_id, "interpretation": interpretation}
+        params = {key: value for key, value in params.items() if value}
+        resp = self._request("GET", "/Observation/stream", params=params, retries=0, stream=True)
+        with resp:
+            yield {"event": "open", "data": None}
+            event, data = "message", []
+            for line in resp.iter_lines(decode_unicode=True):
+                if line is None or line.startswith(":"):
+                    continue
+                if not line:
+                    if data:
+                        yield {"event": event, "data": json.loads("\n".join(data))}
+                    event, data = "message", []
+                elif line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:"):
+                    data.append(line[5:].strip())
+
     def create_observation(
         self,
         patient_id: str,
@@ -137,10 +310,17 @@ class EPRClient:
         resp = self._request("POST", "/Observation", json=payload)
         return resp.json()
 
-    def get_medications(self, patient_id: str) -> List[Dict[str, Any]]:
-        resp = self._request("GET", "/MedicationRequest", params={"patient": patient_id})
+    def get_medications(self, patient_id: str, elements: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        params: Dict[str, Any] = {"patient": patient_id}
+        if elements:
+            params["_elements"] = ",".join(elements)
+        resp = self._request("GET", "/MedicationRequest", params=params)
         return resp.json()
 
+    def count_medications(self, patient_id: str) -> int:
+        resp = self._request("GET", "/MedicationRequest", params={"patient": patient_id, "_summary": "count"})
+        return resp.json()["total"]
+
     def create_medication(
         self,
         patient_id: str,
@@ -166,15 +346,68 @@ class EPRClient:
         return resp.json()["id"]
 
     def download_csv(self, job_id: str, save_path: str) -> None:
-        resp = self._request("GET", f"/export/csv/{job_id}")
+        # Follows pre-signed storage redirects; requests drops the API token when the host changes.
+        resp = self._request("GET", f"/export/csv/{job_id}", stream=True)
         target = Path(save_path)
         target.parent.mkdir(parents=True, exist_ok=True)
-        target.write_bytes(resp.content)
+        with resp, target.open("wb") as f:
+            for chunk in resp.iter_content(chunk_size=64 * 1024):
+                f.write(chunk)
 
     def simulate_events(self, patient_id: str, count: int = 10) -> Dict[str, Any]:
         resp = self._request("POST", "/simulate/events", params={"patient_id": patient_id, "count": count})
         return resp.json()
 
+    def observation_counts(
+        self,
+        from_month: Optional[str] = None,
+        to_month: Optional[str] = None,
+        test_type: Optional[str] = None,
+        interpretation: Optional[str] = None,
+        drug_name: Optional[str] = None,
+        by_drug: bool = False,
+    ) -> List[Dict[str, Any]]:
+        params: Dict[str, Any] = {
+            "from_month": from_month,
+            "to_month": to_month,
+            "type": test_type,
+            "interpretation": interpretation,
+            "drug_name": drug_name,
+        }
+        params = {key: value for key, value in params.items() if value}
+        if by_drug:
+            params["by_drug"] = "true"
+        resp = self._request("GET", "/analytics/observations", params=params)
+        return resp.json()
+
+    def active_medication_counts(self, on_date: Optional[str] = None) -> List[Dict[str, Any]]:
+        params = {"on_date": on_date} if on_date else None
+        resp = self._request("GET", "/analytics/medications/active", params=params)
+        return resp.json()
+
+    def monitoring_due(
+        self,
+        test_type: Optional[str] = None,
+        interval_days: Optional[int] = None,
+        limit: int = 50,
+        offset: int = 0,
+    ) -> Dict[str, Any]:
+        params: Dict[str, Any] = {"limit": limit, "offset": offset}
+        if test_type:
+            params["type"] = test_type
+        if interval_days:
+            params["interval_days"] = interval_days
+        resp = self._request("GET", "/monitoring/due", params=params)
+        return resp.json()
+
+    def list_profiles(self) -> List[Dict[str, Any]]:
+        resp = self._request("GET", "/admin/profiles")
+        return resp.json()
+
+    def get_profile(self, profile_id: str) -> Dict[str, Any]:
+        resp = self._request("GET", f"/admin/profiles/{profile_id}")
+        return resp.json()
+
     def health_check(self) -> Dict[str, Any]:
         started = time.perf_counter()
         resp = self._request("GET", "/health", auth_required=False, retries=0)
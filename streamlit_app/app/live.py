@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import threading
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+import requests
+
+from app.api_client import EPRClient, EPRClientError, RateLimitedError
+
+
+class ObservationFeed:
+    """Background subscription to the backend observation stream.
+
+    Events are kept in a small ring buffer that pages read on each rerun, so
+    the page only re-queries the API when the stream says something changed.
+    """
+
+    RECONNECT_SECONDS = 3
+
+    def __init__(
+        self,
+        client: EPRClient,
+        patient_id: Optional[str] = None,
+        interpretation: Optional[str] = None,
+        max_events: int = 50,
+    ):
+        self.client = client
+        self.patient_id = patient_id
+        self.interpretation = interpretation
+        self.events: deque = deque(maxlen=max_events)
+        self.version = 0
+        self.connected = False
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        reconnecting = False
+        while not self._stopped.is_set():
+            delay = self.RECONNECT_SECONDS
+            try:
+                for message in self.client.stream_observations(self.patient_id, self.interpretation):
+                    if self._stopped.is_set():
+                        return
+                    if message["event"] == "open":
+                        self.connected = True
+                        if not reconnecting:
+                            continue
+                    elif message["event"] == "observation":
+                        self.events.appendleft(message["data"])
+                    # A reconnect or a "dropped" event means results may have been missed; bumping
+                    # the version makes the page re-query.
+                    self.version += 1
+            except RateLimitedError as exc:
+                delay = max(delay, exc.retry_after or 0)
+            except (EPRClientError, requests.RequestException, ValueError):
+                # API unavailable, connection reset or read timeout; reconnect below.
+                pass
+            self.connected = False
+            reconnecting = True
+            self._stopped.wait(delay)
+
+    def recent(self) -> List[Dict[str, Any]]:
+        return list(self.events)
+
+    def is_alive(self) -> bool:
+        return self._thread.is_alive()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+
+def get_feed(state: Any, client: EPRClient, patient_id: Optional[str] = None, interpretation: Optional[str] = None):
+    """One feed per Streamlit session and filter, replacing a feed for a different filter."""
+    key = (patient_id, interpretation)
+    feed = state.get("observation_feed")
+    if feed is not None and (feed.patient_id, feed.interpretation) == key and feed.is_alive():
+        return feed
+    if feed is not None:
+        feed.stop()
+    feed = ObservationFeed(client, patient_id, interpretation)
+    state["observation_feed"] = feed
+    return feed
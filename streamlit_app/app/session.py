@@ -29,7 +29,12 @@ def init_session_state() -> None:
         base_url = os.getenv("API_BASE_URL", "http://127.0.0.1:8000")
         st.session_state.api_client = EPRClient(base_url=base_url)
 
-    st.session_state.api_client.set_token(st.session_state.token)
+    client = st.session_state.api_client
+    if st.session_state.token and client.token:
+        # The client renews its token in place; keep the session copy in step.
+        st.session_state.token = client.token
+    else:
+        client.set_token(st.session_state.token)
 
 
 def is_authenticated() -> bool:
@@ -2,12 +2,15 @@ from __future__ import annotations
 
 import re
 
+import pandas as pd
 import streamlit as st
 
 from app.api_client import EPRClientError, NotFoundError, UnauthorizedError
 from app.session import add_activity, init_session_state, remember_patient, require_auth
 
 
+PAGE_SIZE = 25
+
 st.set_page_config(page_title="Patient Lookup", page_icon="🔍", layout="wide")
 init_session_state()
 require_auth()
@@ -43,6 +46,86 @@ if search:
             except EPRClientError as exc:
                 st.error(str(exc))
 
+st.divider()
+by_pseudonym, by_drug = st.tabs(["Find by pseudonym", "Find patients on a drug"])
+
+with by_pseudonym:
+    with st.form("pseudonym_search"):
+        prefix = st.text_input("Pseudonym starts with", placeholder="PAT-0001")
+        find = st.form_submit_button("Find")
+    if find and prefix.strip():
+        try:
+            st.session_state.pseudonym_results = client.search_patients(prefix.strip(), limit=PAGE_SIZE)
+        except EPRClientError as exc:
+            st.error(str(exc))
+    results = st.session_state.get("pseudonym_results")
+    if results and results["items"]:
+        by_name = {p["pseudonym"]: p for p in results["items"]}
+        choice = st.selectbox("Matching patients", options=list(by_name))
+        if results["next_after"]:
+            st.caption(f"Showing the first {PAGE_SIZE} matches; type more of the pseudonym to narrow them.")
+        if st.button("Open patient", key="open_pseudonym_match"):
+            remember_patient(by_name[choice])
+            add_activity(f"{choice}: Patient record opened")
+            st.rerun()
+    elif results:
+        st.info("No patients match that pseudonym.")
+
+with by_drug:
+    with st.form("drug_search"):
+        d1, d2 = st.columns([3, 1])
+        drug = d1.text_input("Drug name", placeholder="Clozapine", help="Part of a name or a misspelling also works.")
+        active_only = d2.checkbox("Current prescriptions only", value=True)
+        find_drug = st.form_submit_button("Find")
+    if find_drug and drug.strip():
+        # Cursors of the pages seen so far, for "Previous".
+        st.session_state.drug_search = {"drug": drug.strip(), "active": active_only, "cursors": [None]}
+    drug_search = st.session_state.get("drug_search")
+    if drug_search:
+        try:
+            page = client.search_medications(
+                drug_search["drug"], drug_search["active"], drug_search["cursors"][-1], limit=PAGE_SIZE
+            )
+        except EPRClientError as exc:
+            st.error(str(exc))
+            page = None
+        if page and page["items"]:
+            st.caption("Matching drugs: " + ", ".join(page["drug_names"]))
+            df = pd.DataFrame(page["items"])[["pseudonym", "drug_name", "dose", "start_date", "stop_date"]]
+            df["start_date"] = df["start_date"].str[:10]
+            df["stop_date"] = df["stop_date"].str[:10]
+            st.dataframe(
+                df.rename(
+                    columns={
+                        "pseudonym": "Patient",
+                        "drug_name": "Drug",
+                        "dose": "Dose",
+                        "start_date": "Started",
+                        "stop_date": "Stopped",
+                    }
+                ),
+                hide_index=True,
+                use_container_width=True,
+            )
+            prev_col, open_col, next_col = st.columns([1, 3, 1])
+            if prev_col.button("← Previous", disabled=len(drug_search["cursors"]) == 1):
+                drug_search["cursors"].pop()
+                st.rerun()
+            if next_col.button("Next →", disabled=page["next_after"] is None):
+                drug_search["cursors"].append(page["next_after"])
+                st.rerun()
+            choice = open_col.selectbox("Open patient", options=sorted({item["pseudonym"] for item in page["items"]}))
+            if open_col.button("Open patient", key="open_drug_match"):
+                try:
+                    match = client.search_patients(choice, limit=1)["items"][0]
+                    remember_patient(match)
+                    add_activity(f"{choice}: Patient record opened")
+                    st.rerun()
+                except (EPRClientError, IndexError) as exc:
+                    st.error(f"Unable to open {choice}: {exc}")
+        elif page:
+            st.info("No prescriptions match that drug name.")
+
 patient = found_patient or st.session_state.selected_patient
 if patient:
     st.subheader("Patient Summary")
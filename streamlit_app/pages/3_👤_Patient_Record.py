@@ -1,14 +1,21 @@
 from __future__ import annotations
 
-from datetime import date
+from datetime import date, timedelta
 
 import pandas as pd
 import streamlit as st
 
 from app.api_client import EPRClientError, UnauthorizedError
+from app.live import get_feed
 from app.session import add_activity, init_session_state, require_auth
 
 
+TREND_TESTS = ["Weight", "HbA1c"]
+TREND_RANGES = {"1 year": 365, "3 years": 3 * 365, "5 years": 5 * 365, "All": None}
+TREND_POINTS = 200
+RECENT_RESULTS_DAYS = 365
+LIVE_REFRESH_SECONDS = 2
+
 st.set_page_config(page_title="Patient Record", page_icon="👤", layout="wide")
 init_session_state()
 require_auth()
@@ -29,9 +36,32 @@ demo2.metric("Age Band", patient["age_band"])
 demo3.metric("Sex", patient["sex"])
 demo4.metric("Registered", str(patient["created_at"])[:10])
 
+# New results arrive over the observation stream; the record is only re-queried when it reports a change.
+feed = get_feed(st.session_state, client, patient_id=patient["id"])
+st.session_state.record_feed_version = feed.version
+
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+def live_results() -> None:
+    if feed.version != st.session_state.record_feed_version:
+        st.rerun(scope="app")
+    critical = [o for o in feed.recent() if o["interpretation"] == "CRITICAL"]
+    for o in critical[:3]:
+        st.error(
+            f"🔴 New CRITICAL {o['type']}: {o['value']} {o['unit']} "
+            f"(performed {str(o['performed_date'])[:10]}, recorded {str(o['created_at'])[11:16]} UTC)"
+        )
+    st.caption("🟢 Live updates on" if feed.connected else "⚪ Live updates reconnecting…")
+
+
+live_results()
+
 try:
     meds = client.get_medications(patient["id"])
-    obs = client.get_observations(patient["id"])
+    # Recent results come from the hot table; the full history also reads archived results.
+    full_history = st.session_state.get("record_full_history", False)
+    recent_from = (date.today() - timedelta(days=RECENT_RESULTS_DAYS)).isoformat()
+    obs = client.get_observations(patient["id"], from_date=None if full_history else recent_from)
 except UnauthorizedError:
     st.warning("Session expired. Please log in again.")
     st.switch_page("pages/1_🔐_Login.py")
@@ -40,7 +70,7 @@ except EPRClientError as exc:
     st.error(f"Unable to load record: {exc}")
     st.stop()
 
-tabs = st.tabs(["💊 Medications", "📊 Test Results"])
+tabs = st.tabs(["💊 Medications", "📊 Test Results", "📈 Trends"])
 
 with tabs[0]:
     if meds:
@@ -63,6 +93,7 @@ with tabs[0]:
         st.info("No medications recorded for this patient.")
 
 with tabs[1]:
+    st.toggle(f"Include results older than {RECENT_RESULTS_DAYS} days", key="record_full_history")
     if obs:
         flag = {"NORMAL": "🟢 NORMAL", "ABNORMAL": "🟠 ABNORMAL", "CRITICAL": "🔴 CRITICAL"}
         obs_rows = [
@@ -78,7 +109,32 @@ with tabs[1]:
         df = pd.DataFrame(obs_rows).sort_values("Date", ascending=False)
         st.dataframe(df, use_container_width=True, hide_index=True)
     else:
-        st.info("No observations recorded for this patient.")
+        st.info("No observations recorded for this patient in this range.")
+
+with tabs[2]:
+    range_label = st.radio("Range", options=list(TREND_RANGES), index=1, horizontal=True)
+    days = TREND_RANGES[range_label]
+    from_date = (date.today() - timedelta(days=days)).isoformat() if days else None
+    trend_cols = st.columns(len(TREND_TESTS))
+    for col, test_type in zip(trend_cols, TREND_TESTS):
+        with col:
+            try:
+                trend = client.get_observation_series(
+                    patient["id"], test_type, from_date=from_date, points=TREND_POINTS
+                )
+            except EPRClientError as exc:
+                st.error(f"Unable to load {test_type} trend: {exc}")
+                continue
+            unit = f" ({trend['unit']})" if trend.get("unit") else ""
+            st.markdown(f"**{test_type}{unit}**")
+            if not trend["points"]:
+                st.info(f"No {test_type} results in this range.")
+                continue
+            df_trend = pd.DataFrame(trend["points"])
+            df_trend["performed_date"] = pd.to_datetime(df_trend["performed_date"])
+            st.line_chart(df_trend.set_index("performed_date")[["value"]].rename(columns={"value": test_type}))
+            if trend["method"] != "raw":
+                st.caption(f"{len(trend['points'])} of {trend['total']} results shown ({trend['method']} downsampling).")
 
 b1, b2, b3, b4 = st.columns(4)
 if b1.button("➕ Add Test", use_container_width=True):
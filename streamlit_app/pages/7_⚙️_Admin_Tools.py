@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import pandas as pd
 import streamlit as st
 
 from app.api_client import EPRClientError
@@ -56,6 +57,56 @@ if st.button("Test Connection"):
     except EPRClientError as exc:
         st.error(f"Connection failed: {exc}")
 
+st.divider()
+st.subheader("⏱️ Request Profiles")
+st.caption(
+    "Send `X-EPR-Profile: 1` (or `?_profile=1`) with an admin token to profile a single request "
+    "on the API worker that serves it."
+)
+try:
+    profiles = client.list_profiles()
+except EPRClientError as exc:
+    profiles = []
+    st.error(f"Unable to load profiles: {exc}")
+
+if profiles:
+    st.dataframe(
+        pd.DataFrame(
+            [
+                {
+                    "ID": p["id"],
+                    "Request": f"{p['method']} {p['path']}",
+                    "Status": p["status"],
+                    "User": p["username"],
+                    "Started": str(p["started_at"])[:19],
+                    "Duration (ms)": p["duration_ms"],
+                    "SQL": p["sql_count"],
+                    "SQL (ms)": p["sql_ms"],
+                }
+                for p in profiles
+            ]
+        ),
+        use_container_width=True,
+        hide_index=True,
+    )
+    profile_id = st.selectbox("Profile", options=[p["id"] for p in profiles])
+    try:
+        profile = client.get_profile(profile_id)
+        st.write(f"{profile['samples']} samples every {profile['sample_interval_ms']} ms")
+        st.dataframe(pd.DataFrame(profile["top_functions"]), use_container_width=True, hide_index=True)
+        if profile["sql"]:
+            st.dataframe(pd.DataFrame(profile["sql"]), use_container_width=True, hide_index=True)
+        st.download_button(
+            label="Download collapsed stacks (flame graph)",
+            data="\n".join(profile["collapsed"]),
+            file_name=f"profile_{profile_id}.folded",
+            mime="text/plain",
+        )
+    except EPRClientError as exc:
+        st.error(str(exc))
+else:
+    st.info("No request profiles captured yet.")
+
 st.divider()
 st.subheader("📊 System Statistics")
 total_patients = len(known_patients)
@@ -64,8 +115,8 @@ total_observations = 0
 total_medications = 0
 if selected:
     try:
-        total_observations = len(client.get_observations(selected["id"]))
-        total_medications = len(client.get_medications(selected["id"]))
+        total_observations = client.count_observations(selected["id"])
+        total_medications = client.count_medications(selected["id"])
     except EPRClientError:
         pass
 
@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+from datetime import date
+
+import pandas as pd
+import streamlit as st
+
+from app.api_client import EPRClientError, UnauthorizedError
+from app.session import init_session_state, require_auth
+
+
+TEST_TYPES = ["HbA1c", "Weight", "ECG", "FBC", "LFT"]
+INTERPRETATIONS = ["NORMAL", "ABNORMAL", "CRITICAL"]
+
+st.set_page_config(page_title="Cohort Analytics", page_icon="📈", layout="wide")
+init_session_state()
+require_auth()
+
+client = st.session_state.api_client
+st.title("📈 Cohort Analytics")
+st.caption("Population counts served from pre-aggregated summary tables; no patient-level data is shown.")
+
+today = date.today()
+col1, col2, col3, col4 = st.columns(4)
+from_month = col1.text_input("From month (YYYY-MM)", value=f"{today.year - 1}-{today.month:02d}")
+to_month = col2.text_input("To month (YYYY-MM)", value=f"{today.year}-{today.month:02d}")
+test_type = col3.selectbox("Test type", options=["All", *TEST_TYPES])
+interpretation = col4.selectbox("Interpretation", options=["All", *INTERPRETATIONS])
+by_drug = st.checkbox("Break down by medication the patient was on")
+
+try:
+    counts = client.observation_counts(
+        from_month=from_month or None,
+        to_month=to_month or None,
+        test_type=None if test_type == "All" else test_type,
+        interpretation=None if interpretation == "All" else interpretation,
+        by_drug=by_drug,
+    )
+    active = client.active_medication_counts()
+except UnauthorizedError:
+    st.warning("Session expired. Please log in again.")
+    st.switch_page("pages/1_🔐_Login.py")
+    st.stop()
+except EPRClientError as exc:
+    st.error(f"Unable to load analytics: {exc}")
+    st.stop()
+
+st.subheader("Observations per Month")
+if counts:
+    df = pd.DataFrame(counts)
+    index = ["drug_name", "month"] if by_drug else ["month"]
+    pivot = df.pivot_table(index=index, columns=["type", "interpretation"], values="count", aggfunc="sum", fill_value=0)
+    st.dataframe(pivot, use_container_width=True)
+    if not by_drug:
+        st.bar_chart(df.groupby(["month", "interpretation"])["count"].sum().unstack(fill_value=0))
+else:
+    st.info("No observations match these filters.")
+
+st.subheader("Active Medications Today")
+if active:
+    df_active = pd.DataFrame(active).rename(columns={"drug_name": "Drug", "active": "Active prescriptions"})
+    st.dataframe(df_active, hide_index=True, use_container_width=True)
+else:
+    st.info("No active medications.")
@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import pandas as pd
+import streamlit as st
+
+from app.api_client import EPRClientError, UnauthorizedError
+from app.session import init_session_state, require_auth
+
+
+TEST_TYPES = ["HbA1c", "Weight", "ECG", "FBC", "LFT"]
+PAGE_SIZE = 50
+
+st.set_page_config(page_title="Monitoring Due", page_icon="⏰", layout="wide")
+init_session_state()
+require_auth()
+
+client = st.session_state.api_client
+st.title("⏰ Monitoring Due")
+st.caption("Patients overdue for a monitoring test, or on a monitored antipsychotic with no baseline result.")
+
+col1, col2 = st.columns(2)
+test_type = col1.selectbox("Test type", options=["All", *TEST_TYPES])
+interval_days = col2.number_input("Interval override (days, 0 = configured)", min_value=0, value=0, step=30)
+
+filters = (test_type, interval_days)
+if st.session_state.get("monitoring_due_filters") != filters:
+    st.session_state.monitoring_due_filters = filters
+    st.session_state.monitoring_due_offset = 0
+offset = st.session_state.get("monitoring_due_offset", 0)
+
+try:
+    page = client.monitoring_due(
+        test_type=None if test_type == "All" else test_type,
+        interval_days=interval_days or None,
+        limit=PAGE_SIZE,
+        offset=offset,
+    )
+except UnauthorizedError:
+    st.warning("Session expired. Please log in again.")
+    st.switch_page("pages/1_🔐_Login.py")
+    st.stop()
+except EPRClientError as exc:
+    st.error(f"Unable to load the due-list: {exc}")
+    st.stop()
+
+st.caption("Intervals: " + ", ".join(f"{name} {days} days" for name, days in page["intervals"].items()))
+
+if page["items"]:
+    df = pd.DataFrame(page["items"]).rename(
+        columns={
+            "pseudonym": "Patient",
+            "type": "Test",
+            "status": "Status",
+            "last_performed_date": "Last performed",
+            "days_since": "Days since",
+        }
+    )
+    st.dataframe(df.drop(columns=["patient_id"]), hide_index=True, use_container_width=True)
+else:
+    st.success("Nobody is due for monitoring.")
+
+prev_col, info_col, next_col = st.columns([1, 3, 1])
+if prev_col.button("← Previous", disabled=offset == 0):
+    st.session_state.monitoring_due_offset = max(0, offset - PAGE_SIZE)
+    st.rerun()
+info_col.caption(f"Showing {offset + 1 if page['items'] else 0}–{offset + len(page['items'])}")
+if next_col.button("Next →", disabled=page["next_offset"] is None):
+    st.session_state.monitoring_due_offset = page["next_offset"]
+    st.rerun()